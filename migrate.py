@@ -0,0 +1,40 @@
+"""
+Aplica as migrações do schema fora do startup da API.
+
+O startup (db.initialize) aplica só as migrações online. As marcadas como
+offline (cópia da tabela inteira: particionamento de chat_session_message
+e do webhook) travam escritas enquanto rodam e ficam para este script, numa
+janela de manutenção com a API parada. Suba a API de novo depois, para ela
+passar a usar o schema novo.
+
+Uso: python migrate.py [--offline]
+"""
+import sys
+import argparse
+from src.db.storage import db
+from src.db.migrations import schema_state
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Aplica as migrações pendentes do schema")
+    parser.add_argument(
+        "--offline", action="store_true",
+        help="inclui as migrações offline (cópia de tabela inteira; rode com a API parada)"
+    )
+    args = parser.parse_args()
+
+    if not db.check_connection():
+        print("✗ Não foi possível conectar ao MySQL")
+        return 1
+    if not db.create_database() or not db.migrate(offline=args.offline):
+        print("✗ Erro ao aplicar migrações")
+        return 1
+
+    for migration in schema_state.pending_offline():
+        print(f"⚠ Migração {migration.version} pendente ({migration.description}): use --offline")
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,7 +8,19 @@ from src.routers.auth import router as auth_router
 from src.routers.contacts import router as contacts_router
 from src.routers.chat import router as chat_router
 from src.routers.ws import router as ws_router
+from src.routers.metrics import router as metrics_router
 from src.db.storage import db
+from src.db.async_storage import adb
+from src.utils.ingest_queue import ingest_queue, INGEST_MODE
+from src.utils.scheduler import scheduler
+from src.utils.session_sweeper import session_sweeper
+from src.utils.archiver import partition_archiver
+from src.utils.webhook_retention import webhook_pruner
+from src.utils.idempotency import processed_event_pruner
+from src.utils.fast_json import FastJSONResponse
+from src.utils.websocket_manager import manager
+from src.utils.chat_updates import chat_updates
+from src.utils.ws_heartbeat import ws_heartbeat
 
 # CORS
 from fastapi.middleware.cors import CORSMiddleware
@@ -20,9 +32,25 @@ async def lifespan(app: FastAPI):
     # Startup
     print("=" * 50)
     db.initialize()
+    if INGEST_MODE == "queue":
+        await ingest_queue.start()
+    scheduler.add(session_sweeper)
+    scheduler.add(partition_archiver)
+    scheduler.add(webhook_pruner)
+    scheduler.add(processed_event_pruner)
+    scheduler.add(ws_heartbeat)
+    scheduler.start()
+    await manager.start()
     print("=" * 50)
     yield
-    # Shutdown (se necessário no futuro)
+    # Shutdown
+    await scheduler.stop()
+    chat_updates.flush()
+    await manager.stop()
+    if ingest_queue.running:
+        await ingest_queue.stop()
+    db.close()
+    await adb.close()
     print("até dps, vlw flw...")
 
 app = FastAPI(
@@ -32,7 +60,8 @@ app = FastAPI(
     docs_url="/juk/docs",
     redoc_url="/juk/redoc",
     openapi_url=f"/juk/openapi.json",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # Configuração CORS
@@ -40,6 +69,7 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 # Ajustar CORS depois para produção, restringindo os domínios permitidos *.juk.re, *.imogo.com.br
 
@@ -52,6 +82,7 @@ app.include_router(auth_router)
 app.include_router(contacts_router)
 app.include_router(chat_router)
 app.include_router(ws_router)
+app.include_router(metrics_router)
 
 @app.get("/", tags=["Sistema"])
 def read_root():
@@ -59,5 +90,13 @@ def read_root():
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run("run:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "run:app", host="0.0.0.0", port=8000, reload=True,
+        # permessage-deflate nos WebSockets quando o cliente oferece (--ws-per-message-deflate na CLI)
+        ws_per_message_deflate=(os.getenv("WS_PER_MESSAGE_DEFLATE") or "true").lower() == "true",
+        # Ping do protocolo: derruba conexões meio-abertas (--ws-ping-interval/--ws-ping-timeout na CLI)
+        ws_ping_interval=float(os.getenv("WS_PROTOCOL_PING_INTERVAL") or 20),
+        ws_ping_timeout=float(os.getenv("WS_PROTOCOL_PING_TIMEOUT") or 20)
+    )
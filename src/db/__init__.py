@@ -1,3 +1,4 @@
 from .storage import db
+from .async_storage import adb
 
-__all__ = ['db']
\ No newline at end of file
+__all__ = ['db', 'adb']
\ No newline at end of file
@@ -0,0 +1,535 @@
+import os
+import gzip
+import heapq
+import json
+import zlib
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from src.db.partitions import add_months, partition_month
+
+load_dotenv()
+
+ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR") or "data/chat_archive"
+# Conversas já descompactadas que ficam em memória para leituras repetidas
+ARCHIVE_CACHE_SIZE = int(os.getenv("CHAT_ARCHIVE_CACHE_SIZE") or 64)
+# Índices de partição em memória (um por mês arquivado)
+ARCHIVE_INDEX_CACHE_SIZE = int(os.getenv("CHAT_ARCHIVE_INDEX_CACHE_SIZE") or 36)
+# Linhas a partir das quais o bloco fecha na próxima troca de conversa; uma
+# conversa maior que ARCHIVE_BLOCK_MAX_ROWS continua no bloco seguinte
+ARCHIVE_BLOCK_ROWS = 2000
+ARCHIVE_BLOCK_MAX_ROWS = 4 * ARCHIVE_BLOCK_ROWS
+
+ARCHIVE_FORMAT = "columnar-json-v2"
+DATETIME_COLUMNS = ("create_in", "updated_at", "expires_at")
+_DATA_SUFFIX = ".columns.gz"
+_INDEX_SUFFIX = ".index.json.gz"
+_GZIP = 31  # wbits do zlib para ler/escrever membros gzip
+# Sessão -> mês arquivado mais recente dela: registros de largura fixa
+# ordenados por session_id, lidos por busca binária sem carregar o arquivo
+_SESSIONS_FILE = "sessions.idx"
+_SESSION_ID_WIDTH = 36
+_SESSION_RECORD = _SESSION_ID_WIDTH + 16 + 1
+# Intervalo máximo entre duas mensagens da mesma sessão (expires_at = create_in + 24h)
+SESSION_WINDOW = timedelta(hours=24)
+
+
+def _cursor_key(values: Optional[Sequence[Any]]) -> Optional[Tuple[datetime, int]]:
+    """Converte as chaves do cursor da linha do tempo ([create_in, id])"""
+    if not values:
+        return None
+    created = values[0]
+    if not isinstance(created, datetime):
+        created = datetime.fromisoformat(str(created))
+    return created, int(values[1])
+
+
+class _BlockWriter:
+    """
+    Escreve o arquivo como uma sequência de membros gzip independentes, cada
+    um com um bloco colunar ({"rows": n, "data": {coluna: [valores]}}).
+    Só o bloco atual fica em memória.
+    """
+
+    def __init__(self, file: BinaryIO, columns: List[str], encode):
+        self.file = file
+        self.columns = columns
+        self.encode = encode
+        self.offset = 0
+        self.rows = 0
+        self._data: List[List[Any]] = [[] for _ in columns]
+
+    def write(self, row: Sequence[Any]) -> None:
+        for values, value in zip(self._data, row):
+            values.append(value)
+        self.rows += 1
+
+    def close(self) -> Optional[List[int]]:
+        """Grava o bloco atual; retorna [offset, tamanho compactado] ou None se vazio"""
+        if not self.rows:
+            return None
+        block = {"rows": self.rows, "data": dict(zip(self.columns, self._data))}
+        raw = json.dumps(block, separators=(",", ":"), default=self.encode).encode("utf-8")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP)
+        self.file.write(compressor.compress(raw) + compressor.flush())
+        start, self.offset = self.offset, self.file.tell()
+        self.rows = 0
+        self._data = [[] for _ in self.columns]
+        return [start, self.offset - start]
+
+
+class ChatArchive:
+    """
+    Partições mensais fechadas de chat_session_message em disco.
+
+    Cada partição vira um arquivo colunar ordenado por conversa e data,
+    gravado em blocos gzip independentes de ~ARCHIVE_BLOCK_ROWS linhas (um
+    JSON com uma lista por coluna em cada bloco). Os blocos fecham entre
+    conversas; só uma conversa muito grande continua no bloco seguinte. Um
+    índice ao lado (<partição>.index.json.gz) guarda conversa -> (bloco,
+    primeira linha, quantidade), sessão -> conversa e o offset de cada
+    bloco: a leitura de uma conversa abre só os meses em que ela aparece e
+    descompacta só os blocos dela. sessions.idx aponta cada sessão para o
+    mês arquivado mais recente dela.
+    """
+
+    def __init__(
+        self,
+        directory: str = ARCHIVE_DIR,
+        cache_size: int = ARCHIVE_CACHE_SIZE,
+        index_cache_size: int = ARCHIVE_INDEX_CACHE_SIZE
+    ):
+        self.directory = directory
+        self.cache_size = max(1, cache_size)
+        self.index_cache_size = max(1, index_cache_size)
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], List[List[Any]]]" = OrderedDict()
+        self._indexes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._partitions: Optional[List[str]] = None
+        self._listed_at: Optional[int] = None
+
+        # Métricas
+        self.reads = 0
+        self.loads = 0
+        self.index_loads = 0
+        self.cache_hits = 0
+
+    def path(self, partition: str) -> str:
+        return os.path.join(self.directory, partition + _DATA_SUFFIX)
+
+    def index_path(self, partition: str) -> str:
+        return os.path.join(self.directory, partition + _INDEX_SUFFIX)
+
+    def partitions(self) -> List[str]:
+        """Partições arquivadas, mais antigas primeiro"""
+        # Relista só quando o diretório muda (o arquivador pode rodar em outro worker).
+        # O índice é gravado por último: partição sem índice ainda não terminou.
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if self._partitions is None or mtime != self._listed_at:
+            names = [f[:-len(_INDEX_SUFFIX)] for f in os.listdir(self.directory) if f.endswith(_INDEX_SUFFIX)]
+            self._partitions = sorted(n for n in names if partition_month(n))
+            self._listed_at = mtime
+        return self._partitions
+
+    def horizon(self) -> Optional[datetime]:
+        """Fim do mês arquivado mais recente (tudo antes disso pode estar em disco)"""
+        partitions = self.partitions()
+        if not partitions:
+            return None
+        end = add_months(partition_month(partitions[-1]), 1)
+        return datetime(end.year, end.month, end.day)
+
+    def write(self, partition: str, columns: List[str], chunks: Iterable[Sequence[Sequence[Any]]]) -> Tuple[int, int]:
+        """
+        Grava a partição a partir de lotes já ordenados por conversa
+        (wa_id, phone_number_id, create_in, id), um lote por vez, sem juntar
+        a partição em memória. Retorna (linhas gravadas, bytes em disco).
+        """
+        position = {name: i for i, name in enumerate(columns)}
+        phone, wa_id = position["phone_number_id"], position["wa_id"]
+        session = position["session_id"]
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(partition)
+        index_path = self.index_path(partition)
+        blocks: List[List[int]] = []
+        conversations: Dict[str, List[int]] = {}
+        sessions: Dict[str, str] = {}
+        total = 0
+        current = None
+
+        with open(path + ".tmp", "wb") as f:
+            writer = _BlockWriter(f, columns, self._encode)
+            for chunk in chunks:
+                for row in chunk:
+                    key = f"{row[phone]}\t{row[wa_id]}"
+                    if key != current:
+                        if key in conversations:
+                            raise ValueError(f"partição {partition}: linhas fora de ordem na conversa {key}")
+                        if writer.rows >= ARCHIVE_BLOCK_ROWS:
+                            blocks.append(writer.close())
+                        conversations[key] = [len(blocks), writer.rows, 0]
+                        current = key
+                    elif writer.rows >= ARCHIVE_BLOCK_MAX_ROWS:
+                        blocks.append(writer.close())
+                    writer.write(row)
+                    conversations[key][2] += 1
+                    sessions[row[session]] = key
+                    total += 1
+            block = writer.close()
+            if block:
+                blocks.append(block)
+
+        index = {
+            "format": ARCHIVE_FORMAT,
+            "table": "chat_session_message",
+            "partition": partition,
+            "rows": total,
+            "columns": columns,
+            "blocks": blocks,
+            "conversations": conversations,
+            "sessions": sessions,
+        }
+        with gzip.open(index_path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        self._add_sessions(partition, sessions)
+        os.replace(index_path + ".tmp", index_path)
+
+        with self._lock:
+            self._indexes.pop(partition, None)
+            for cached in [k for k in self._cache if k[0] == partition]:
+                del self._cache[cached]
+            self._partitions = None
+        return total, os.path.getsize(path) + os.path.getsize(index_path)
+
+    def remove(self, partition: str) -> None:
+        """
+        Apaga uma partição arquivada (ou a gravação incompleta dela); as
+        entradas dela em sessions.idx ficam e são ignoradas sem o índice.
+        """
+        for path in (self.index_path(partition), self.path(partition)):
+            for candidate in (path, path + ".tmp"):
+                try:
+                    os.remove(candidate)
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            self._indexes.pop(partition, None)
+            self._partitions = None
+
+    def _session_records(self) -> Iterator[Tuple[str, int, str]]:
+        try:
+            with open(os.path.join(self.directory, _SESSIONS_FILE), "rb") as f:
+                while True:
+                    record = f.read(_SESSION_RECORD)
+                    if len(record) < _SESSION_RECORD:
+                        return
+                    yield record[:_SESSION_ID_WIDTH].decode().rstrip(), 1, record[_SESSION_ID_WIDTH:-1].decode().rstrip()
+        except FileNotFoundError:
+            return
+
+    def _add_sessions(self, partition: str, sessions: Iterable[str]) -> None:
+        """Junta as sessões do mês em sessions.idx (o mês novo prevalece), lendo o arquivo em fluxo"""
+        path = os.path.join(self.directory, _SESSIONS_FILE)
+        added = ((session_id, 0, partition) for session_id in sorted(sessions))
+        last = None
+        with open(path + ".tmp", "wb") as f:
+            for session_id, _, name in heapq.merge(added, self._session_records()):
+                if session_id == last:
+                    continue
+                last = session_id
+                f.write(session_id.ljust(_SESSION_ID_WIDTH).encode() + name.ljust(16).encode() + b"\n")
+        os.replace(path + ".tmp", path)
+
+    def _session_partition(self, session_id: str) -> Optional[str]:
+        """Mês arquivado mais recente da sessão (busca binária em sessions.idx)"""
+        wanted = session_id.ljust(_SESSION_ID_WIDTH).encode()
+        if len(wanted) != _SESSION_ID_WIDTH:
+            return None
+        try:
+            with open(os.path.join(self.directory, _SESSIONS_FILE), "rb") as f:
+                low, high = 0, os.fstat(f.fileno()).st_size // _SESSION_RECORD
+                while low < high:
+                    middle = (low + high) // 2
+                    f.seek(middle * _SESSION_RECORD)
+                    record = f.read(_SESSION_RECORD)
+                    current = record[:_SESSION_ID_WIDTH]
+                    if current == wanted:
+                        return record[_SESSION_ID_WIDTH:-1].decode().rstrip()
+                    if current < wanted:
+                        low = middle + 1
+                    else:
+                        high = middle
+        except FileNotFoundError:
+            pass
+        return None
+
+    @staticmethod
+    def _encode(value: Any) -> Any:
+        if isinstance(value, (datetime, date)):
+            return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+        if isinstance(value, (bytes, bytearray)):
+            return value.decode("utf-8")
+        return str(value)
+
+    def _index(self, partition: str) -> Dict[str, Any]:
+        with self._lock:
+            index = self._indexes.get(partition)
+            if index is not None:
+                self._indexes.move_to_end(partition)
+                return index
+
+        with gzip.open(self.index_path(partition), "rt", encoding="utf-8") as f:
+            index = json.load(f)
+
+        with self._lock:
+            self.index_loads += 1
+            self._indexes[partition] = index
+            while len(self._indexes) > self.index_cache_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _conversation(self, partition: str, key: str) -> Optional[Tuple[List[str], List[List[Any]]]]:
+        """(colunas, linhas) de uma conversa num mês; None se ela não aparece no mês"""
+        index = self._index(partition)
+        entry = index["conversations"].get(key)
+        if not entry:
+            return None
+        columns = index["columns"]
+
+        with self._lock:
+            rows = self._cache.get((partition, key))
+            if rows is not None:
+                self._cache.move_to_end((partition, key))
+                self.cache_hits += 1
+                return columns, rows
+
+        # Colunas da conversa, a partir do bloco dela (e dos seguintes, se continuar)
+        block, first, count = entry
+        data: Dict[str, List[Any]] = {name: [] for name in columns}
+        with open(self.path(partition), "rb") as f:
+            while count > 0:
+                offset, length = index["blocks"][block]
+                f.seek(offset)
+                document = json.loads(zlib.decompress(f.read(length), _GZIP))
+                taken = min(count, document["rows"] - first)
+                for name in columns:
+                    data[name].extend(document["data"][name][first:first + taken])
+                count -= taken
+                block, first = block + 1, 0
+        for name in DATETIME_COLUMNS:
+            if name in data:
+                data[name] = [datetime.fromisoformat(v) if v else None for v in data[name]]
+        rows = [list(row) for row in zip(*(data[name] for name in columns))]
+
+        with self._lock:
+            self.loads += 1
+            self._cache[(partition, key)] = rows
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return columns, rows
+
+    def read_conversation(
+        self,
+        wa_id: str,
+        phone_number_id: str,
+        limit: int,
+        before: Optional[Sequence[Any]] = None,
+        after: Optional[Sequence[Any]] = None,
+        include_payload: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Mensagens arquivadas de uma conversa, na mesma ordem da linha do tempo:
+        decrescente (sem cursor ou `before`) ou crescente (`after`).
+        """
+        partitions = self.partitions()
+        if not partitions or limit <= 0:
+            return []
+        self.reads += 1
+
+        before_key = _cursor_key(before)
+        after_key = _cursor_key(after)
+        key = f"{phone_number_id}\t{wa_id}"
+        ascending = after_key is not None
+        rows: List[Dict[str, Any]] = []
+
+        for partition in (partitions if ascending else reversed(partitions)):
+            month = partition_month(partition)
+            start_at = datetime(month.year, month.month, 1)
+            end = add_months(month, 1)
+            if after_key and datetime(end.year, end.month, 1) <= after_key[0]:
+                continue
+            if before_key and start_at >= before_key[0]:
+                continue
+
+            conversation = self._conversation(partition, key)
+            if not conversation:
+                continue
+
+            columns, archived = conversation
+            position = {name: i for i, name in enumerate(columns)}
+            created, row_id = position["create_in"], position["id"]
+            selected = [(name, i) for name, i in position.items() if include_payload or name != "payload"]
+            for row in (archived if ascending else reversed(archived)):
+                row_key = (row[created], row[row_id])
+                if after_key and row_key <= after_key:
+                    continue
+                if before_key and row_key >= before_key:
+                    continue
+                rows.append({name: row[i] for name, i in selected})
+                if len(rows) >= limit:
+                    return rows
+        return rows
+
+    def complete_timeline(
+        self,
+        rows: List[Dict[str, Any]],
+        wa_id: str,
+        phone_number_id: str,
+        limit: int,
+        before: Optional[Sequence[Any]] = None,
+        after: Optional[Sequence[Any]] = None,
+        include_payload: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Completa a página da linha do tempo lida do banco com as mensagens
+        arquivadas (todas anteriores às que ainda estão no banco).
+        """
+        horizon = self.horizon()
+        if horizon is None:
+            return rows
+
+        if after:
+            if _cursor_key(after)[0] >= horizon:
+                return rows
+            archived = self.read_conversation(
+                wa_id, phone_number_id, limit, after=after, include_payload=include_payload
+            )
+            return (archived + rows)[:limit]
+
+        if len(rows) >= limit:
+            return rows
+        oldest = [rows[-1]["create_in"], rows[-1]["id"]] if rows else before
+        return rows + self.read_conversation(
+            wa_id, phone_number_id, limit - len(rows), before=oldest, include_payload=include_payload
+        )
+
+    def session_messages(self, session_id: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Completa as mensagens de uma sessão lidas do banco (ordem crescente)
+        com as arquivadas. Uma sessão não tem intervalos maiores que
+        SESSION_WINDOW, então ocupa meses seguidos: a busca começa no mês mais
+        novo (se o banco tem o fim dela) ou no mês de sessions.idx, e para no
+        primeiro mês em que ela não aparece. Sessão desconhecida não abre
+        nenhum índice.
+        """
+        horizon = self.horizon()
+        if horizon is None or (rows and rows[0]["create_in"] >= horizon + SESSION_WINDOW):
+            return rows
+
+        partitions = self.partitions()
+        if rows:
+            start = len(partitions) - 1
+        else:
+            newest = self._session_partition(session_id)
+            if newest not in partitions:
+                return rows
+            start = partitions.index(newest)
+        self.reads += 1
+
+        archived: List[Dict[str, Any]] = []
+        for partition in reversed(partitions[:start + 1]):
+            key = self._index(partition).get("sessions", {}).get(session_id)
+            if not key:
+                break
+            columns, conversation = self._conversation(partition, key)
+            position = columns.index("session_id")
+            archived[:0] = [dict(zip(columns, row)) for row in conversation if row[position] == session_id]
+        return archived + rows
+
+    def complete_sessions(
+        self,
+        sessions: List[Dict[str, Any]],
+        wa_id: str,
+        phone_number_id: str,
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Completa as últimas sessões de uma conversa (resumo do
+        USER_SESSIONS_QUERY, mais recentes primeiro) com o histórico
+        arquivado: sessões que começaram antes do horizonte têm início e
+        contagem corrigidos, e sessões só arquivadas entram até `limit`.
+        """
+        horizon = self.horizon()
+        if horizon is None:
+            return sessions
+
+        self.reads += 1
+        merged = {session["session_id"]: dict(session) for session in sessions}
+        key = f"{phone_number_id}\t{wa_id}"
+        for partition in reversed(self.partitions()):
+            month = partition_month(partition)
+            end = add_months(month, 1)
+            # Só sessões que começam até SESSION_WINDOW depois do mês podem ter mensagens nele
+            boundary = datetime(end.year, end.month, 1) + SESSION_WINDOW
+            if len(merged) >= limit and all(s["session_start"] >= boundary for s in merged.values()):
+                break
+
+            conversation = self._conversation(partition, key)
+            if not conversation:
+                continue
+            columns, rows = conversation
+            position = {name: i for i, name in enumerate(columns)}
+            for row in rows:
+                created = row[position["create_in"]]
+                current = merged.setdefault(row[position["session_id"]], {
+                    "session_id": row[position["session_id"]],
+                    "wa_id": row[position["wa_id"]],
+                    "wa_id_received": row[position["wa_id_received"]],
+                    "phone_number_id": row[position["phone_number_id"]],
+                    "session_start": created,
+                    "last_message": created,
+                    "expires_at": row[position["expires_at"]],
+                    "is_active": row[position["is_active"]],
+                    "message_count": 0,
+                })
+                current["session_start"] = min(current["session_start"], created)
+                current["last_message"] = max(current["last_message"], created)
+                expires_at = row[position["expires_at"]]
+                if expires_at and (current["expires_at"] is None or expires_at > current["expires_at"]):
+                    current["expires_at"] = expires_at
+                current["message_count"] += 1
+
+            ordered = sorted(merged.values(), key=lambda s: s["last_message"], reverse=True)
+            merged = {s["session_id"]: s for s in ordered[:limit]}
+        return list(merged.values())
+
+    def stats(self) -> Dict[str, Any]:
+        partitions = self.partitions()
+        size = 0
+        for partition in partitions:
+            for path in (self.path(partition), self.index_path(partition)):
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    pass
+        return {
+            "partitions": len(partitions),
+            "bytes": size,
+            "reads": self.reads,
+            "loads": self.loads,
+            "index_loads": self.index_loads,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache),
+            "cached_indexes": len(self._indexes),
+        }
+
+
+# Instância global
+chat_archive = ChatArchive()
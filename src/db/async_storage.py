@@ -0,0 +1,1692 @@
+import os
+import json
+import asyncio
+import bcrypt
+import random
+import string
+import mysql.connector.aio
+from mysql.connector import Error
+from typing import Optional, Dict, Any, Iterable, List, Tuple, Union
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from src.db.pool import AsyncConnectionPool
+from src.db.queries import (
+    STATUS_RANK, webhook_insert, PROCESSED_EVENT_INSERT, PROCESSED_EVENT_PRUNE,
+    processed_events_query, latest_contacts, default_profile, contact_params, contacts_upsert,
+    ACTIVE_SESSION_QUERY, LAST_SESSION_QUERY, SESSION_MESSAGE_INSERT,
+    SESSION_MESSAGE_INSERT_IF_ACTIVE, SESSION_MESSAGES_QUERY, SESSION_DEACTIVATE,
+    EXPIRED_SESSIONS_QUERY, sessions_deactivate, conversation_state_sessions_end,
+    USER_SESSIONS_QUERY, MESSAGE_STATUS_LOCK, MESSAGE_STATUS_UPDATE, BOT_REPLIED_UPDATE,
+    FLOW_STATE_UPDATE, resolve_session, session_message_params, session_message_row,
+    status_lock_query, status_update_query, plan_statuses, empty_timeline, timeline_query,
+    timeline_page, CONVERSATION_STATE_UPSERT, CONVERSATION_STATE_STATUS_UPDATE,
+    CONVERSATION_STATE_SESSION_END, CONVERSATION_STATE_BOT_REPLY, CONVERSATIONS_SUMMARY_QUERY,
+    conversation_state_params, message_status_params, status_update_params,
+    active_conversations_queries, conversations_summary
+)
+from src.db.session_cache import session_cache
+from src.db.archive import chat_archive
+from src.utils.pagination import encode_cursor, decode_cursor
+from src.db.settings_cache import settings_registry, SETTINGS_ROUTING_QUERY
+
+load_dotenv()
+
+class AsyncDatabaseStorage:
+    """
+    Variante asyncio do DatabaseStorage (mysql.connector.aio).
+
+    Tem os mesmos métodos de leitura/escrita, mas não bloqueia o event loop.
+    A criação do schema continua no `db.initialize()` síncrono do startup.
+    """
+
+    def __init__(self):
+        self.host = os.getenv("DB_HOST")
+        self.user = os.getenv("DB_USER")
+        self.password = os.getenv("DB_PASSWORD")
+        self.database = os.getenv("DB_NAME")
+        self.port = int(os.getenv("DB_PORT") or 3306)
+        self.pool = AsyncConnectionPool(factory=self._connect)
+
+    def _hash_password(self, password: str) -> str:
+        """Criptografa a senha usando bcrypt"""
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+    def _verify_password(self, password: str, hashed: str) -> bool:
+        """Verifica se a senha corresponde ao hash"""
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    async def _connect(self):
+        """Abre uma conexão nova com o banco (usada pelo pool)"""
+        return await mysql.connector.aio.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            port=self.port
+        )
+
+    async def _get_connection(self):
+        """Pega uma conexão do pool (await conn.close() devolve ao pool)"""
+        try:
+            return await self.pool.connection()
+        except Error as e:
+            print(f"Erro ao conectar ao MySQL: {e}")
+            return None
+
+    async def check_connection(self) -> bool:
+        """Verifica se consegue conectar ao banco"""
+        conn = await self._get_connection()
+        if not conn:
+            return False
+        try:
+            return await conn.is_connected()
+        finally:
+            await conn.close()
+
+    async def close(self) -> None:
+        """Fecha as conexões do pool"""
+        await self.pool.close()
+
+    # ==================== WEBHOOK ====================
+    
+    async def save_webhook(self, webhook_data: Union[bytes, Dict[str, Any]]) -> Optional[int]:
+        """
+        Salva o payload do webhook completo (JSON comprimido, ver webhook_insert).
+        
+        Recebe de preferência os bytes originais da requisição, gravados como
+        chegaram; um dict é serializado uma vez com orjson.
+        """
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cursor = await conn.cursor()
+            await cursor.execute(*webhook_insert(webhook_data))
+            await conn.commit()
+            
+            webhook_id = cursor.lastrowid
+            await cursor.close()
+            await conn.close()
+            
+            print(f"✓ Webhook salvo com ID: {webhook_id}")
+            return webhook_id
+        except Error as e:
+            print(f"Erro ao salvar webhook: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== IDEMPOTÊNCIA ====================
+    
+    async def find_processed_events(self, keys: List[str]) -> Optional[set]:
+        """
+        Quais dessas chaves já estão em processed_event (eventos já aplicados).
+        None em erro.
+        """
+        if not keys:
+            return set()
+        
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor()
+            await cur.execute(processed_events_query(len(keys)), tuple(keys))
+            found = {row[0] for row in await cur.fetchall()}
+            await cur.close()
+            await conn.close()
+            
+            return found
+        
+        except Error as e:
+            print(f"Erro ao consultar eventos processados: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def prune_processed_events(self, before: datetime, limit: int = 5000) -> Optional[int]:
+        """Apaga até `limit` eventos registrados antes de `before` (índice idx_created_at)"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor()
+            await cur.execute(PROCESSED_EVENT_PRUNE, (before, limit))
+            rows_affected = cur.rowcount
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return rows_affected
+        
+        except Error as e:
+            print(f"Erro ao limpar eventos processados: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== CONTACTS ====================
+    
+    async def save_or_update_contact(
+        self, 
+        wa_id: str, 
+        name: str,
+        phone_number_id: str,
+        timestamp: int
+    ) -> bool:
+        """Salva ou atualiza um contato com base nas configurações"""
+        return await self.save_contacts_batch([{
+            "wa_id": wa_id,
+            "name": name,
+            "phone_number_id": phone_number_id,
+            "timestamp": timestamp
+        }])
+
+    async def save_contacts_batch(self, contacts: List[Dict[str, Any]]) -> bool:
+        """
+        Upsert de vários contatos num único INSERT ... ON DUPLICATE KEY UPDATE.
+        
+        Cada item tem wa_id, name, phone_number_id e timestamp. Pode receber os
+        contatos de um payload inteiro ou de vários payloads; repetições da
+        mesma conversa são reduzidas à mais recente antes do insert.
+        """
+        latest = latest_contacts(contacts)
+        if not latest:
+            return True
+        
+        conn = None
+        try:
+            params = []
+            for contact in latest.values():
+                # Profile padrão vem das settings do número (tabela de roteamento em memória)
+                tenant = await self.get_tenant(contact["phone_number_id"])
+                params.extend(contact_params(contact, default_profile(tenant)))
+            
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            
+            cursor = await conn.cursor()
+            await cursor.execute(contacts_upsert(len(latest)), params)
+            await conn.commit()
+            await cursor.close()
+            await conn.close()
+            
+            for wa_id, phone_number_id in latest:
+                print(f"✓ Contato {wa_id} salvo/atualizado → {phone_number_id}")
+            return True
+        except Error as e:
+            print(f"Erro ao salvar/atualizar contato: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_contacts_by_phone_number(
+        self,
+        phone_number_id: str,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Busca contatos por settings (create_for_phone_number) com paginação por cursor.
+
+        Ordena por (last_message_timestamp, id) decrescente usando o índice
+        idx_phone_last_message; retorna (contatos, próximo cursor).
+        """
+        after = decode_cursor(cursor, "contacts", 2)
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return [], None
+            
+            cur = await conn.cursor(dictionary=True)
+            if after is None:
+                await cur.execute("""
+                    SELECT * FROM contacts 
+                    WHERE create_for_phone_number = %s 
+                    ORDER BY last_message_timestamp DESC, id DESC
+                    LIMIT %s
+                """, (phone_number_id, limit + 1))
+            elif after[0] is None:
+                # Já estamos nos contatos sem timestamp (ficam no fim)
+                await cur.execute("""
+                    SELECT * FROM contacts 
+                    WHERE create_for_phone_number = %s 
+                      AND last_message_timestamp IS NULL AND id < %s
+                    ORDER BY last_message_timestamp DESC, id DESC
+                    LIMIT %s
+                """, (phone_number_id, after[1], limit + 1))
+            else:
+                await cur.execute("""
+                    SELECT * FROM contacts 
+                    WHERE create_for_phone_number = %s 
+                      AND (last_message_timestamp < %s
+                           OR (last_message_timestamp = %s AND id < %s)
+                           OR last_message_timestamp IS NULL)
+                    ORDER BY last_message_timestamp DESC, id DESC
+                    LIMIT %s
+                """, (phone_number_id, after[0], after[0], after[1], limit + 1))
+            rows = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                next_cursor = encode_cursor("contacts", [last['last_message_timestamp'], last['id']])
+            return rows, next_cursor
+        except Error as e:
+            print(f"Erro ao buscar contatos: {e}")
+            return [], None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_contact(self, contact_id: int) -> Optional[Dict[str, Any]]:
+        """Busca um contato pelo ID"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("SELECT * FROM contacts WHERE id = %s", (contact_id,))
+            contact = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return contact
+        except Error as e:
+            print(f"Erro ao buscar contato: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def update_contact_name(self, contact_id: int, name: str) -> Dict[str, Any]:
+        """Atualiza o nome do contato"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Verifica se contato existe
+            await cur.execute("SELECT id FROM contacts WHERE id = %s", (contact_id,))
+            if not await cur.fetchone():
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": f"Contato ID {contact_id} não encontrado"}
+            
+            # Atualiza nome
+            await cur.execute("UPDATE contacts SET name = %s WHERE id = %s", (name, contact_id))
+            await conn.commit()
+            
+            # Retorna contato atualizado
+            await cur.execute("SELECT * FROM contacts WHERE id = %s", (contact_id,))
+            contact = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            
+            return {"success": True, "message": "Nome atualizado com sucesso", "data": contact}
+        except Error as e:
+            print(f"Erro ao atualizar nome do contato: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    async def set_contact_automatic_message(self, contact_id: int, activate: bool) -> Dict[str, Any]:
+        """Ativa/Desativa mensagem automática"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Verifica se contato existe
+            await cur.execute("SELECT id FROM contacts WHERE id = %s", (contact_id,))
+            if not await cur.fetchone():
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": f"Contato ID {contact_id} não encontrado"}
+            
+            # Atualiza status
+            await cur.execute(
+                "UPDATE contacts SET activate_automatic_message = %s WHERE id = %s",
+                (activate, contact_id)
+            )
+            await conn.commit()
+            
+            # Retorna contato atualizado
+            await cur.execute("SELECT * FROM contacts WHERE id = %s", (contact_id,))
+            contact = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            
+            status = "ativada" if activate else "desativada"
+            return {"success": True, "message": f"Mensagem automática {status}", "data": contact}
+        except Error as e:
+            print(f"Erro ao atualizar mensagem automática: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    async def set_contact_bot(self, contact_id: int, activate: bool) -> Dict[str, Any]:
+        """Ativa/Desativa bot do contato"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Verifica se contato existe
+            await cur.execute("SELECT id FROM contacts WHERE id = %s", (contact_id,))
+            if not await cur.fetchone():
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": f"Contato ID {contact_id} não encontrado"}
+            
+            # Atualiza status e profile
+            profile = 'bot' if activate else 'human'
+            await cur.execute(
+                "UPDATE contacts SET activate_bot = %s, profile = %s WHERE id = %s",
+                (activate, profile, contact_id)
+            )
+            await conn.commit()
+            
+            # Retorna contato atualizado
+            await cur.execute("SELECT * FROM contacts WHERE id = %s", (contact_id,))
+            contact = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            
+            status = "ativado" if activate else "desativado"
+            return {"success": True, "message": f"Bot {status}", "data": contact}
+        except Error as e:
+            print(f"Erro ao atualizar bot do contato: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== SETTINGS ====================
+    
+    async def load_settings_registry(self) -> bool:
+        """Carrega a tabela de roteamento phone_number_id -> settings/organização"""
+        conn = None
+        try:
+            version = settings_registry.version
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(SETTINGS_ROUTING_QUERY)
+            rows = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            
+            settings_registry.load(rows, version)
+            return True
+        except Error as e:
+            print(f"Erro ao carregar tabela de roteamento: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_tenant(self, phone_number_id: str) -> Optional[Dict[str, Any]]:
+        """Resolve settings + organização de um phone_number_id sem ir ao banco"""
+        if not settings_registry.is_fresh():
+            await self.load_settings_registry()
+        return settings_registry.get(phone_number_id)
+
+    async def is_webhook_verify_token(self, token: Optional[str]) -> bool:
+        """Verifica se o token pertence a algum settings cadastrado"""
+        if not settings_registry.is_fresh():
+            await self.load_settings_registry()
+        return settings_registry.is_verify_token(token)
+
+    async def get_settings(self, phone_number_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Busca as configurações do sistema"""
+        if settings_registry.is_fresh() or await self.load_settings_registry():
+            if phone_number_id:
+                tenant = settings_registry.get(phone_number_id)
+            else:
+                tenant = settings_registry.get_by_id(1)
+            return dict(tenant["settings"]) if tenant else None
+        
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cursor = await conn.cursor(dictionary=True)
+            
+            if phone_number_id:
+                await cursor.execute(
+                    "SELECT * FROM settings WHERE phone_number_id = %s", 
+                    (phone_number_id,)
+                )
+            else:
+                await cursor.execute("SELECT * FROM settings WHERE id = 1")
+            
+            settings = await cursor.fetchone()
+            
+            await cursor.close()
+            await conn.close()
+            return settings
+        except Error as e:
+            print(f"Erro ao buscar configurações: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== ORGANIZATION ====================
+    
+    async def create_organization(self, organization_name: str, create_by: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Cria organização e vincula criador como user_creator"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+
+            await cur.execute("""
+                INSERT INTO organization (organization_name, activate, create_by)
+                VALUES (%s, %s, %s)
+            """, (organization_name, True, create_by))
+            org_id = cur.lastrowid
+
+            # Vincula criador como user_creator
+            if create_by:
+                await cur.execute("""
+                    INSERT IGNORE INTO organization_users (organization_id, user_id, role, activate)
+                    VALUES (%s, %s, %s, %s)
+                """, (org_id, create_by, 'user_creator', True))
+
+            await conn.commit()
+
+            await cur.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
+            org = await cur.fetchone()
+
+            await cur.close()
+            await conn.close()
+            return org
+        except Error as e:
+            print(f"Erro ao criar organização: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def deactivate_organization(self, org_id: int) -> Optional[Dict[str, Any]]:
+        """Desativa organização"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("UPDATE organization SET activate = FALSE WHERE id = %s", (org_id,))
+            await conn.commit()
+            settings_registry.invalidate()
+            await cur.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
+            org = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return org
+        except Error as e:
+            print(f"Erro ao desativar organização: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def activate_organization(self, org_id: int) -> Optional[Dict[str, Any]]:
+        """Ativa organização"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("UPDATE organization SET activate = TRUE WHERE id = %s", (org_id,))
+            await conn.commit()
+            settings_registry.invalidate()
+            await cur.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
+            org = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return org
+        except Error as e:
+            print(f"Erro ao ativar organização: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def update_organization_name(self, org_id: int, new_name: str) -> Optional[Dict[str, Any]]:
+        """Atualiza nome da organização"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("UPDATE organization SET organization_name = %s WHERE id = %s", (new_name, org_id))
+            await conn.commit()
+            settings_registry.invalidate()
+            await cur.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
+            org = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return org
+        except Error as e:
+            print(f"Erro ao atualizar nome da organização: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def list_organization_users(self, organization_id: int) -> List[Dict[str, Any]]:
+        """Lista usuários vinculados a uma organização."""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return []
+            cursor = await conn.cursor(dictionary=True)
+            await cursor.execute("""
+                SELECT ou.id, ou.organization_id, ou.user_id, ou.role, ou.activate, ou.create_in,
+                       u.name, u.email
+                FROM organization_users ou
+                JOIN users u ON u.id = ou.user_id
+                WHERE ou.organization_id = %s
+            """, (organization_id,))
+            rows = await cursor.fetchall()
+            await cursor.close()
+            await conn.close()
+            return rows
+        except Error as e:
+            print(f"Erro ao listar usuários da organização: {e}")
+            return []
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== SETTINGS (por organização) ====================
+    async def create_settings(self, organization_id: int, default_bot: Optional[str], default_profile: Optional[str],
+                        wa_id: Optional[str], phone_number_id: Optional[str],
+                        webhook_verify_token: Optional[str], meta_token: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Cria settings para a organização"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("""
+                INSERT INTO settings (default_bot, default_profile, wa_id, phone_number_id, webhook_verify_token, meta_token, organization_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (default_bot, default_profile or 'human', wa_id, phone_number_id, webhook_verify_token, meta_token, organization_id))
+            settings_id = cur.lastrowid
+            await conn.commit()
+            await cur.execute("SELECT * FROM settings WHERE id = %s", (settings_id,))
+            row = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            settings_registry.invalidate()
+            return row
+        except Error as e:
+            print(f"Erro ao criar settings: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def delete_settings(self, settings_id: int) -> bool:
+        """Remove settings por ID"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            cur = await conn.cursor()
+            await cur.execute("DELETE FROM settings WHERE id = %s", (settings_id,))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            settings_registry.invalidate()
+            return True
+        except Error as e:
+            print(f"Erro ao remover settings: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== USERS ====================
+    async def create_user(self, name: str, email: str, password: str) -> Optional[Dict[str, Any]]:
+        """Cria um novo usuário (senha com bcrypt)."""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+
+            # Verifica duplicidade de email
+            await cur.execute("SELECT id FROM users WHERE email = %s", (email,))
+            if await cur.fetchone():
+                await cur.close()
+                await conn.close()
+                return None
+
+            hashed = await asyncio.to_thread(self._hash_password, password)
+            await cur.execute("""
+                INSERT INTO users (name, email, password, activate)
+                VALUES (%s, %s, %s, %s)
+            """, (name, email, hashed, True))
+            user_id = cur.lastrowid
+            await conn.commit()
+
+            await cur.execute("SELECT id, name, email, create_in, activate FROM users WHERE id = %s", (user_id,))
+            user = await cur.fetchone()
+
+            await cur.close()
+            await conn.close()
+            return user
+        except Error as e:
+            print(f"Erro ao criar usuário: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_users(self, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lista usuários com paginação por cursor (id crescente)."""
+        after = decode_cursor(cursor, "users", 1)
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return [], None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(
+                "SELECT id, name, email, create_in, activate FROM users WHERE id > %s ORDER BY id LIMIT %s",
+                (after[0] if after else 0, limit + 1)
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor("users", [rows[-1]['id']])
+            return rows, next_cursor
+        except Error as e:
+            print(f"Erro ao buscar usuários: {e}")
+            return [], None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Busca um usuário pelo ID."""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("SELECT id, name, email, create_in, activate FROM users WHERE id = %s", (user_id,))
+            row = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return row
+        except Error as e:
+            print(f"Erro ao buscar usuário: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def update_user_name(self, user_id: int, name: str) -> Optional[Dict[str, Any]]:
+        """Atualiza o nome do usuário."""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("UPDATE users SET name = %s WHERE id = %s", (name, user_id))
+            await conn.commit()
+            await cur.execute("SELECT id, name, email, create_in, activate FROM users WHERE id = %s", (user_id,))
+            row = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return row
+        except Error as e:
+            print(f"Erro ao atualizar usuário: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def update_user_password(self, user_id: int, password: str) -> bool:
+        """Atualiza a senha do usuário (bcrypt)."""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            hashed = await asyncio.to_thread(self._hash_password, password)
+            cur = await conn.cursor()
+            await cur.execute("UPDATE users SET password = %s WHERE id = %s", (hashed, user_id))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            return True
+        except Error as e:
+            print(f"Erro ao atualizar senha: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    async def deactivate_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Desativa a conta do usuário."""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("UPDATE users SET activate = FALSE WHERE id = %s", (user_id,))
+            await conn.commit()
+            await cur.execute("SELECT id, name, email, create_in, activate FROM users WHERE id = %s", (user_id,))
+            row = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return row
+        except Error as e:
+            print(f"Erro ao desativar usuário: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def activate_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Ativa a conta do usuário."""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("UPDATE users SET activate = TRUE WHERE id = %s", (user_id,))
+            await conn.commit()
+            await cur.execute("SELECT id, name, email, create_in, activate FROM users WHERE id = %s", (user_id,))
+            row = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            return row
+        except Error as e:
+            print(f"Erro ao ativar usuário: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_organization(self, org_id: int) -> Optional[Dict[str, Any]]:
+        """Busca uma organização pelo ID"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cursor = await conn.cursor(dictionary=True)
+            await cursor.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
+            organization = await cursor.fetchone()
+            
+            await cursor.close()
+            await conn.close()
+            return organization
+        except Error as e:
+            print(f"Erro ao buscar organização: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_all_organizations(self, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lista todas as organizações com paginação por cursor (id crescente)"""
+        after = decode_cursor(cursor, "organizations", 1)
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return [], None
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(
+                "SELECT * FROM organization WHERE id > %s ORDER BY id LIMIT %s",
+                (after[0] if after else 0, limit + 1)
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor("organizations", [rows[-1]['id']])
+            return rows, next_cursor
+        except Error as e:
+            print(f"Erro ao listar organizações: {e}")
+            return [], None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_user_organizations(self, user_id: int) -> List[Dict[str, Any]]:
+        """Lista todas as organizações que o usuário participa"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return []
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("""
+                SELECT o.*, ou.role, ou.activate as user_active_in_org, ou.create_in as joined_at
+                FROM organization o
+                JOIN organization_users ou ON o.id = ou.organization_id
+                WHERE ou.user_id = %s
+            """, (user_id,))
+            rows = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            return rows
+        except Error as e:
+            print(f"Erro ao listar organizações do usuário: {e}")
+            return []
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_organization_settings(self, organization_id: int) -> List[Dict[str, Any]]:
+        """Lista todos os settings de uma organização"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return []
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute("SELECT * FROM settings WHERE organization_id = %s", (organization_id,))
+            rows = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            return rows
+        except Error as e:
+            print(f"Erro ao listar settings da organização: {e}")
+            return []
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== ORGANIZATION USERS (com validações) ====================
+    async def add_user_to_organization(self, organization_id: int, user_id: int, role: str = 'user') -> Dict[str, Any]:
+        """Vincula um usuário à organização com validações"""
+        conn = None
+        try:
+            if role not in ('user', 'user_admin', 'user_creator'):
+                role = 'user'
+            
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cursor = await conn.cursor(dictionary=True)
+            
+            # Valida se organização existe
+            await cursor.execute("SELECT id FROM organization WHERE id = %s", (organization_id,))
+            if not await cursor.fetchone():
+                await cursor.close()
+                await conn.close()
+                return {"success": False, "message": f"Organização ID {organization_id} não encontrada"}
+            
+            # Valida se usuário existe
+            await cursor.execute("SELECT id FROM users WHERE id = %s", (user_id,))
+            if not await cursor.fetchone():
+                await cursor.close()
+                await conn.close()
+                return {"success": False, "message": f"Usuário ID {user_id} não encontrado"}
+            
+            # Verifica se já existe vínculo
+            await cursor.execute("""
+                SELECT id FROM organization_users 
+                WHERE organization_id = %s AND user_id = %s
+            """, (organization_id, user_id))
+            if await cursor.fetchone():
+                await cursor.close()
+                await conn.close()
+                return {"success": False, "message": "Usuário já está vinculado a esta organização"}
+            
+            # Insere vínculo
+            await cursor.execute("""
+                INSERT INTO organization_users (organization_id, user_id, role, activate)
+                VALUES (%s, %s, %s, %s)
+            """, (organization_id, user_id, role, True))
+            await conn.commit()
+            await cursor.close()
+            await conn.close()
+            
+            return {"success": True, "message": f"Usuário ID {user_id} adicionado com role '{role}'"}
+        except Error as e:
+            print(f"Erro ao vincular usuário à organização: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    async def remove_user_from_organization(self, organization_id: int, user_id: int) -> Dict[str, Any]:
+        """Remove vínculo com validações"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Verifica se vínculo existe
+            await cur.execute("""
+                SELECT id FROM organization_users 
+                WHERE organization_id = %s AND user_id = %s
+            """, (organization_id, user_id))
+            if not await cur.fetchone():
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": f"Usuário ID {user_id} não está vinculado à organização ID {organization_id}"}
+            
+            # Remove vínculo
+            await cur.execute("""
+                DELETE FROM organization_users 
+                WHERE organization_id = %s AND user_id = %s
+            """, (organization_id, user_id))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return {"success": True, "message": f"Usuário ID {user_id} removido da organização"}
+        except Error as e:
+            print(f"Erro ao remover usuário da organização: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    async def update_organization_user_role(self, organization_id: int, user_id: int, role: str) -> Dict[str, Any]:
+        """Atualiza role com validações"""
+        conn = None
+        try:
+            if role not in ('user', 'user_admin', 'user_creator'):
+                return {"success": False, "message": f"Role '{role}' inválido. Use: user, user_admin ou user_creator"}
+            
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Verifica se vínculo existe
+            await cur.execute("""
+                SELECT id FROM organization_users 
+                WHERE organization_id = %s AND user_id = %s
+            """, (organization_id, user_id))
+            if not await cur.fetchone():
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": f"Usuário ID {user_id} não está vinculado à organização ID {organization_id}"}
+            
+            # Atualiza role
+            await cur.execute("""
+                UPDATE organization_users SET role = %s 
+                WHERE organization_id = %s AND user_id = %s
+            """, (role, organization_id, user_id))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return {"success": True, "message": f"Role do usuário ID {user_id} atualizado para '{role}'"}
+        except Error as e:
+            print(f"Erro ao atualizar role: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    async def set_organization_user_active(self, organization_id: int, user_id: int, active: bool) -> Dict[str, Any]:
+        """Ativa/Desativa com validações"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Verifica se vínculo existe
+            await cur.execute("""
+                SELECT id FROM organization_users 
+                WHERE organization_id = %s AND user_id = %s
+            """, (organization_id, user_id))
+            if not await cur.fetchone():
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": f"Usuário ID {user_id} não está vinculado à organização ID {organization_id}"}
+            
+            # Atualiza status
+            await cur.execute("""
+                UPDATE organization_users SET activate = %s 
+                WHERE organization_id = %s AND user_id = %s
+            """, (active, organization_id, user_id))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            status_text = "ativado" if active else "desativado"
+            return {"success": True, "message": f"Usuário ID {user_id} {status_text} na organização"}
+        except Error as e:
+            print(f"Erro ao atualizar ativação: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    async def reset_user_password(self, email: str) -> Dict[str, Any]:
+        """Reseta a senha do usuário e retorna a nova senha"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return {"success": False, "message": "Erro ao conectar ao banco de dados"}
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Verifica se email existe e usuário está ativo
+            await cur.execute("SELECT id, name, email, activate FROM users WHERE email = %s", (email,))
+            user = await cur.fetchone()
+            
+            if not user:
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": f"Email {email} não encontrado"}
+            
+            if not user['activate']:
+                await cur.close()
+                await conn.close()
+                return {"success": False, "message": "Usuário desativado. Entre em contato com o suporte."}
+            
+            # Gera senha numérica aleatória de 8 dígitos
+            new_password = ''.join(random.choices(string.digits, k=8))
+            
+            # Hash da nova senha
+            hashed = await asyncio.to_thread(self._hash_password, new_password)
+            
+            # Atualiza senha
+            await cur.execute("UPDATE users SET password = %s WHERE id = %s", (hashed, user['id']))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return {
+                "success": True, 
+                "message": "Senha resetada com sucesso",
+                "user_id": user['id'],
+                "name": user['name'],
+                "email": user['email'],
+                "new_password": new_password
+            }
+        except Error as e:
+            print(f"Erro ao resetar senha: {e}")
+            return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                await conn.close()
+
+    async def authenticate_user(self, email: str, password: str) -> Optional[Dict[str, Any]]:
+        """Autentica usuário por email e senha"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor(dictionary=True)
+            
+            # Busca usuário por email
+            await cur.execute("SELECT id, name, email, password, activate FROM users WHERE email = %s", (email,))
+            user = await cur.fetchone()
+            
+            await cur.close()
+            await conn.close()
+            
+            if not user:
+                return None
+            
+            # Verifica se usuário está ativo
+            if not user['activate']:
+                return None
+            
+            # Verifica senha
+            if not await asyncio.to_thread(self._verify_password, password, user['password']):
+                return None
+            
+            # Remove senha do retorno
+            del user['password']
+            return user
+            
+        except Error as e:
+            print(f"Erro ao autenticar usuário: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    # ==================== CHAT SESSION MESSAGE ====================
+    
+    async def get_active_session(self, wa_id: str, wa_id_received: str, phone_number_id: str) -> Optional[Dict[str, Any]]:
+        """Busca sessão ativa (última mensagem não expirada)"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(ACTIVE_SESSION_QUERY, (wa_id, wa_id_received, phone_number_id, datetime.now()))
+            
+            last_message = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            
+            if not last_message:
+                return None
+            
+            session_cache.set(
+                (wa_id, wa_id_received, phone_number_id),
+                last_message['session_id'],
+                last_message['expires_at']
+            )
+            return last_message
+        
+        except Error as e:
+            print(f"Erro ao buscar sessão ativa: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def create_session_message(
+        self,
+        wa_id: str,
+        wa_id_received: str,
+        phone_number_id: str,
+        content: str,
+        payload: Union[Dict[str, Any], str],
+        is_user_message: bool = True,
+        message_status: str = 'sent',
+        wamid: Optional[str] = None,
+        event_key: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Cria nova mensagem na sessão (cria sessão se necessário).
+        
+        Busca da sessão, insert e montagem do retorno acontecem numa única
+        transação e numa única conexão; a linha criada é montada a partir dos
+        valores inseridos, sem SELECT de volta.
+        
+        `event_key` (message:<wamid> do webhook) entra em processed_event na
+        mesma transação; se outro worker já gravou o evento, nada é inserido
+        e retorna None.
+        """
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor(dictionary=True)
+            if event_key:
+                await cur.execute(PROCESSED_EVENT_INSERT, (event_key,))
+                if not cur.rowcount:
+                    await conn.rollback()
+                    await cur.close()
+                    await conn.close()
+                    print(f"↺ Evento {event_key} já processado")
+                    return None
+            
+            now = datetime.now().replace(microsecond=0)
+            key = (wa_id, wa_id_received, phone_number_id)
+            # Calcula expiração (24h a partir de agora); a sessão é resolvida abaixo
+            expires_at = now + timedelta(hours=24)
+            message = session_message_row(
+                wa_id, wa_id_received, phone_number_id, None, content, payload,
+                is_user_message, message_status, wamid, now, expires_at
+            )
+            
+            # Sessão em cache evita o SELECT da última mensagem; o insert confere
+            # que ela segue ativa (o cache só é confiável quanto ao expires_at)
+            inserted = False
+            cached = session_cache.get(key, now)
+            if cached:
+                message["session_id"] = resolve_session({"session_id": cached[0], "expires_at": cached[1]}, now)
+                await cur.execute(SESSION_MESSAGE_INSERT_IF_ACTIVE, session_message_params(message) + (cached[0],))
+                inserted = cur.rowcount > 0
+                if not inserted:
+                    print(f"↺ Sessão {cached[0]} encerrada por outro processo")
+                    session_cache.invalidate_session(cached[0])
+            
+            if not inserted:
+                # Última mensagem ativa e não expirada da conversa (mesma transação do insert)
+                await cur.execute(LAST_SESSION_QUERY, (wa_id, wa_id_received, phone_number_id, now))
+                message["session_id"] = resolve_session(await cur.fetchone(), now)
+                await cur.execute(SESSION_MESSAGE_INSERT, session_message_params(message))
+            
+            # Atualiza o resumo da conversa na mesma transação
+            message["id"] = cur.lastrowid
+            await cur.execute(CONVERSATION_STATE_UPSERT, conversation_state_params(message))
+            
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            session_cache.set(key, message["session_id"], expires_at)
+            
+            print(f"  └─ Mensagem ID {message['id']} salva na sessão")
+            print(f"  └─ Expira em: {expires_at.strftime('%d/%m/%Y %H:%M:%S')}")
+            
+            return message
+        
+        except Error as e:
+            print(f"Erro ao criar mensagem na sessão: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def deactivate_session(self, session_id: str) -> bool:
+        """Desativa todas as mensagens de uma sessão"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            
+            cur = await conn.cursor()
+            await cur.execute(SESSION_DEACTIVATE, (session_id,))
+            rows_affected = cur.rowcount
+            await cur.execute(CONVERSATION_STATE_SESSION_END, (session_id,))
+            await conn.commit()
+            
+            await cur.close()
+            await conn.close()
+            
+            session_cache.invalidate_session(session_id)
+            print(f"✓ Sessão {session_id} desativada ({rows_affected} mensagens)")
+            return True
+        
+        except Error as e:
+            print(f"Erro ao desativar sessão: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    async def deactivate_expired_sessions(self, limit: int = 1000) -> Optional[int]:
+        """
+        Desativa até `limit` sessões expiradas (sem nenhuma mensagem válida).
+        
+        A sessão é desativada inteira pelo session_id, junto com o
+        session_expires_at de conversation_state e o cache de sessões. Lote
+        limitado para não segurar locks por muito tempo; o SessionSweeper
+        repete até sobrar menos que `limit`. Retorna as sessões desativadas.
+        """
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor()
+            now = datetime.now()
+            await cur.execute(EXPIRED_SESSIONS_QUERY, (now, now, limit))
+            session_ids = [row[0] for row in await cur.fetchall()]
+            if session_ids:
+                await cur.execute(sessions_deactivate(len(session_ids)), tuple(session_ids))
+                await cur.execute(conversation_state_sessions_end(len(session_ids)), tuple(session_ids))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            for session_id in session_ids:
+                session_cache.invalidate_session(session_id)
+            return len(session_ids)
+        
+        except Error as e:
+            print(f"Erro ao desativar sessões expiradas: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_session_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Lista todas as mensagens de uma sessão"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return []
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(SESSION_MESSAGES_QUERY, (session_id,))
+            
+            messages = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            
+            # Sessão que começou num mês já arquivado (PartitionArchiver)
+            if chat_archive.partitions():
+                messages = await asyncio.to_thread(chat_archive.session_messages, session_id, messages)
+            return messages
+        
+        except Error as e:
+            print(f"Erro ao buscar mensagens da sessão: {e}")
+            return []
+        finally:
+            if conn:
+                await conn.close()
+
+    async def update_message_status(self, message_id: int, status: str) -> bool:
+        """Atualiza status da mensagem (sent, delivered, read, failed)"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(MESSAGE_STATUS_LOCK, (message_id,))
+            message = await cur.fetchone()
+            await cur.execute(MESSAGE_STATUS_UPDATE, (status, message_id))
+            
+            # Mantém os contadores da sessão atual da conversa
+            if message and message['message_status'] != status:
+                await cur.execute(CONVERSATION_STATE_STATUS_UPDATE, message_status_params(message, status))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return True
+        
+        except Error as e:
+            print(f"Erro ao atualizar status da mensagem: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    async def apply_message_statuses(self, statuses: Dict[str, str], event_keys: Iterable[str] = ()) -> Optional[int]:
+        """
+        Aplica status de entrega/leitura da Meta ({wamid: status}) em lote.
+        
+        Um UPDATE por status de destino; o status só avança (sent < delivered
+        < read < failed), então eventos atrasados não regridem uma mensagem
+        já lida. As chaves dos eventos (status:<wamid>:<status>) entram em
+        processed_event na mesma transação. Retorna quantas mensagens mudaram
+        (None em erro).
+        """
+        if not statuses:
+            return 0
+        
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(status_lock_query(len(statuses)), tuple(statuses))
+            ids_by_status, conversations = plan_statuses(await cur.fetchall(), statuses)
+            
+            updated = 0
+            for status, ids in ids_by_status.items():
+                await cur.execute(status_update_query(len(ids)), (status, *ids, STATUS_RANK[status]))
+                updated += cur.rowcount
+            
+            if conversations:
+                await cur.executemany(CONVERSATION_STATE_STATUS_UPDATE, status_update_params(conversations))
+            keys = [(key,) for key in event_keys]
+            if keys:
+                await cur.executemany(PROCESSED_EVENT_INSERT, keys)
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return updated
+        
+        except Error as e:
+            print(f"Erro ao aplicar status das mensagens: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+    async def mark_bot_replied(self, message_id: int) -> bool:
+        """Marca que o bot respondeu a mensagem"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            
+            cur = await conn.cursor()
+            await cur.execute(BOT_REPLIED_UPDATE, (message_id,))
+            if cur.rowcount:
+                await cur.execute(CONVERSATION_STATE_BOT_REPLY, (message_id,))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return True
+        
+        except Error as e:
+            print(f"Erro ao marcar bot replied: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    async def update_flow_state(self, message_id: int, flow_state: Dict[str, Any]) -> bool:
+        """Atualiza o estado do flow"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return False
+            
+            cur = await conn.cursor()
+            await cur.execute(FLOW_STATE_UPDATE, (json.dumps(flow_state), message_id))
+            await conn.commit()
+            await cur.close()
+            await conn.close()
+            
+            return True
+        
+        except Error as e:
+            print(f"Erro ao atualizar flow state: {e}")
+            return False
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_user_sessions(self, wa_id: str, phone_number_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Lista últimas sessões do usuário"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return []
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(USER_SESSIONS_QUERY, (wa_id, phone_number_id, limit))
+            
+            sessions = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            
+            # Sessões (ou o começo delas) em meses já arquivados
+            if chat_archive.partitions():
+                sessions = await asyncio.to_thread(
+                    chat_archive.complete_sessions, sessions, wa_id, phone_number_id, limit
+                )
+            return sessions
+        
+        except Error as e:
+            print(f"Erro ao buscar sessões do usuário: {e}")
+            return []
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_conversation_timeline(
+        self,
+        wa_id: str,
+        phone_number_id: str,
+        limit: int = 50,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        include_payload: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Página da linha do tempo de uma conversa numa única consulta.
+        
+        Usa o índice (wa_id, phone_number_id, create_in, id). Sem cursor traz as
+        mensagens mais recentes; `before` pagina para trás e `after` busca as
+        mais novas. As mensagens voltam em ordem cronológica.
+        """
+        before_keys = decode_cursor(before, "timeline", 2)
+        after_keys = decode_cursor(after, "timeline", 2)
+        
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return empty_timeline(after)
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(*timeline_query(wa_id, phone_number_id, limit, before_keys, after_keys, include_payload))
+            rows = await cur.fetchall()
+            await cur.close()
+            await conn.close()
+            
+            # Meses antigos saem do banco para o arquivo em disco (PartitionArchiver)
+            if chat_archive.partitions():
+                rows = await asyncio.to_thread(
+                    chat_archive.complete_timeline, rows, wa_id, phone_number_id, limit + 1,
+                    before_keys, after_keys, include_payload
+                )
+            return timeline_page(rows, limit, after, after_keys)
+        except Error as e:
+            print(f"Erro ao buscar linha do tempo da conversa: {e}")
+            return empty_timeline(after)
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_active_conversations(
+        self,
+        phone_number_id: str,
+        limit: int = 50,
+        skip: int = 0,
+        unread_only: bool = False
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Conversas com sessão ativa do número, mais recentes primeiro.
+        
+        Lê o resumo mantido em conversation_state (sem agregar as mensagens).
+        Retorna (página, total).
+        """
+        page_query, count_query, params = active_conversations_queries(phone_number_id, unread_only)
+        
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return [], 0
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(page_query, params + (limit, skip))
+            conversations = await cur.fetchall()
+            
+            await cur.execute(count_query, params)
+            total = (await cur.fetchone())['total']
+            await cur.close()
+            await conn.close()
+            return conversations, total
+        except Error as e:
+            print(f"Erro ao listar conversas ativas: {e}")
+            return [], 0
+        finally:
+            if conn:
+                await conn.close()
+
+    async def get_conversations_summary(self, phone_number_id: str) -> Optional[Dict[str, Any]]:
+        """Totais das conversas com sessão ativa do número (a partir de conversation_state)"""
+        conn = None
+        try:
+            conn = await self._get_connection()
+            if not conn:
+                return None
+            
+            cur = await conn.cursor(dictionary=True)
+            await cur.execute(CONVERSATIONS_SUMMARY_QUERY, (phone_number_id, datetime.now()))
+            summary = await cur.fetchone()
+            await cur.close()
+            await conn.close()
+            
+            return conversations_summary(summary)
+        except Error as e:
+            print(f"Erro ao buscar resumo das conversas: {e}")
+            return None
+        finally:
+            if conn:
+                await conn.close()
+
+# Instância global
+adb = AsyncDatabaseStorage()
@@ -0,0 +1,422 @@
+from datetime import date, datetime
+from typing import Any, Callable, List, Optional, Sequence, Set
+from mysql.connector import Error
+from src.db.partitions import DAY, is_partitioned, partition_table, partition_clause, initial_partitions
+
+# Lock nomeado para vários workers não migrarem ao mesmo tempo
+MIGRATION_LOCK = "whatsapp_webhook_schema_migrations"
+# Espera pelo lock: MIGRATION_LOCK_ATTEMPTS tentativas de MIGRATION_LOCK_TIMEOUT segundos
+MIGRATION_LOCK_TIMEOUT = 60
+MIGRATION_LOCK_ATTEMPTS = 3
+
+
+class Migration:
+    """
+    Passo versionado do schema: lista de SQL e/ou função (storage, cursor).
+
+    offline=True marca as que copiam uma tabela inteira (travando escritas);
+    o startup não as aplica, só o migrate.py --offline numa janela de
+    manutenção. As demais seguem sendo aplicadas mesmo com elas pendentes.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        description: str,
+        statements: Sequence[str] = (),
+        run: Optional[Callable[[Any, Any], Any]] = None,
+        offline: bool = False
+    ):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.run = run
+        self.offline = offline
+
+    def apply(self, storage, cursor) -> None:
+        for statement in self.statements:
+            cursor.execute(statement)
+        if self.run:
+            self.run(storage, cursor)
+
+
+def index_exists(cursor, table: str, index: str) -> bool:
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, index))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def table_exists(cursor, table: str) -> bool:
+    cursor.execute("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+        LIMIT 1
+    """, (table,))
+    return cursor.fetchone() is not None
+
+
+def add_index(table: str, index: str, columns: str, unique: bool = False) -> Callable[[Any, Any], None]:
+    """Cria o índice só se ainda não existir (DDL do MySQL não tem IF NOT EXISTS)"""
+    def run(storage, cursor):
+        if not index_exists(cursor, table, index):
+            kind = "UNIQUE INDEX" if unique else "INDEX"
+            cursor.execute(f"ALTER TABLE {table} ADD {kind} {index} ({columns})")
+            print(f"  └─ Índice {table}.{index} criado")
+    return run
+
+
+def add_column(table: str, column: str, definition: str) -> Callable[[Any, Any], None]:
+    """Adiciona a coluna só se ainda não existir"""
+    def run(storage, cursor):
+        if not column_exists(cursor, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            print(f"  └─ Coluna {table}.{column} criada")
+    return run
+
+
+def steps(*functions: Callable[[Any, Any], None]) -> Callable[[Any, Any], None]:
+    def run(storage, cursor):
+        for function in functions:
+            function(storage, cursor)
+    return run
+
+
+def _initial_schema(storage, cursor) -> None:
+    # Schema original (tabelas + registros padrão); idempotente em bancos existentes
+    if not storage.create_tables():
+        raise RuntimeError("Erro ao criar/verificar tabelas")
+
+
+CONVERSATION_STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS conversation_state (
+        phone_number_id VARCHAR(50) NOT NULL,
+        wa_id VARCHAR(50) NOT NULL,
+        last_message_id INT NULL,
+        last_message_content TEXT NULL,
+        last_message_at DATETIME NULL,
+        last_session_id VARCHAR(36) NULL,
+        session_expires_at DATETIME NULL,
+        last_read_at DATETIME NULL,
+        total_sessions INT NOT NULL DEFAULT 0,
+        total_messages INT NOT NULL DEFAULT 0,
+        user_messages INT NOT NULL DEFAULT 0,
+        bot_messages INT NOT NULL DEFAULT 0,
+        bot_replies INT NOT NULL DEFAULT 0,
+        unread_count INT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (phone_number_id, wa_id),
+        INDEX idx_phone_last_message (phone_number_id, last_message_at),
+        INDEX idx_phone_expires (phone_number_id, session_expires_at),
+        INDEX idx_last_session (last_session_id)
+    )
+"""
+
+
+def _backfill_conversation_state(storage, cursor) -> None:
+    # Estado inicial a partir do histórico; depois é mantido pelo ingest
+    cursor.execute("""
+        INSERT INTO conversation_state
+            (phone_number_id, wa_id, total_sessions, total_messages, user_messages,
+             bot_messages, bot_replies, unread_count, last_message_at, last_read_at,
+             session_expires_at)
+        SELECT
+            phone_number_id,
+            wa_id,
+            COUNT(DISTINCT session_id),
+            COUNT(*),
+            SUM(CASE WHEN is_user_message = TRUE THEN 1 ELSE 0 END),
+            SUM(CASE WHEN is_user_message = FALSE THEN 1 ELSE 0 END),
+            SUM(CASE WHEN bot_replied = TRUE THEN 1 ELSE 0 END),
+            SUM(CASE WHEN message_status NOT IN ('read', 'delivered') THEN 1 ELSE 0 END),
+            MAX(create_in),
+            MAX(CASE WHEN message_status IN ('delivered', 'read') THEN create_in END),
+            MAX(CASE WHEN is_active = TRUE THEN expires_at END)
+        FROM chat_session_message
+        GROUP BY phone_number_id, wa_id
+        ON DUPLICATE KEY UPDATE phone_number_id = phone_number_id
+    """)
+    print(f"  └─ {cursor.rowcount} conversas carregadas em conversation_state")
+    cursor.execute("""
+        UPDATE conversation_state cs
+        JOIN (
+            SELECT phone_number_id, wa_id, MAX(id) AS last_id
+            FROM chat_session_message
+            GROUP BY phone_number_id, wa_id
+        ) latest ON latest.phone_number_id = cs.phone_number_id AND latest.wa_id = cs.wa_id
+        JOIN chat_session_message m ON m.id = latest.last_id
+        SET cs.last_message_id = m.id,
+            cs.last_message_content = m.content,
+            cs.last_session_id = m.session_id
+    """)
+
+
+def _partition_chat_messages(storage, cursor) -> None:
+    # Particionamento mensal por create_in: a coluna precisa estar em toda chave única
+    if is_partitioned(cursor, "chat_session_message"):
+        return
+    cursor.execute("""
+        UPDATE chat_session_message SET create_in = COALESCE(updated_at, NOW())
+        WHERE create_in IS NULL
+    """)
+    cursor.execute("SELECT MIN(create_in) FROM chat_session_message")
+    first_month = cursor.fetchone()[0] or datetime.now()
+    cursor.execute("""
+        ALTER TABLE chat_session_message
+            MODIFY create_in DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT 'Quando a mensagem foi criada',
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (id, create_in)
+    """)
+    names = partition_table(cursor, "chat_session_message", "create_in", first_month)
+    print(f"  └─ chat_session_message particionada por mês ({names[0]} .. {names[-1]} + pmax)")
+
+
+WEBHOOK_TABLE = """
+    CREATE TABLE webhook (
+        id BIGINT AUTO_INCREMENT,
+        date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        body LONGBLOB NOT NULL COMMENT 'JSON bruto comprimido (formato do COMPRESS(), ler com UNCOMPRESS())',
+        size INT NOT NULL COMMENT 'Tamanho do JSON sem compressão',
+        PRIMARY KEY (id, date),
+        INDEX idx_date (date)
+    )
+"""
+
+
+def _partition_webhook(storage, cursor) -> None:
+    # Nova tabela particionada por dia; a antiga fica como webhook_legacy até
+    # sair da retenção (sem reescrever a maior tabela durante o boot)
+    if table_exists(cursor, "webhook"):
+        if is_partitioned(cursor, "webhook"):
+            return
+        cursor.execute("SELECT 1 FROM webhook LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute("DROP TABLE webhook")
+        elif table_exists(cursor, "webhook_legacy"):
+            raise RuntimeError("webhook_legacy já existe; remova-a antes de migrar")
+        else:
+            cursor.execute("RENAME TABLE webhook TO webhook_legacy")
+            print("  └─ Tabela webhook antiga renomeada para webhook_legacy")
+    cursor.execute(WEBHOOK_TABLE + partition_clause("date", initial_partitions(date.today(), 7, DAY), DAY))
+    print("  └─ Tabela webhook recriada com partições diárias")
+
+
+def _session_counters(storage, cursor) -> None:
+    # O histórico vira lifetime_*; os contadores passam a valer só para a sessão atual
+    cursor.execute("""
+        UPDATE conversation_state
+        SET lifetime_sessions = total_sessions, lifetime_messages = total_messages
+    """)
+    cursor.execute("""
+        UPDATE conversation_state cs
+        LEFT JOIN (
+            SELECT
+                m.session_id,
+                COUNT(*) AS total_messages,
+                SUM(CASE WHEN m.is_user_message = TRUE THEN 1 ELSE 0 END) AS user_messages,
+                SUM(CASE WHEN m.is_user_message = FALSE THEN 1 ELSE 0 END) AS bot_messages,
+                SUM(CASE WHEN m.bot_replied = TRUE THEN 1 ELSE 0 END) AS bot_replies,
+                SUM(CASE WHEN m.message_status NOT IN ('read', 'delivered') THEN 1 ELSE 0 END) AS unread_count,
+                SUM(m.message_status = 'received') AS status_received,
+                SUM(m.message_status = 'sent') AS status_sent,
+                SUM(m.message_status = 'delivered') AS status_delivered,
+                SUM(m.message_status = 'read') AS status_read,
+                SUM(m.message_status = 'failed') AS status_failed,
+                SUM(m.message_status NOT IN ('received', 'sent', 'delivered', 'read', 'failed')) AS status_other
+            FROM chat_session_message m
+            JOIN conversation_state last ON last.last_session_id = m.session_id
+            GROUP BY m.session_id
+        ) s ON s.session_id = cs.last_session_id
+        SET cs.total_sessions = IF(s.session_id IS NULL, 0, 1),
+            cs.total_messages = COALESCE(s.total_messages, 0),
+            cs.user_messages = COALESCE(s.user_messages, 0),
+            cs.bot_messages = COALESCE(s.bot_messages, 0),
+            cs.bot_replies = COALESCE(s.bot_replies, 0),
+            cs.unread_count = COALESCE(s.unread_count, 0),
+            cs.status_received = COALESCE(s.status_received, 0),
+            cs.status_sent = COALESCE(s.status_sent, 0),
+            cs.status_delivered = COALESCE(s.status_delivered, 0),
+            cs.status_read = COALESCE(s.status_read, 0),
+            cs.status_failed = COALESCE(s.status_failed, 0),
+            cs.status_other = COALESCE(s.status_other, 0)
+    """)
+    print(f"  └─ Contadores da sessão atual recalculados em {cursor.rowcount} conversas")
+
+
+def _unread_user_messages(storage, cursor) -> None:
+    # Não lidas da sessão atual enviadas pelo usuário (o resto de unread_count é do bot)
+    cursor.execute("""
+        UPDATE conversation_state cs
+        JOIN (
+            SELECT m.session_id, COUNT(*) AS unread_user_messages
+            FROM chat_session_message m
+            JOIN conversation_state last ON last.last_session_id = m.session_id
+            WHERE m.is_user_message = TRUE AND m.message_status NOT IN ('read', 'delivered')
+            GROUP BY m.session_id
+        ) s ON s.session_id = cs.last_session_id
+        SET cs.unread_user_messages = s.unread_user_messages
+    """)
+    print(f"  └─ Não lidas do usuário recalculadas em {cursor.rowcount} conversas")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "schema inicial", run=_initial_schema),
+    Migration(2, "índices das consultas quentes", run=steps(
+        # Busca da sessão ativa por conversa (create_session_message / get_active_session)
+        add_index("chat_session_message", "idx_conversation_active",
+                  "wa_id, wa_id_received, phone_number_id, is_active, create_in"),
+        # Sessões/histórico de um contato (get_user_sessions / conversation)
+        add_index("chat_session_message", "idx_contact_history",
+                  "wa_id, phone_number_id, create_in"),
+        # Listas de chats ativos por número
+        add_index("chat_session_message", "idx_phone_active",
+                  "phone_number_id, is_active, wa_id"),
+        # Lista de contatos por número ordenada pela última mensagem
+        add_index("contacts", "idx_phone_last_message",
+                  "create_for_phone_number, last_message_timestamp"),
+        # Roteamento por phone_number_id
+        add_index("settings", "idx_phone_number_id", "phone_number_id"),
+        # Consultas/limpeza do webhook bruto por data
+        add_index("webhook", "idx_date", "date"),
+    )),
+    Migration(3, "resumo por conversa (conversation_state)",
+              statements=(CONVERSATION_STATE_TABLE,),
+              run=_backfill_conversation_state),
+    Migration(4, "id da mensagem na Meta (wamid)", run=steps(
+        add_column("chat_session_message", "wamid", "VARCHAR(128) NULL"),
+        # Aplicação dos status de entrega/leitura por wamid
+        add_index("chat_session_message", "idx_wamid", "wamid"),
+    )),
+    Migration(5, "particionamento mensal de chat_session_message", run=_partition_chat_messages, offline=True),
+    Migration(6, "webhook bruto comprimido e particionado por dia", run=_partition_webhook, offline=True),
+    Migration(7, "eventos já processados (idempotência do ingest)", statements=("""
+        CREATE TABLE IF NOT EXISTS processed_event (
+            event_key VARCHAR(191) NOT NULL PRIMARY KEY COMMENT 'message:<wamid> ou status:<wamid>:<status>',
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_created_at (created_at)
+        )
+    """,)),
+    Migration(8, "contadores de conversation_state por sessão (histórico em lifetime_*)", run=steps(
+        add_column("conversation_state", "lifetime_sessions", "INT NOT NULL DEFAULT 0"),
+        add_column("conversation_state", "lifetime_messages", "INT NOT NULL DEFAULT 0"),
+        add_column("conversation_state", "status_received", "INT NOT NULL DEFAULT 0"),
+        add_column("conversation_state", "status_sent", "INT NOT NULL DEFAULT 0"),
+        add_column("conversation_state", "status_delivered", "INT NOT NULL DEFAULT 0"),
+        add_column("conversation_state", "status_read", "INT NOT NULL DEFAULT 0"),
+        add_column("conversation_state", "status_failed", "INT NOT NULL DEFAULT 0"),
+        add_column("conversation_state", "status_other", "INT NOT NULL DEFAULT 0"),
+        _session_counters,
+    )),
+    Migration(9, "não lidas do usuário em conversation_state", run=steps(
+        add_column("conversation_state", "unread_user_messages", "INT NOT NULL DEFAULT 0"),
+        _unread_user_messages,
+    )),
+]
+
+LATEST_VERSION = max(m.version for m in MIGRATIONS)
+
+# A partir desta versão o webhook bruto fica em body/size (COMPRESS)
+WEBHOOK_COMPRESSED_VERSION = 6
+
+
+def applied_versions(cursor) -> Optional[Set[int]]:
+    """Versões aplicadas do schema (None se a tabela de controle não existe)"""
+    try:
+        cursor.execute("SELECT version FROM schema_version")
+    except Error:
+        return None
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(applied: Set[int], offline: bool = False) -> List[Migration]:
+    """Migrações ainda não aplicadas, em ordem (as offline só com offline=True)"""
+    return [m for m in MIGRATIONS if m.version not in applied and (offline or not m.offline)]
+
+
+class SchemaState:
+    """
+    Migrações aplicadas no banco, carregadas pelo db.initialize().
+
+    Enquanto não carregado (scripts que não passam pelo startup) assume o
+    schema completo.
+    """
+
+    def __init__(self):
+        self.applied: Optional[Set[int]] = None
+
+    def has(self, version: int) -> bool:
+        return self.applied is None or version in self.applied
+
+    def pending_offline(self) -> List[Migration]:
+        if self.applied is None:
+            return []
+        return [m for m in MIGRATIONS if m.offline and m.version not in self.applied]
+
+
+schema_state = SchemaState()
+
+
+def _acquire_lock(cursor) -> None:
+    """
+    Pega o lock nomeado das migrações. GET_LOCK retorna 1 (obtido), 0
+    (timeout: outro processo ainda migrando) ou NULL (erro); só segue com 1.
+    """
+    for attempt in range(1, MIGRATION_LOCK_ATTEMPTS + 1):
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+        result = cursor.fetchone()[0]
+        if result == 1:
+            return
+        if result is None:
+            break
+        print(f"⚠ Lock das migrações ocupado (tentativa {attempt}/{MIGRATION_LOCK_ATTEMPTS})")
+    raise RuntimeError(f"Não foi possível obter o lock das migrações (GET_LOCK retornou {result})")
+
+
+def run_migrations(storage, conn, offline: bool = False) -> Set[int]:
+    """
+    Aplica as migrações pendentes em ordem; retorna as versões aplicadas.
+
+    As offline ficam pendentes, a menos que offline=True (migrate.py --offline).
+    """
+    cursor = conn.cursor()
+    try:
+        _acquire_lock(cursor)
+    except Exception:
+        cursor.close()
+        raise
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        applied = applied_versions(cursor) or set()
+
+        for migration in pending_migrations(applied, offline):
+            print(f"→ Aplicando migração {migration.version}: {migration.description}")
+            migration.apply(storage, cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (migration.version, migration.description)
+            )
+            conn.commit()
+            applied.add(migration.version)
+            print(f"✓ Migração {migration.version} aplicada")
+        return applied
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        cursor.fetchone()
+        cursor.close()
@@ -0,0 +1,137 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple, Union
+
+# Partição que recebe tudo além da última partição do intervalo
+MAX_PARTITION = "pmax"
+
+# Intervalos suportados: partições mensais (pAAAAMM) ou diárias (pAAAAMMDD)
+MONTH = "month"
+DAY = "day"
+
+
+def month_start(value: Union[date, datetime]) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def period_start(value: Union[date, datetime], interval: str = MONTH) -> date:
+    if interval == DAY:
+        return date(value.year, value.month, value.day)
+    return month_start(value)
+
+
+def add_periods(start: date, count: int, interval: str = MONTH) -> date:
+    if interval == DAY:
+        return start + timedelta(days=count)
+    return add_months(start, count)
+
+
+def partition_name(start: date, interval: str = MONTH) -> str:
+    return f"p{start:%Y%m%d}" if interval == DAY else f"p{start:%Y%m}"
+
+
+def partition_start(name: str) -> Optional[Tuple[date, str]]:
+    """(início, intervalo) de uma partição 'pAAAAMM' ou 'pAAAAMMDD' (None para pmax)"""
+    formats = {9: ("p%Y%m%d", DAY), 7: ("p%Y%m", MONTH)}
+    if not name or len(name) not in formats:
+        return None
+    fmt, interval = formats[len(name)]
+    try:
+        return datetime.strptime(name, fmt).date(), interval
+    except ValueError:
+        return None
+
+
+def partition_month(name: str) -> Optional[date]:
+    """Mês de uma partição mensal 'pAAAAMM'"""
+    parsed = partition_start(name)
+    return parsed[0] if parsed and parsed[1] == MONTH else None
+
+
+def partition_definition(start: date, interval: str = MONTH) -> str:
+    end = add_periods(start, 1, interval)
+    return f"PARTITION {partition_name(start, interval)} VALUES LESS THAN ('{end:%Y-%m-%d}')"
+
+
+def _periods(first: date, last: date, interval: str) -> List[date]:
+    starts = []
+    start = period_start(first, interval)
+    while start <= last:
+        starts.append(start)
+        start = add_periods(start, 1, interval)
+    return starts
+
+
+def partition_clause(column: str, starts: List[date], interval: str = MONTH) -> str:
+    """Cláusula PARTITION BY RANGE COLUMNS para as partições dadas + pmax"""
+    definitions = [partition_definition(s, interval) for s in starts]
+    definitions.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    return f"PARTITION BY RANGE COLUMNS({column}) (" + ", ".join(definitions) + ")"
+
+
+def list_partitions(cursor, table: str) -> List[Tuple[str, int]]:
+    """(nome, linhas estimadas) das partições da tabela, em ordem"""
+    cursor.execute("""
+        SELECT partition_name, table_rows FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+    """, (table,))
+    return [(row[0], row[1] or 0) for row in cursor.fetchall()]
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    return bool(list_partitions(cursor, table))
+
+
+def initial_partitions(first: Union[date, datetime], ahead: int = 2, interval: str = MONTH) -> List[date]:
+    """Inícios das partições de `first` até `ahead` intervalos depois de hoje"""
+    last = add_periods(period_start(date.today(), interval), ahead, interval)
+    return _periods(first, last, interval)
+
+
+def partition_table(cursor, table: str, column: str, first: Union[date, datetime],
+                    ahead: int = 2, interval: str = MONTH) -> List[str]:
+    """Particiona uma tabela existente por RANGE COLUMNS a partir de `first`"""
+    starts = initial_partitions(first, ahead, interval)
+    cursor.execute(f"ALTER TABLE {table} " + partition_clause(column, starts, interval))
+    return [partition_name(s, interval) for s in starts]
+
+
+def ensure_future_partitions(cursor, table: str, ahead: int = 2, interval: str = MONTH) -> List[str]:
+    """Cria as partições que faltam até `ahead` intervalos à frente"""
+    starts = [partition_start(name) for name, _ in list_partitions(cursor, table)]
+    starts = [s[0] for s in starts if s and s[1] == interval]
+    if not starts:
+        return []
+
+    target = add_periods(period_start(date.today(), interval), ahead, interval)
+    new_starts = _periods(add_periods(max(starts), 1, interval), target, interval)
+    if not new_starts:
+        return []
+
+    # Divide a pmax (vazia enquanto houver partições à frente) nas novas partições
+    definitions = [partition_definition(s, interval) for s in new_starts]
+    definitions.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    cursor.execute(
+        f"ALTER TABLE {table} REORGANIZE PARTITION {MAX_PARTITION} INTO ("
+        + ", ".join(definitions) + ")"
+    )
+    return [partition_name(s, interval) for s in new_starts]
+
+
+def closed_partitions(cursor, table: str, before: date) -> List[str]:
+    """Partições que terminam até `before` (mais antigas primeiro)"""
+    names = []
+    for name, _ in list_partitions(cursor, table):
+        parsed = partition_start(name)
+        if parsed and add_periods(parsed[0], 1, parsed[1]) <= before:
+            names.append(name)
+    return names
+
+
+def drop_partition(cursor, table: str, name: str) -> None:
+    cursor.execute(f"ALTER TABLE {table} DROP PARTITION {name}")
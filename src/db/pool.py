@@ -0,0 +1,395 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+from mysql.connector import Error
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or 10)
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT") or 5)
+POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE") or 1800)
+POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER") or 30)
+
+
+class PoolTimeout(Error):
+    """Nenhuma conexão ficou livre dentro do tempo de espera"""
+
+
+class PooledConnection:
+    """
+    Conexão emprestada do pool.
+
+    Repassa tudo para a conexão real; `close()` devolve a conexão ao pool
+    em vez de fechar o socket, então o código existente não muda. `close()`
+    é idempotente: os métodos do storage também chamam no `finally`.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn, created_at: float):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._release(conn, self._created_at)
+
+    def __del__(self):
+        # Detector de vazamento: quem pega a conexão devolve no finally; chegar
+        # aqui é bug (a conexão ficou fora do pool até o GC) e é registrado
+        if getattr(self, "_conn", None) is not None:
+            self._pool.leaked += 1
+            print("⚠ Pool: conexão coletada pelo GC sem close() (vazamento)")
+            self.close()
+
+
+class ConnectionPool:
+    """Pool de conexões MySQL com validação no checkout, reciclagem e métricas de espera"""
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        size: int = POOL_SIZE,
+        timeout: float = POOL_TIMEOUT,
+        recycle: float = POOL_RECYCLE,
+        ping_after: float = POOL_PING_AFTER
+    ):
+        self._factory = factory
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        # (conexão, criada_em, devolvida_em)
+        self._idle: deque = deque()
+        self._open = 0
+        self._closed = False
+
+        # Métricas
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.validation_failures = 0
+        self.leaked = 0
+
+    def connection(self) -> PooledConnection:
+        """Pega uma conexão do pool (espera até `timeout` se todas estiverem em uso)"""
+        started = time.monotonic()
+        waited = False
+        entry = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(msg=f"Pool esgotado após {self.timeout}s ({self.size} conexões em uso)")
+                waited = True
+                self._cond.wait(remaining)
+
+            self.checkouts += 1
+            if waited:
+                elapsed = time.monotonic() - started
+                self.waits += 1
+                self.wait_time_total += elapsed
+                self.wait_time_max = max(self.wait_time_max, elapsed)
+
+        if entry is not None:
+            conn, created_at, released_at = entry
+            conn = self._validate(conn, created_at, released_at)
+            if conn is not None:
+                return PooledConnection(self, conn, created_at)
+
+        return self._create()
+
+    def _create(self) -> PooledConnection:
+        """Abre uma conexão nova para um slot já reservado"""
+        try:
+            conn = self._factory()
+        except Exception:
+            self._discard_slot()
+            raise
+        self.created += 1
+        return PooledConnection(self, conn, time.monotonic())
+
+    def _validate(self, conn, created_at: float, released_at: float):
+        """Retorna a conexão se ainda é válida; senão fecha e devolve None"""
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            self.recycled += 1
+            self._close_quietly(conn)
+            return None
+
+        # Só faz ping se a conexão ficou parada tempo suficiente para o servidor derrubá-la
+        if now - released_at > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self.validation_failures += 1
+                self._close_quietly(conn)
+                return None
+        return conn
+
+    def _release(self, conn, created_at: float) -> None:
+        """Devolve a conexão ao pool, encerrando transação pendente"""
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            if healthy and not self._closed:
+                self._idle.append((conn, created_at, time.monotonic()))
+                self._cond.notify()
+                return
+            self._open -= 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    def _discard_slot(self) -> None:
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """Fecha todas as conexões ociosas (as emprestadas fecham ao voltar)"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            idle = len(self._idle)
+            open_ = self._open
+        return {
+            "size": self.size,
+            "open": open_,
+            "idle": idle,
+            "in_use": open_ - idle,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_time_total_ms": round(self.wait_time_total * 1000, 2),
+            "wait_time_avg_ms": round(self.wait_time_total * 1000 / self.waits, 2) if self.waits else 0.0,
+            "wait_time_max_ms": round(self.wait_time_max * 1000, 2),
+            "timeouts": self.timeouts,
+            "created": self.created,
+            "recycled": self.recycled,
+            "validation_failures": self.validation_failures,
+            "leaked": self.leaked,
+        }
+
+
+class AsyncPooledConnection:
+    """Conexão emprestada do pool assíncrono; `await close()` devolve ao pool"""
+
+    def __init__(self, pool: "AsyncConnectionPool", conn, created_at: float):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await self._pool._release(conn, self._created_at)
+
+    def __del__(self):
+        # Detector de vazamento (ver PooledConnection); devolve pelo event loop
+        if getattr(self, "_conn", None) is not None:
+            self._pool.leaked += 1
+            print("⚠ Pool: conexão assíncrona coletada pelo GC sem close() (vazamento)")
+            conn, self._conn = self._conn, None
+            self._pool._release_later(conn, self._created_at)
+
+
+class AsyncConnectionPool:
+    """Versão asyncio do ConnectionPool (mysql.connector.aio)"""
+
+    def __init__(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        size: int = POOL_SIZE,
+        timeout: float = POOL_TIMEOUT,
+        recycle: float = POOL_RECYCLE,
+        ping_after: float = POOL_PING_AFTER
+    ):
+        self._factory = factory
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._cond: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle: deque = deque()
+        self._open = 0
+        self._closed = False
+
+        # Métricas
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.validation_failures = 0
+        self.leaked = 0
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+            self._loop = asyncio.get_running_loop()
+        return self._cond
+
+    async def connection(self) -> AsyncPooledConnection:
+        """Pega uma conexão do pool (espera até `timeout` se todas estiverem em uso)"""
+        cond = self._condition()
+        started = time.monotonic()
+        waited = False
+        entry = None
+
+        async with cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(msg=f"Pool esgotado após {self.timeout}s ({self.size} conexões em uso)")
+                waited = True
+                try:
+                    await asyncio.wait_for(cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            self.checkouts += 1
+            if waited:
+                elapsed = time.monotonic() - started
+                self.waits += 1
+                self.wait_time_total += elapsed
+                self.wait_time_max = max(self.wait_time_max, elapsed)
+
+        if entry is not None:
+            conn, created_at, released_at = entry
+            conn = await self._validate(conn, created_at, released_at)
+            if conn is not None:
+                return AsyncPooledConnection(self, conn, created_at)
+
+        try:
+            conn = await self._factory()
+        except Exception:
+            async with cond:
+                self._open -= 1
+                cond.notify()
+            raise
+        self.created += 1
+        return AsyncPooledConnection(self, conn, time.monotonic())
+
+    async def _validate(self, conn, created_at: float, released_at: float):
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            self.recycled += 1
+            await self._close_quietly(conn)
+            return None
+
+        if now - released_at > self.ping_after:
+            try:
+                await conn.ping(reconnect=False)
+            except Exception:
+                self.validation_failures += 1
+                await self._close_quietly(conn)
+                return None
+        return conn
+
+    async def _release(self, conn, created_at: float) -> None:
+        healthy = True
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+        except Exception:
+            healthy = False
+
+        cond = self._condition()
+        async with cond:
+            if healthy and not self._closed:
+                self._idle.append((conn, created_at, time.monotonic()))
+                cond.notify()
+                return
+            self._open -= 1
+            cond.notify()
+        await self._close_quietly(conn)
+
+    def _release_later(self, conn, created_at: float) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(lambda: loop.create_task(self._release(conn, created_at)))
+
+    @staticmethod
+    async def _close_quietly(conn) -> None:
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        """Fecha todas as conexões ociosas"""
+        self._closed = True
+        idle, self._idle = list(self._idle), deque()
+        self._open -= len(idle)
+        for conn, _, _ in idle:
+            await self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        idle = len(self._idle)
+        return {
+            "size": self.size,
+            "open": self._open,
+            "idle": idle,
+            "in_use": self._open - idle,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_time_total_ms": round(self.wait_time_total * 1000, 2),
+            "wait_time_avg_ms": round(self.wait_time_total * 1000 / self.waits, 2) if self.waits else 0.0,
+            "wait_time_max_ms": round(self.wait_time_max * 1000, 2),
+            "timeouts": self.timeouts,
+            "created": self.created,
+            "recycled": self.recycled,
+            "validation_failures": self.validation_failures,
+            "leaked": self.leaked,
+        }
@@ -0,0 +1,614 @@
+"""
+SQL e montagem de resultados compartilhados pelo DatabaseStorage e pelo
+AsyncDatabaseStorage no caminho do webhook (webhook bruto, idempotência,
+contatos em lote, sessões, status e conversation_state) e nas leituras
+que dependem dessas tabelas.
+
+As duas classes fazem só o I/O (conexão, execute, fetch, commit); as
+consultas, os parâmetros e os dicts de retorno ficam aqui, num lugar só.
+O CRUD administrativo (usuários, organizações, settings, contato avulso)
+não passa pelo pipeline assíncrono e mantém o SQL junto do método.
+"""
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+import orjson
+from src.utils.compression import mysql_compress
+from src.db.migrations import schema_state, WEBHOOK_COMPRESSED_VERSION
+from src.utils.pagination import encode_cursor
+
+# ==================== STATUS ====================
+
+# Colunas da linha do tempo (payload só quando pedido)
+TIMELINE_COLUMNS = (
+    "id, wa_id, wa_id_received, phone_number_id, session_id, flow_state, message_status, "
+    "is_user_message, bot_replied, content, create_in, updated_at, expires_at, is_active, wamid"
+)
+
+# Status que contam a mensagem como lida
+READ_STATUSES = ("delivered", "read")
+
+# Ordem dos status de entrega da Meta; um status só substitui outro de ordem menor
+STATUS_ORDER = ("sent", "delivered", "read", "failed")
+STATUS_RANK = {status: rank for rank, status in enumerate(STATUS_ORDER, start=1)}
+STATUS_RANK_SQL = "FIELD(message_status, " + ", ".join(f"'{s}'" for s in STATUS_ORDER) + ")"
+
+# Contagem por status da sessão atual em conversation_state (status_<status>);
+# status fora da lista entram em status_other
+COUNTED_STATUSES = ("received",) + STATUS_ORDER
+STATUS_COLUMNS = tuple(f"status_{status}" for status in COUNTED_STATUSES) + ("status_other",)
+STATUS_COLUMN_INDEX = {status: index for index, status in enumerate(COUNTED_STATUSES)}
+
+
+def unread_delta(old_status: Optional[str], new_status: str) -> int:
+    """Variação do contador de não lidas quando uma mensagem muda de status"""
+    was_read = old_status in READ_STATUSES
+    is_read = new_status in READ_STATUSES
+    if was_read == is_read:
+        return 0
+    return -1 if is_read else 1
+
+
+def status_deltas(old_status: Optional[str], new_status: str) -> List[int]:
+    """Variação de cada coluna de STATUS_COLUMNS quando uma mensagem muda (ou nasce, old_status None)"""
+    deltas = [0] * len(STATUS_COLUMNS)
+    if old_status is not None:
+        deltas[STATUS_COLUMN_INDEX.get(old_status, -1)] -= 1
+    deltas[STATUS_COLUMN_INDEX.get(new_status, -1)] += 1
+    return deltas
+
+
+def placeholders(count: int) -> str:
+    """Lista de %s para um IN (...)"""
+    return ", ".join(["%s"] * count)
+
+
+# ==================== WEBHOOK ====================
+
+WEBHOOK_INSERT = "INSERT INTO webhook (body, size) VALUES (%s, %s)"
+# Tabela antiga (coluna JSON), enquanto a migração offline do webhook não roda
+WEBHOOK_LEGACY_INSERT = "INSERT INTO webhook (json) VALUES (%s)"
+
+
+def webhook_insert(webhook_data: Union[bytes, Dict[str, Any]]) -> Tuple[str, tuple]:
+    """
+    (SQL, parâmetros) do webhook bruto: corpo comprimido + tamanho original
+    (bytes da requisição ou dict serializado uma vez), ou o JSON puro no
+    formato antigo se a migração do webhook ainda está pendente.
+    """
+    raw = webhook_data if isinstance(webhook_data, (bytes, bytearray)) else orjson.dumps(webhook_data)
+    if not schema_state.has(WEBHOOK_COMPRESSED_VERSION):
+        return WEBHOOK_LEGACY_INSERT, (bytes(raw).decode("utf-8"),)
+    return WEBHOOK_INSERT, (mysql_compress(raw), len(raw))
+
+
+# ==================== IDEMPOTÊNCIA ====================
+
+# Gravada na mesma transação do efeito do evento (mensagem ou status):
+# a chave só existe se o evento foi aplicado
+PROCESSED_EVENT_INSERT = "INSERT IGNORE INTO processed_event (event_key) VALUES (%s)"
+
+PROCESSED_EVENT_PRUNE = """
+    DELETE FROM processed_event
+    WHERE created_at < %s
+    LIMIT %s
+"""
+
+
+def processed_events_query(count: int) -> str:
+    return f"SELECT event_key FROM processed_event WHERE event_key IN ({placeholders(count)})"
+
+
+# ==================== CONTACTS ====================
+
+def latest_contacts(contacts: List[Dict[str, Any]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Uma entrada por conversa (wa_id + phone_number_id), ficando a mais recente"""
+    latest: Dict[tuple, Dict[str, Any]] = {}
+    for contact in contacts:
+        key = (contact["wa_id"], contact["phone_number_id"])
+        current = latest.get(key)
+        if current is None or int(contact["timestamp"]) >= int(current["timestamp"]):
+            latest[key] = contact
+    return latest
+
+
+def default_profile(tenant: Optional[Dict[str, Any]]) -> str:
+    """Profile padrão das settings do número (human se não houver)"""
+    if tenant and tenant["settings"].get('default_profile'):
+        return tenant["settings"]['default_profile']
+    return 'human'
+
+
+def contact_params(contact: Dict[str, Any], profile: str) -> List[Any]:
+    return [
+        contact["wa_id"],
+        contact["name"],
+        profile,
+        contact["phone_number_id"],
+        int(contact["timestamp"]),
+        profile != 'human',
+        False
+    ]
+
+
+def contacts_upsert(count: int) -> str:
+    """Upsert em lote: conversa nova insere com o profile padrão; existente só atualiza nome e timestamp"""
+    values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * count)
+    return f"""
+        INSERT INTO contacts
+        (wa_id, name, profile, create_for_phone_number, last_message_timestamp, activate_bot, activate_automatic_message)
+        VALUES {values} AS new
+        ON DUPLICATE KEY UPDATE
+            name = new.name,
+            last_message_timestamp = GREATEST(
+                COALESCE(last_message_timestamp, 0), new.last_message_timestamp
+            )
+    """
+
+
+# ==================== CHAT SESSION MESSAGE ====================
+
+# Última mensagem não expirada da conversa (a desativação fica com o sweeper)
+ACTIVE_SESSION_QUERY = """
+    SELECT * FROM chat_session_message
+    WHERE wa_id = %s
+      AND wa_id_received = %s
+      AND phone_number_id = %s
+      AND is_active = TRUE
+      AND expires_at >= %s
+    ORDER BY create_in DESC
+    LIMIT 1
+"""
+
+# Mesma busca, só com o necessário para o create_session_message
+LAST_SESSION_QUERY = """
+    SELECT session_id, expires_at FROM chat_session_message
+    WHERE wa_id = %s
+      AND wa_id_received = %s
+      AND phone_number_id = %s
+      AND is_active = TRUE
+      AND expires_at >= %s
+    ORDER BY create_in DESC
+    LIMIT 1
+"""
+
+SESSION_MESSAGE_INSERT = """
+    INSERT INTO chat_session_message
+    (wa_id, wa_id_received, phone_number_id, session_id, content, payload,
+     is_user_message, message_status, create_in, updated_at, expires_at, is_active, wamid)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Mesmo insert para a sessão vinda do session_cache: o cache é por processo,
+# então só grava se a sessão ainda está ativa no banco (outro worker pode tê-la
+# encerrado); rowcount 0 manda de volta para a LAST_SESSION_QUERY
+SESSION_MESSAGE_INSERT_IF_ACTIVE = """
+    INSERT INTO chat_session_message
+    (wa_id, wa_id_received, phone_number_id, session_id, content, payload,
+     is_user_message, message_status, create_in, updated_at, expires_at, is_active, wamid)
+    SELECT %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s FROM DUAL
+    WHERE EXISTS (
+        SELECT 1 FROM chat_session_message
+        WHERE session_id = %s AND is_active = TRUE
+    )
+"""
+
+SESSION_MESSAGES_QUERY = """
+    SELECT * FROM chat_session_message
+    WHERE session_id = %s
+    ORDER BY create_in ASC
+"""
+
+SESSION_DEACTIVATE = """
+    UPDATE chat_session_message
+    SET is_active = FALSE
+    WHERE session_id = %s
+"""
+
+# Sessões expiradas: cada mensagem tem o seu expires_at (24h depois dela),
+# então uma linha vencida ainda pode pertencer a uma sessão viva. Entra no
+# lote só a sessão sem nenhuma mensagem não expirada (idx_active + idx_session).
+EXPIRED_SESSIONS_QUERY = """
+    SELECT DISTINCT m.session_id FROM chat_session_message m
+    WHERE m.is_active = TRUE AND m.expires_at < %s
+      AND NOT EXISTS (
+          SELECT 1 FROM chat_session_message live
+          WHERE live.session_id = m.session_id AND live.expires_at >= %s
+      )
+    LIMIT %s
+"""
+
+
+def sessions_deactivate(count: int) -> str:
+    return f"""
+        UPDATE chat_session_message
+        SET is_active = FALSE
+        WHERE session_id IN ({placeholders(count)}) AND is_active = TRUE
+    """
+
+
+def conversation_state_sessions_end(count: int) -> str:
+    """Conversas cuja última sessão foi desativada deixam de ter sessão ativa"""
+    return f"""
+        UPDATE conversation_state
+        SET session_expires_at = NULL
+        WHERE last_session_id IN ({placeholders(count)})
+    """
+
+USER_SESSIONS_QUERY = """
+    SELECT DISTINCT session_id, wa_id, wa_id_received, phone_number_id,
+           MIN(create_in) as session_start,
+           MAX(create_in) as last_message,
+           MAX(expires_at) as expires_at,
+           MAX(is_active) as is_active,
+           COUNT(*) as message_count
+    FROM chat_session_message
+    WHERE wa_id = %s AND phone_number_id = %s
+    GROUP BY session_id, wa_id, wa_id_received, phone_number_id
+    ORDER BY last_message DESC
+    LIMIT %s
+"""
+
+MESSAGE_STATUS_LOCK = """
+    SELECT wa_id, phone_number_id, session_id, message_status, is_user_message, create_in
+    FROM chat_session_message
+    WHERE id = %s
+    FOR UPDATE
+"""
+
+MESSAGE_STATUS_UPDATE = """
+    UPDATE chat_session_message
+    SET message_status = %s
+    WHERE id = %s
+"""
+
+BOT_REPLIED_UPDATE = """
+    UPDATE chat_session_message
+    SET bot_replied = TRUE
+    WHERE id = %s AND bot_replied = FALSE
+"""
+
+FLOW_STATE_UPDATE = """
+    UPDATE chat_session_message
+    SET flow_state = %s
+    WHERE id = %s
+"""
+
+
+def resolve_session(last_message: Optional[Dict[str, Any]], now: datetime) -> str:
+    """Sessão da mensagem nova: a ativa da conversa ou uma nova (a expirada fica com o sweeper)"""
+    if last_message and now <= last_message['expires_at']:
+        print(f"✓ Usando sessão existente: {last_message['session_id']}")
+        return last_message['session_id']
+    session_id = str(uuid.uuid4())
+    print(f"✓ Nova sessão criada: {session_id}")
+    return session_id
+
+
+def session_message_params(message: Dict[str, Any]) -> tuple:
+    """Parâmetros do SESSION_MESSAGE_INSERT a partir da linha montada por session_message_row"""
+    return (
+        message["wa_id"],
+        message["wa_id_received"],
+        message["phone_number_id"],
+        message["session_id"],
+        message["content"],
+        message["payload"],
+        bool(message["is_user_message"]),
+        message["message_status"],
+        message["create_in"],
+        message["updated_at"],
+        message["expires_at"],
+        True,
+        message["wamid"]
+    )
+
+
+def session_message_row(
+    wa_id: str,
+    wa_id_received: str,
+    phone_number_id: str,
+    session_id: str,
+    content: str,
+    payload: Union[Dict[str, Any], str],
+    is_user_message: bool,
+    message_status: str,
+    wamid: Optional[str],
+    now: datetime,
+    expires_at: datetime
+) -> Dict[str, Any]:
+    """Linha da mensagem no mesmo formato que o SELECT * retornaria (id preenchido após o insert)"""
+    return {
+        "id": None,
+        "wa_id": wa_id,
+        "wa_id_received": wa_id_received,
+        "phone_number_id": phone_number_id,
+        "session_id": session_id,
+        "flow_state": None,
+        "message_status": message_status,
+        "is_user_message": int(bool(is_user_message)),
+        "bot_replied": 0,
+        "content": content,
+        # Payload serializado uma única vez (ou já recebido como JSON)
+        "payload": payload if isinstance(payload, str) else orjson.dumps(payload).decode("utf-8"),
+        "create_in": now,
+        "updated_at": now,
+        "expires_at": expires_at,
+        "is_active": 1,
+        "wamid": wamid
+    }
+
+
+def status_lock_query(count: int) -> str:
+    return f"""
+        SELECT id, wamid, wa_id, phone_number_id, session_id, message_status, is_user_message, create_in
+        FROM chat_session_message
+        WHERE wamid IN ({placeholders(count)})
+        FOR UPDATE
+    """
+
+
+def status_update_query(count: int) -> str:
+    """UPDATE forward-only: só avança mensagens com status de ordem menor"""
+    return f"""
+        UPDATE chat_session_message
+        SET message_status = %s
+        WHERE id IN ({placeholders(count)}) AND {STATUS_RANK_SQL} < %s
+    """
+
+
+def plan_statuses(
+    rows: List[Dict[str, Any]],
+    statuses: Dict[str, str]
+) -> Tuple[Dict[str, List[int]], Dict[Tuple[str, str, str], List[Any]]]:
+    """
+    Agrupa as mensagens travadas pelo status de destino e calcula as
+    variações por conversa e sessão. Retorna (ids por status,
+    {(phone_number_id, wa_id, session_id): [variação de não lidas, última
+    lida, variação por status, variação de não lidas do usuário]}); eventos
+    que regrediriam são ignorados.
+    """
+    ids_by_status: Dict[str, List[int]] = {}
+    conversations: Dict[Tuple[str, str, str], List[Any]] = {}
+    for row in rows:
+        status = statuses[row['wamid']]
+        if STATUS_RANK[status] <= STATUS_RANK.get(row['message_status'], 0):
+            continue
+        ids_by_status.setdefault(status, []).append(row['id'])
+
+        key = (row['phone_number_id'], row['wa_id'], row['session_id'])
+        state = conversations.setdefault(key, [0, None, [0] * len(STATUS_COLUMNS), 0])
+        delta = unread_delta(row['message_status'], status)
+        state[0] += delta
+        if row['is_user_message']:
+            state[3] += delta
+        if delta < 0 and (state[1] is None or row['create_in'] > state[1]):
+            state[1] = row['create_in']
+        state[2] = [a + b for a, b in zip(state[2], status_deltas(row['message_status'], status))]
+    return ids_by_status, conversations
+
+
+def empty_timeline(after: Optional[str]) -> Dict[str, Any]:
+    return {"messages": [], "before_cursor": None, "after_cursor": after, "has_more_after": False}
+
+
+def timeline_query(
+    wa_id: str,
+    phone_number_id: str,
+    limit: int,
+    before_keys: Optional[List[Any]],
+    after_keys: Optional[List[Any]],
+    include_payload: bool
+) -> Tuple[str, tuple]:
+    """Página da linha do tempo pelo índice (wa_id, phone_number_id, create_in, id); traz limit + 1"""
+    columns = TIMELINE_COLUMNS + (", payload" if include_payload else "")
+    if after_keys:
+        return f"""
+            SELECT {columns} FROM chat_session_message
+            WHERE wa_id = %s AND phone_number_id = %s
+              AND (create_in > %s OR (create_in = %s AND id > %s))
+            ORDER BY create_in ASC, id ASC
+            LIMIT %s
+        """, (wa_id, phone_number_id, after_keys[0], after_keys[0], after_keys[1], limit + 1)
+    if before_keys:
+        return f"""
+            SELECT {columns} FROM chat_session_message
+            WHERE wa_id = %s AND phone_number_id = %s
+              AND (create_in < %s OR (create_in = %s AND id < %s))
+            ORDER BY create_in DESC, id DESC
+            LIMIT %s
+        """, (wa_id, phone_number_id, before_keys[0], before_keys[0], before_keys[1], limit + 1)
+    return f"""
+        SELECT {columns} FROM chat_session_message
+        WHERE wa_id = %s AND phone_number_id = %s
+        ORDER BY create_in DESC, id DESC
+        LIMIT %s
+    """, (wa_id, phone_number_id, limit + 1)
+
+
+def timeline_page(
+    rows: List[Dict[str, Any]],
+    limit: int,
+    after: Optional[str],
+    after_keys: Optional[List[Any]]
+) -> Dict[str, Any]:
+    """Monta a página (ordem cronológica) e os cursores a partir das limit + 1 linhas"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after_keys:
+        rows.reverse()
+
+    # Mais antigas: só há cursor se a consulta para trás encontrou mais linhas
+    # (ou se a página veio do `after`, onde sempre pode haver anteriores)
+    before_cursor = None
+    after_cursor = after
+    if rows:
+        first, last = rows[0], rows[-1]
+        if has_more or after_keys:
+            before_cursor = encode_cursor("timeline", [first['create_in'], first['id']])
+        after_cursor = encode_cursor("timeline", [last['create_in'], last['id']])
+
+    return {
+        "messages": rows,
+        "before_cursor": before_cursor,
+        "after_cursor": after_cursor,
+        "has_more_after": bool(after_keys) and has_more
+    }
+
+
+# ==================== CONVERSATION STATE ====================
+
+# Contadores da sessão atual: recomeçam quando a mensagem abre outra sessão.
+# Todos comparam last_session_id antes de ele ser sobrescrito (o MySQL aplica
+# as atribuições do UPDATE da esquerda para a direita); lifetime_* acumulam
+# o histórico inteiro da conversa. A linha nova é lida pelo alias `new`.
+# unread_count conta as mensagens da sessão ainda não entregues/lidas (cai
+# quando elas são lidas); unread_user_messages é a parte enviada pelo
+# usuário, o resto é do bot.
+SAME_SESSION = "last_session_id <=> new.last_session_id"
+COLUMN_SEPARATOR = ",\n        "
+SESSION_STATUS_COUNTERS = COLUMN_SEPARATOR.join(
+    f"{column} = IF({SAME_SESSION}, {column}, 0) + new.{column}" for column in STATUS_COLUMNS
+)
+STATUS_COUNTER_DELTAS = COLUMN_SEPARATOR.join(f"{column} = GREATEST({column} + %s, 0)" for column in STATUS_COLUMNS)
+STATUS_COUNTER_SUMS = COLUMN_SEPARATOR.join(f"COALESCE(SUM({column}), 0) AS {column}" for column in STATUS_COLUMNS)
+
+CONVERSATION_STATE_UPSERT = f"""
+    INSERT INTO conversation_state
+        (phone_number_id, wa_id, last_message_id, last_message_content, last_message_at,
+         last_session_id, session_expires_at, total_sessions, total_messages,
+         user_messages, bot_messages, unread_count, unread_user_messages, lifetime_sessions,
+         lifetime_messages, {", ".join(STATUS_COLUMNS)})
+    VALUES (%s, %s, %s, %s, %s, %s, %s, 1, 1, %s, %s, %s, %s, 1, 1, {placeholders(len(STATUS_COLUMNS))}) AS new
+    ON DUPLICATE KEY UPDATE
+        lifetime_sessions = lifetime_sessions + IF({SAME_SESSION}, 0, 1),
+        lifetime_messages = lifetime_messages + 1,
+        total_messages = IF({SAME_SESSION}, total_messages, 0) + 1,
+        user_messages = IF({SAME_SESSION}, user_messages, 0) + new.user_messages,
+        bot_messages = IF({SAME_SESSION}, bot_messages, 0) + new.bot_messages,
+        bot_replies = IF({SAME_SESSION}, bot_replies, 0),
+        unread_count = IF({SAME_SESSION}, unread_count, 0) + new.unread_count,
+        unread_user_messages = IF({SAME_SESSION}, unread_user_messages, 0) + new.unread_user_messages,
+        {SESSION_STATUS_COUNTERS},
+        total_sessions = 1,
+        last_message_id = new.last_message_id,
+        last_message_content = new.last_message_content,
+        last_message_at = new.last_message_at,
+        last_session_id = new.last_session_id,
+        session_expires_at = new.session_expires_at
+"""
+
+# Mudança de status de uma mensagem: só mexe nos contadores se ela é da
+# sessão atual da conversa
+CONVERSATION_STATE_STATUS_UPDATE = f"""
+    UPDATE conversation_state
+    SET unread_count = GREATEST(unread_count + %s, 0),
+        unread_user_messages = GREATEST(unread_user_messages + %s, 0),
+        {STATUS_COUNTER_DELTAS},
+        last_read_at = CASE WHEN %s THEN GREATEST(COALESCE(last_read_at, %s), %s) ELSE last_read_at END
+    WHERE phone_number_id = %s AND wa_id = %s AND last_session_id = %s
+"""
+
+# Conversa deixa de ter sessão ativa se essa era a última
+CONVERSATION_STATE_SESSION_END = """
+    UPDATE conversation_state
+    SET session_expires_at = NULL
+    WHERE last_session_id = %s
+"""
+
+CONVERSATION_STATE_BOT_REPLY = """
+    UPDATE conversation_state cs
+    JOIN chat_session_message m
+      ON m.phone_number_id = cs.phone_number_id AND m.wa_id = cs.wa_id
+     AND m.session_id = cs.last_session_id
+    SET cs.bot_replies = cs.bot_replies + 1
+    WHERE m.id = %s
+"""
+
+CONVERSATION_STATE_COLUMNS = (
+    "cs.wa_id, cs.phone_number_id, c.name AS contact_name, cs.total_sessions, cs.total_messages, "
+    "cs.user_messages, cs.bot_messages, cs.bot_replies, cs.unread_count, cs.unread_user_messages, "
+    "cs.last_message_id, cs.last_message_content, cs.last_message_at, cs.last_read_at, cs.session_expires_at"
+)
+
+# Totais e distribuição por status das sessões ativas, sem ler chat_session_message
+CONVERSATIONS_SUMMARY_QUERY = f"""
+    SELECT
+        COUNT(*) AS total_active_chats,
+        COALESCE(SUM(unread_count > 0), 0) AS unread_chats,
+        COALESCE(SUM(total_messages), 0) AS total_messages,
+        COALESCE(SUM(user_messages), 0) AS user_messages,
+        COALESCE(SUM(bot_messages), 0) AS bot_messages,
+        COALESCE(SUM(bot_replies), 0) AS bot_replies,
+        COALESCE(SUM(total_sessions), 0) AS total_sessions,
+        {STATUS_COUNTER_SUMS}
+    FROM conversation_state
+    WHERE phone_number_id = %s AND session_expires_at > %s
+"""
+
+
+def conversation_state_params(message: Dict[str, Any]) -> tuple:
+    """Parâmetros do CONVERSATION_STATE_UPSERT para a mensagem recém-inserida"""
+    is_user_message = message["is_user_message"]
+    unread = 0 if message["message_status"] in READ_STATUSES else 1
+    return (
+        message["phone_number_id"],
+        message["wa_id"],
+        message["id"],
+        message["content"],
+        message["create_in"],
+        message["session_id"],
+        message["expires_at"],
+        1 if is_user_message else 0,
+        0 if is_user_message else 1,
+        unread,
+        unread if is_user_message else 0,
+        *status_deltas(None, message["message_status"])
+    )
+
+
+def message_status_params(message: Dict[str, Any], status: str) -> tuple:
+    """Parâmetros do CONVERSATION_STATE_STATUS_UPDATE para uma mensagem que mudou de status"""
+    delta = unread_delta(message['message_status'], status)
+    return (
+        delta, delta if message['is_user_message'] else 0,
+        *status_deltas(message['message_status'], status),
+        delta < 0, message['create_in'], message['create_in'],
+        message['phone_number_id'], message['wa_id'], message['session_id']
+    )
+
+
+def status_update_params(conversations: Dict[Tuple[str, str, str], List[Any]]) -> List[tuple]:
+    """Parâmetros do CONVERSATION_STATE_STATUS_UPDATE para o executemany de plan_statuses"""
+    return [
+        (delta, user_delta, *deltas, last_read is not None, last_read, last_read, phone_number_id, wa_id, session_id)
+        for (phone_number_id, wa_id, session_id), (delta, last_read, deltas, user_delta) in conversations.items()
+    ]
+
+
+def active_conversations_queries(phone_number_id: str, unread_only: bool) -> Tuple[str, str, tuple]:
+    """(página, contagem, parâmetros) das conversas com sessão ativa, lidas de conversation_state"""
+    filters = "cs.phone_number_id = %s AND cs.session_expires_at > %s"
+    if unread_only:
+        filters += " AND cs.unread_count > 0"
+    page = f"""
+        SELECT {CONVERSATION_STATE_COLUMNS}
+        FROM conversation_state cs
+        LEFT JOIN contacts c ON c.wa_id = cs.wa_id AND c.create_for_phone_number = cs.phone_number_id
+        WHERE {filters}
+        ORDER BY cs.last_message_at DESC
+        LIMIT %s OFFSET %s
+    """
+    count = f"SELECT COUNT(*) AS total FROM conversation_state cs WHERE {filters}"
+    return page, count, (phone_number_id, datetime.now())
+
+
+def conversations_summary(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Separa os totais da distribuição por status (só os status presentes)"""
+    totals = {key: int(value) for key, value in summary.items()}
+    distribution = {}
+    for column in STATUS_COLUMNS:
+        count = totals.pop(column)
+        if count:
+            distribution[column[len("status_"):]] = count
+    return {"summary": totals, "status_distribution": distribution}
@@ -0,0 +1,102 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE") or 10000)
+
+# (wa_id, wa_id_received, phone_number_id)
+ConversationKey = Tuple[str, str, str]
+
+
+class SessionCache:
+    """
+    Cache LRU em memória da sessão ativa de cada conversa.
+
+    Guarda (session_id, expires_at) por conversa para que o
+    create_session_message não precise do SELECT da última mensagem.
+    Entradas expiradas são tratadas como ausentes.
+
+    O cache é por processo e só é confiável quanto ao expires_at: outro
+    worker pode encerrar a sessão sem invalidar a entrada daqui. Por isso o
+    insert feito a partir de um acerto é condicional à sessão seguir ativa
+    no banco (SESSION_MESSAGE_INSERT_IF_ACTIVE); se não estiver, a entrada é
+    invalidada e a sessão é buscada de novo.
+    """
+
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[ConversationKey, Tuple[str, datetime]]" = OrderedDict()
+        # session_id -> conversa, para invalidar pelo deactivate_session
+        self._by_session: Dict[str, ConversationKey] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: ConversationKey, now: Optional[datetime] = None) -> Optional[Tuple[str, datetime]]:
+        """Retorna (session_id, expires_at) se a sessão ainda estiver válida"""
+        now = now or datetime.now()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if now > entry[1]:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: ConversationKey, session_id: str, expires_at: datetime) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old and old[0] != session_id:
+                self._by_session.pop(old[0], None)
+            self._entries[key] = (session_id, expires_at)
+            self._by_session[session_id] = key
+            while len(self._entries) > self.max_size:
+                evicted_key, (evicted_session, _) = self._entries.popitem(last=False)
+                self._by_session.pop(evicted_session, None)
+                self.evictions += 1
+
+    def invalidate_session(self, session_id: str) -> None:
+        """Remove a conversa que aponta para uma sessão desativada"""
+        with self._lock:
+            key = self._by_session.get(session_id)
+            if key is not None:
+                self._remove(key)
+
+    def _remove(self, key: ConversationKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._by_session.pop(entry[0], None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_session.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Instância global (compartilhada entre db e adb)
+session_cache = SessionCache()
@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL") or 300)
+
+# Query usada para carregar a tabela de roteamento
+SETTINGS_ROUTING_QUERY = """
+    SELECT s.*, o.organization_name, o.activate AS organization_activate
+    FROM settings s
+    LEFT JOIN organization o ON o.id = s.organization_id
+"""
+
+
+class SettingsRegistry:
+    """
+    Tabela de roteamento em memória: phone_number_id -> settings + organização.
+
+    Carregada no startup e recarregada quando invalidada (create/delete de
+    settings) ou depois de SETTINGS_CACHE_TTL segundos, para refletir
+    mudanças feitas por outros processos.
+    """
+
+    def __init__(self, ttl: float = SETTINGS_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_phone: Dict[str, Dict[str, Any]] = {}
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._verify_tokens: set = set()
+        self._loaded_at: Optional[float] = None
+        self._version = 0
+        self.hits = 0
+        self.reloads = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def is_fresh(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def load(self, rows: List[Dict[str, Any]], version: int) -> None:
+        """Substitui a tabela pelas linhas da SETTINGS_ROUTING_QUERY"""
+        by_phone, by_id, tokens = {}, {}, set()
+        for row in rows:
+            row = dict(row)
+            organization = {
+                "id": row.get("organization_id"),
+                "organization_name": row.pop("organization_name", None),
+                "activate": row.pop("organization_activate", None),
+            }
+            tenant = {"settings": row, "organization": organization}
+            by_id[row["id"]] = tenant
+            if row.get("phone_number_id"):
+                by_phone[row["phone_number_id"]] = tenant
+            if row.get("webhook_verify_token"):
+                tokens.add(row["webhook_verify_token"])
+
+        with self._lock:
+            self._by_phone = by_phone
+            self._by_id = by_id
+            self._verify_tokens = tokens
+            self.reloads += 1
+            # Se houve invalidação durante a carga, continua marcado como velho
+            if version == self._version:
+                self._loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._loaded_at = None
+
+    def get(self, phone_number_id: str) -> Optional[Dict[str, Any]]:
+        """Tenant ({"settings", "organization"}) do phone_number_id"""
+        tenant = self._by_phone.get(phone_number_id)
+        if tenant:
+            self.hits += 1
+        return tenant
+
+    def get_by_id(self, settings_id: int) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(settings_id)
+
+    def is_verify_token(self, token: Optional[str]) -> bool:
+        return bool(token) and token in self._verify_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tenants": len(self._by_id),
+            "phone_numbers": len(self._by_phone),
+            "fresh": self.is_fresh(),
+            "hits": self.hits,
+            "reloads": self.reloads,
+        }
+
+
+# Instância global (compartilhada entre db e adb)
+settings_registry = SettingsRegistry()
@@ -1,13 +1,33 @@
 import os
 import mysql.connector
 from mysql.connector import Error
-from typing import Optional, Dict, Any, List
-from datetime import datetime
+from typing import Optional, Dict, Any, Iterable, List, Set, Tuple, Union
+from datetime import datetime, timedelta
 import json
 from dotenv import load_dotenv
 import bcrypt
 import random
 import string
+from src.db.pool import ConnectionPool
+from src.db.session_cache import session_cache
+from src.db.archive import chat_archive
+from src.db.queries import (
+    STATUS_RANK, webhook_insert, PROCESSED_EVENT_INSERT, PROCESSED_EVENT_PRUNE,
+    processed_events_query, latest_contacts, default_profile, contact_params, contacts_upsert,
+    ACTIVE_SESSION_QUERY, LAST_SESSION_QUERY, SESSION_MESSAGE_INSERT,
+    SESSION_MESSAGE_INSERT_IF_ACTIVE, SESSION_MESSAGES_QUERY, SESSION_DEACTIVATE,
+    EXPIRED_SESSIONS_QUERY, sessions_deactivate, conversation_state_sessions_end,
+    USER_SESSIONS_QUERY, MESSAGE_STATUS_LOCK, MESSAGE_STATUS_UPDATE, BOT_REPLIED_UPDATE,
+    FLOW_STATE_UPDATE, resolve_session, session_message_params, session_message_row,
+    status_lock_query, status_update_query, plan_statuses, empty_timeline, timeline_query,
+    timeline_page, CONVERSATION_STATE_UPSERT, CONVERSATION_STATE_STATUS_UPDATE,
+    CONVERSATION_STATE_SESSION_END, CONVERSATION_STATE_BOT_REPLY, CONVERSATIONS_SUMMARY_QUERY,
+    conversation_state_params, message_status_params, status_update_params,
+    active_conversations_queries, conversations_summary
+)
+from src.utils.pagination import encode_cursor, decode_cursor
+from src.db.settings_cache import settings_registry, SETTINGS_ROUTING_QUERY
+from src.db.migrations import run_migrations, applied_versions, pending_migrations, schema_state
 
 load_dotenv()
 
@@ -19,6 +39,8 @@ class DatabaseStorage:
         self.database = os.getenv("DB_NAME")
         self.port = int(os.getenv("DB_PORT") or 3306)
         self.connection = None
+        # Pool de conexões com o banco (evita handshake TCP + auth a cada chamada)
+        self.pool = ConnectionPool(factory=self._connect)
         
     def _hash_password(self, password: str) -> str:
         """Criptografa a senha usando bcrypt"""
@@ -28,17 +50,22 @@ class DatabaseStorage:
         """Verifica se a senha corresponde ao hash"""
         return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
         
+    def _connect(self):
+        """Abre uma conexão nova com o banco (usada pelo pool)"""
+        return mysql.connector.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            port=self.port
+        )
+
     def _get_connection(self, include_db: bool = True):
-        """Cria conexão com o MySQL"""
+        """Pega uma conexão do pool (ou cria uma avulsa sem banco selecionado)"""
         try:
             if include_db:
-                conn = mysql.connector.connect(
-                    host=self.host,
-                    user=self.user,
-                    password=self.password,
-                    database=self.database,
-                    port=self.port
-                )
+                # close() devolve a conexão ao pool
+                conn = self.pool.connection()
             else:
                 conn = mysql.connector.connect(
                     host=self.host,
@@ -54,13 +81,16 @@ class DatabaseStorage:
     def check_connection(self) -> bool:
         """Verifica se consegue conectar ao banco"""
         conn = self._get_connection(include_db=False)
-        if conn and conn.is_connected():
+        if not conn:
+            return False
+        try:
+            return conn.is_connected()
+        finally:
             conn.close()
-            return True
-        return False
 
     def create_database(self) -> bool:
         """Cria o banco de dados se não existir"""
+        conn = None
         try:
             conn = self._get_connection(include_db=False)
             if not conn:
@@ -75,9 +105,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao criar banco de dados: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
 
     def create_tables(self) -> bool:
         """Cria as tabelas se não existirem"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -264,39 +298,101 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao criar tabelas: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
+
+    def schema_versions(self) -> Optional[Set[int]]:
+        """Versões aplicadas do schema (None se o banco/tabela de controle não existe)"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return None
+            cursor = conn.cursor()
+            versions = applied_versions(cursor)
+            cursor.close()
+            conn.close()
+            return versions
+        except Error as e:
+            print(f"Erro ao consultar versão do schema: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def migrate(self, offline: bool = False) -> bool:
+        """Aplica as migrações pendentes do schema (offline=True inclui as de cópia de tabela)"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return False
+            schema_state.applied = run_migrations(self, conn, offline)
+            conn.close()
+            print(f"✓ Schema na versão {max(schema_state.applied)}")
+            return True
+        except (Error, RuntimeError) as e:
+            print(f"Erro ao aplicar migrações: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
 
     def initialize(self) -> bool:
-        """Inicializa o banco de dados completo"""
+        """Inicializa o banco de dados (só confere a versão se o schema já está atualizado)"""
         print("Inicializando banco de dados...")
         
-        if not self.check_connection():
-            print("✗ Não foi possível conectar ao MySQL")
-            return False
-        print("✓ Conexão com MySQL estabelecida")
+        # Caminho rápido: uma consulta de versão
+        versions = self.schema_versions()
+        if versions and not pending_migrations(versions):
+            schema_state.applied = versions
+            print(f"✓ Schema atualizado (versão {max(versions)})")
+        else:
+            if not self.check_connection():
+                print("✗ Não foi possível conectar ao MySQL")
+                return False
+            print("✓ Conexão com MySQL estabelecida")
+            
+            if not self.create_database():
+                print("✗ Erro ao criar/verificar banco de dados")
+                return False
+            
+            if not self.migrate():
+                print("✗ Erro ao aplicar migrações")
+                return False
         
-        if not self.create_database():
-            print("✗ Erro ao criar/verificar banco de dados")
-            return False
+        for migration in schema_state.pending_offline():
+            print(f"⚠ Migração {migration.version} pendente ({migration.description}): "
+                  f"roda offline com `python migrate.py --offline`")
         
-        if not self.create_tables():
-            print("✗ Erro ao criar/verificar tabelas")
-            return False
+        if self.load_settings_registry():
+            print(f"✓ Tabela de roteamento carregada ({settings_registry.stats()['tenants']} settings)")
         
         print("✓ Banco de dados inicializado com sucesso!")
         return True
 
+    def close(self) -> None:
+        """Fecha as conexões do pool"""
+        self.pool.close()
+
     # ==================== WEBHOOK ====================
     
-    def save_webhook(self, webhook_data: Dict[str, Any]) -> Optional[int]:
-        """Salva o payload do webhook completo"""
+    def save_webhook(self, webhook_data: Union[bytes, Dict[str, Any]]) -> Optional[int]:
+        """
+        Salva o payload do webhook completo (JSON comprimido, ver webhook_insert).
+        
+        Recebe de preferência os bytes originais da requisição, gravados como
+        chegaram; um dict é serializado uma vez com orjson.
+        """
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return None
             
             cursor = conn.cursor()
-            query = "INSERT INTO webhook (json) VALUES (%s)"
-            cursor.execute(query, (json.dumps(webhook_data),))
+            cursor.execute(*webhook_insert(webhook_data))
             conn.commit()
             
             webhook_id = cursor.lastrowid
@@ -308,6 +404,64 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao salvar webhook: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
+
+    # ==================== IDEMPOTÊNCIA ====================
+    
+    def find_processed_events(self, keys: List[str]) -> Optional[set]:
+        """
+        Quais dessas chaves já estão em processed_event (eventos já aplicados).
+        None em erro.
+        """
+        if not keys:
+            return set()
+        
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return None
+            
+            cur = conn.cursor()
+            cur.execute(processed_events_query(len(keys)), tuple(keys))
+            found = {row[0] for row in cur.fetchall()}
+            cur.close()
+            conn.close()
+            
+            return found
+        
+        except Error as e:
+            print(f"Erro ao consultar eventos processados: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def prune_processed_events(self, before: datetime, limit: int = 5000) -> Optional[int]:
+        """Apaga até `limit` eventos registrados antes de `before` (índice idx_created_at)"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return None
+            
+            cur = conn.cursor()
+            cur.execute(PROCESSED_EVENT_PRUNE, (before, limit))
+            rows_affected = cur.rowcount
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+            return rows_affected
+        
+        except Error as e:
+            print(f"Erro ao limpar eventos processados: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
 
     # ==================== CONTACTS ====================
     
@@ -319,105 +473,119 @@ class DatabaseStorage:
         timestamp: int
     ) -> bool:
         """Salva ou atualiza um contato com base nas configurações"""
+        return self.save_contacts_batch([{
+            "wa_id": wa_id,
+            "name": name,
+            "phone_number_id": phone_number_id,
+            "timestamp": timestamp
+        }])
+
+    def save_contacts_batch(self, contacts: List[Dict[str, Any]]) -> bool:
+        """
+        Upsert de vários contatos num único INSERT ... ON DUPLICATE KEY UPDATE.
+        
+        Cada item tem wa_id, name, phone_number_id e timestamp. Pode receber os
+        contatos de um payload inteiro ou de vários payloads; repetições da
+        mesma conversa são reduzidas à mais recente antes do insert.
+        """
+        latest = latest_contacts(contacts)
+        if not latest:
+            return True
+        
+        conn = None
         try:
+            params = []
+            for contact in latest.values():
+                # Profile padrão vem das settings do número (tabela de roteamento em memória)
+                tenant = self.get_tenant(contact["phone_number_id"])
+                params.extend(contact_params(contact, default_profile(tenant)))
+            
             conn = self._get_connection()
             if not conn:
                 return False
             
-            cursor = conn.cursor(dictionary=True)
-            
-            # Busca configurações do número
-            cursor.execute(
-                "SELECT default_profile FROM settings WHERE phone_number_id = %s", 
-                (phone_number_id,)
-            )
-            settings = cursor.fetchone()
-            
-            # Define profile e activate_bot baseado nas settings
-            if settings:
-                profile = settings.get('default_profile', 'human')
-                activate_bot = False if profile == 'human' else True
-            else:
-                profile = 'human'
-                activate_bot = False
-            
-            # Verifica se ESTA CONVERSA ESPECÍFICA existe (wa_id + phone_number_id)
-            cursor.execute(
-                "SELECT id, create_in FROM contacts WHERE wa_id = %s AND create_for_phone_number = %s", 
-                (wa_id, phone_number_id)
-            )
-            contact = cursor.fetchone()
-            
-            if contact:
-                # Conversa já existe - atualiza
-                query = """
-                    UPDATE contacts 
-                    SET name = %s, last_message_timestamp = %s 
-                    WHERE wa_id = %s AND create_for_phone_number = %s
-                """
-                cursor.execute(query, (name, timestamp, wa_id, phone_number_id))
-                
-                first_message_date = contact['create_in'].strftime('%d/%m/%Y %H:%M:%S')
-                print(f"✓ Contato {wa_id} ({name}) atualizado")
-                print(f"  └─ Conversa com número: {phone_number_id}")
-                print(f"  └─ Primeira mensagem desta conversa foi em: {first_message_date}")
-                print(f"  └─ Esta é mais uma mensagem nesta conversa")
-            else:
-                # Nova conversa - insere
-                query = """
-                    INSERT INTO contacts 
-                    (wa_id, name, profile, create_for_phone_number, last_message_timestamp, activate_bot, activate_automatic_message) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                cursor.execute(query, (
-                    wa_id, 
-                    name, 
-                    profile, 
-                    phone_number_id, 
-                    timestamp, 
-                    activate_bot, 
-                    False
-                ))
-                
-                now = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-                print(f"✓ Nova conversa criada: {wa_id} ({name}) → {phone_number_id}")
-                print(f"  └─ Esta é a PRIMEIRA mensagem desta conversa")
-                print(f"  └─ Criado em: {now}")
-                print(f"  └─ Profile: {profile}")
-                print(f"  └─ Bot ativado: {activate_bot}")
-            
+            cursor = conn.cursor()
+            cursor.execute(contacts_upsert(len(latest)), params)
             conn.commit()
             cursor.close()
             conn.close()
+            
+            for wa_id, phone_number_id in latest:
+                print(f"✓ Contato {wa_id} salvo/atualizado → {phone_number_id}")
             return True
         except Error as e:
             print(f"Erro ao salvar/atualizar contato: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
+
+    def get_contacts_by_phone_number(
+        self,
+        phone_number_id: str,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Busca contatos por settings (create_for_phone_number) com paginação por cursor.
 
-    def get_contacts_by_phone_number(self, phone_number_id: str, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-        """Busca contatos por settings (create_for_phone_number)"""
+        Ordena por (last_message_timestamp, id) decrescente usando o índice
+        idx_phone_last_message; retorna (contatos, próximo cursor).
+        """
+        after = decode_cursor(cursor, "contacts", 2)
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
-                return []
+                return [], None
             
             cur = conn.cursor(dictionary=True)
-            cur.execute("""
-                SELECT * FROM contacts 
-                WHERE create_for_phone_number = %s 
-                ORDER BY last_message_timestamp DESC
-                LIMIT %s OFFSET %s
-            """, (phone_number_id, limit, skip))
+            if after is None:
+                cur.execute("""
+                    SELECT * FROM contacts 
+                    WHERE create_for_phone_number = %s 
+                    ORDER BY last_message_timestamp DESC, id DESC
+                    LIMIT %s
+                """, (phone_number_id, limit + 1))
+            elif after[0] is None:
+                # Já estamos nos contatos sem timestamp (ficam no fim)
+                cur.execute("""
+                    SELECT * FROM contacts 
+                    WHERE create_for_phone_number = %s 
+                      AND last_message_timestamp IS NULL AND id < %s
+                    ORDER BY last_message_timestamp DESC, id DESC
+                    LIMIT %s
+                """, (phone_number_id, after[1], limit + 1))
+            else:
+                cur.execute("""
+                    SELECT * FROM contacts 
+                    WHERE create_for_phone_number = %s 
+                      AND (last_message_timestamp < %s
+                           OR (last_message_timestamp = %s AND id < %s)
+                           OR last_message_timestamp IS NULL)
+                    ORDER BY last_message_timestamp DESC, id DESC
+                    LIMIT %s
+                """, (phone_number_id, after[0], after[0], after[1], limit + 1))
             rows = cur.fetchall()
             cur.close()
             conn.close()
-            return rows
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                next_cursor = encode_cursor("contacts", [last['last_message_timestamp'], last['id']])
+            return rows, next_cursor
         except Error as e:
             print(f"Erro ao buscar contatos: {e}")
-            return []
+            return [], None
+        finally:
+            if conn:
+                conn.close()
 
     def get_contact(self, contact_id: int) -> Optional[Dict[str, Any]]:
         """Busca um contato pelo ID"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -432,9 +600,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao buscar contato: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def update_contact_name(self, contact_id: int, name: str) -> Dict[str, Any]:
         """Atualiza o nome do contato"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -463,9 +635,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar nome do contato: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     def set_contact_automatic_message(self, contact_id: int, activate: bool) -> Dict[str, Any]:
         """Ativa/Desativa mensagem automática"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -498,9 +674,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar mensagem automática: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     def set_contact_bot(self, contact_id: int, activate: bool) -> Dict[str, Any]:
         """Ativa/Desativa bot do contato"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -534,11 +714,58 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar bot do contato: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     # ==================== SETTINGS ====================
     
+    def load_settings_registry(self) -> bool:
+        """Carrega a tabela de roteamento phone_number_id -> settings/organização"""
+        conn = None
+        try:
+            version = settings_registry.version
+            conn = self._get_connection()
+            if not conn:
+                return False
+            
+            cur = conn.cursor(dictionary=True)
+            cur.execute(SETTINGS_ROUTING_QUERY)
+            rows = cur.fetchall()
+            cur.close()
+            conn.close()
+            
+            settings_registry.load(rows, version)
+            return True
+        except Error as e:
+            print(f"Erro ao carregar tabela de roteamento: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    def get_tenant(self, phone_number_id: str) -> Optional[Dict[str, Any]]:
+        """Resolve settings + organização de um phone_number_id sem ir ao banco"""
+        if not settings_registry.is_fresh():
+            self.load_settings_registry()
+        return settings_registry.get(phone_number_id)
+
+    def is_webhook_verify_token(self, token: Optional[str]) -> bool:
+        """Verifica se o token pertence a algum settings cadastrado"""
+        if not settings_registry.is_fresh():
+            self.load_settings_registry()
+        return settings_registry.is_verify_token(token)
+
     def get_settings(self, phone_number_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Busca as configurações do sistema"""
+        if settings_registry.is_fresh() or self.load_settings_registry():
+            if phone_number_id:
+                tenant = settings_registry.get(phone_number_id)
+            else:
+                tenant = settings_registry.get_by_id(1)
+            return dict(tenant["settings"]) if tenant else None
+        
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -562,11 +789,15 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao buscar configurações: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     # ==================== ORGANIZATION ====================
     
     def create_organization(self, organization_name: str, create_by: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """Cria organização e vincula criador como user_creator"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -597,9 +828,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao criar organização: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def deactivate_organization(self, org_id: int) -> Optional[Dict[str, Any]]:
         """Desativa organização"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -607,6 +842,7 @@ class DatabaseStorage:
             cur = conn.cursor(dictionary=True)
             cur.execute("UPDATE organization SET activate = FALSE WHERE id = %s", (org_id,))
             conn.commit()
+            settings_registry.invalidate()
             cur.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
             org = cur.fetchone()
             cur.close()
@@ -615,9 +851,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao desativar organização: {e}")
             return None
-    
+        finally:
+            if conn:
+                conn.close()
+
     def activate_organization(self, org_id: int) -> Optional[Dict[str, Any]]:
         """Ativa organização"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -625,6 +865,7 @@ class DatabaseStorage:
             cur = conn.cursor(dictionary=True)
             cur.execute("UPDATE organization SET activate = TRUE WHERE id = %s", (org_id,))
             conn.commit()
+            settings_registry.invalidate()
             cur.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
             org = cur.fetchone()
             cur.close()
@@ -633,9 +874,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao ativar organização: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def update_organization_name(self, org_id: int, new_name: str) -> Optional[Dict[str, Any]]:
         """Atualiza nome da organização"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -643,6 +888,7 @@ class DatabaseStorage:
             cur = conn.cursor(dictionary=True)
             cur.execute("UPDATE organization SET organization_name = %s WHERE id = %s", (new_name, org_id))
             conn.commit()
+            settings_registry.invalidate()
             cur.execute("SELECT * FROM organization WHERE id = %s", (org_id,))
             org = cur.fetchone()
             cur.close()
@@ -651,9 +897,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar nome da organização: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def list_organization_users(self, organization_id: int) -> List[Dict[str, Any]]:
         """Lista usuários vinculados a uma organização."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -673,12 +923,16 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao listar usuários da organização: {e}")
             return []
+        finally:
+            if conn:
+                conn.close()
 
     # ==================== SETTINGS (por organização) ====================
     def create_settings(self, organization_id: int, default_bot: Optional[str], default_profile: Optional[str],
                         wa_id: Optional[str], phone_number_id: Optional[str],
                         webhook_verify_token: Optional[str], meta_token: Optional[str]) -> Optional[Dict[str, Any]]:
         """Cria settings para a organização"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -694,13 +948,18 @@ class DatabaseStorage:
             row = cur.fetchone()
             cur.close()
             conn.close()
+            settings_registry.invalidate()
             return row
         except Error as e:
             print(f"Erro ao criar settings: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def delete_settings(self, settings_id: int) -> bool:
         """Remove settings por ID"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -710,14 +969,19 @@ class DatabaseStorage:
             conn.commit()
             cur.close()
             conn.close()
+            settings_registry.invalidate()
             return True
         except Error as e:
             print(f"Erro ao remover settings: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
 
     # ==================== USERS ====================
     def create_user(self, name: str, email: str, password: str) -> Optional[Dict[str, Any]]:
         """Cria um novo usuário (senha com bcrypt)."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -748,28 +1012,42 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao criar usuário: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
-    def get_users(self, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-        """Lista usuários com paginação."""
+    def get_users(self, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lista usuários com paginação por cursor (id crescente)."""
+        after = decode_cursor(cursor, "users", 1)
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
-                return []
+                return [], None
             cur = conn.cursor(dictionary=True)
             cur.execute(
-                "SELECT id, name, email, create_in, activate FROM users LIMIT %s OFFSET %s",
-                (limit, skip)
+                "SELECT id, name, email, create_in, activate FROM users WHERE id > %s ORDER BY id LIMIT %s",
+                (after[0] if after else 0, limit + 1)
             )
             rows = cur.fetchall()
             cur.close()
             conn.close()
-            return rows
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor("users", [rows[-1]['id']])
+            return rows, next_cursor
         except Error as e:
             print(f"Erro ao buscar usuários: {e}")
-            return []
+            return [], None
+        finally:
+            if conn:
+                conn.close()
 
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Busca um usuário pelo ID."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -783,9 +1061,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao buscar usuário: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def update_user_name(self, user_id: int, name: str) -> Optional[Dict[str, Any]]:
         """Atualiza o nome do usuário."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -801,9 +1083,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar usuário: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def update_user_password(self, user_id: int, password: str) -> bool:
         """Atualiza a senha do usuário (bcrypt)."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -818,9 +1104,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar senha: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
 
     def deactivate_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Desativa a conta do usuário."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -836,9 +1126,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao desativar usuário: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def activate_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Ativa a conta do usuário."""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -854,12 +1148,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao ativar usuário: {e}")
             return None
-        
-    # coe 
+        finally:
+            if conn:
+                conn.close()
 
-    
     def get_organization(self, org_id: int) -> Optional[Dict[str, Any]]:
         """Busca uma organização pelo ID"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -875,25 +1170,42 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao buscar organização: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
-    def get_all_organizations(self, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-        """Lista todas as organizações"""
+    def get_all_organizations(self, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Lista todas as organizações com paginação por cursor (id crescente)"""
+        after = decode_cursor(cursor, "organizations", 1)
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
-                return []
+                return [], None
             cur = conn.cursor(dictionary=True)
-            cur.execute("SELECT * FROM organization LIMIT %s OFFSET %s", (limit, skip))
+            cur.execute(
+                "SELECT * FROM organization WHERE id > %s ORDER BY id LIMIT %s",
+                (after[0] if after else 0, limit + 1)
+            )
             rows = cur.fetchall()
             cur.close()
             conn.close()
-            return rows
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor("organizations", [rows[-1]['id']])
+            return rows, next_cursor
         except Error as e:
             print(f"Erro ao listar organizações: {e}")
-            return []
+            return [], None
+        finally:
+            if conn:
+                conn.close()
 
     def get_user_organizations(self, user_id: int) -> List[Dict[str, Any]]:
         """Lista todas as organizações que o usuário participa"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -912,9 +1224,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao listar organizações do usuário: {e}")
             return []
+        finally:
+            if conn:
+                conn.close()
 
     def get_organization_settings(self, organization_id: int) -> List[Dict[str, Any]]:
         """Lista todos os settings de uma organização"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -928,10 +1244,14 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao listar settings da organização: {e}")
             return []
+        finally:
+            if conn:
+                conn.close()
 
     # ==================== ORGANIZATION USERS (com validações) ====================
     def add_user_to_organization(self, organization_id: int, user_id: int, role: str = 'user') -> Dict[str, Any]:
         """Vincula um usuário à organização com validações"""
+        conn = None
         try:
             if role not in ('user', 'user_admin', 'user_creator'):
                 role = 'user'
@@ -979,9 +1299,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao vincular usuário à organização: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     def remove_user_from_organization(self, organization_id: int, user_id: int) -> Dict[str, Any]:
         """Remove vínculo com validações"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -1012,9 +1336,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao remover usuário da organização: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     def update_organization_user_role(self, organization_id: int, user_id: int, role: str) -> Dict[str, Any]:
         """Atualiza role com validações"""
+        conn = None
         try:
             if role not in ('user', 'user_admin', 'user_creator'):
                 return {"success": False, "message": f"Role '{role}' inválido. Use: user, user_admin ou user_creator"}
@@ -1048,9 +1376,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar role: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     def set_organization_user_active(self, organization_id: int, user_id: int, active: bool) -> Dict[str, Any]:
         """Ativa/Desativa com validações"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -1082,9 +1414,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao atualizar ativação: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     def reset_user_password(self, email: str) -> Dict[str, Any]:
         """Reseta a senha do usuário e retorna a nova senha"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -1129,9 +1465,13 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao resetar senha: {e}")
             return {"success": False, "message": f"Erro: {str(e)}"}
+        finally:
+            if conn:
+                conn.close()
 
     def authenticate_user(self, email: str, password: str) -> Optional[Dict[str, Any]]:
         """Autentica usuário por email e senha"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
@@ -1164,28 +1504,22 @@ class DatabaseStorage:
         except Error as e:
             print(f"Erro ao autenticar usuário: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     # ==================== CHAT SESSION MESSAGE ====================
     
     def get_active_session(self, wa_id: str, wa_id_received: str, phone_number_id: str) -> Optional[Dict[str, Any]]:
         """Busca sessão ativa (última mensagem não expirada)"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return None
             
             cur = conn.cursor(dictionary=True)
-            
-            # Busca última mensagem da conversa
-            cur.execute("""
-                SELECT * FROM chat_session_message
-                WHERE wa_id = %s 
-                  AND wa_id_received = %s 
-                  AND phone_number_id = %s
-                  AND is_active = TRUE
-                ORDER BY create_in DESC
-                LIMIT 1
-            """, (wa_id, wa_id_received, phone_number_id))
+            cur.execute(ACTIVE_SESSION_QUERY, (wa_id, wa_id_received, phone_number_id, datetime.now()))
             
             last_message = cur.fetchone()
             cur.close()
@@ -1194,17 +1528,19 @@ class DatabaseStorage:
             if not last_message:
                 return None
             
-            # Verifica se sessão expirou
-            if datetime.now() > last_message['expires_at']:
-                # Marca como inativa
-                self.deactivate_session(last_message['session_id'])
-                return None
-            
+            session_cache.set(
+                (wa_id, wa_id_received, phone_number_id),
+                last_message['session_id'],
+                last_message['expires_at']
+            )
             return last_message
-            
+        
         except Error as e:
             print(f"Erro ao buscar sessão ativa: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def create_session_message(
         self,
@@ -1212,224 +1548,426 @@ class DatabaseStorage:
         wa_id_received: str,
         phone_number_id: str,
         content: str,
-        payload: Dict[str, Any],
+        payload: Union[Dict[str, Any], str],
         is_user_message: bool = True,
-        message_status: str = 'sent'
+        message_status: str = 'sent',
+        wamid: Optional[str] = None,
+        event_key: Optional[str] = None
     ) -> Optional[Dict[str, Any]]:
-        """Cria nova mensagem na sessão (cria sessão se necessário)"""
+        """
+        Cria nova mensagem na sessão (cria sessão se necessário).
+        
+        Busca da sessão, insert e montagem do retorno acontecem numa única
+        transação e numa única conexão; a linha criada é montada a partir dos
+        valores inseridos, sem SELECT de volta.
+        
+        `event_key` (message:<wamid> do webhook) entra em processed_event na
+        mesma transação; se outro worker já gravou o evento, nada é inserido
+        e retorna None.
+        """
+        conn = None
         try:
-            import uuid
-            from datetime import timedelta
-            
             conn = self._get_connection()
             if not conn:
                 return None
             
             cur = conn.cursor(dictionary=True)
+            if event_key:
+                cur.execute(PROCESSED_EVENT_INSERT, (event_key,))
+                if not cur.rowcount:
+                    conn.rollback()
+                    cur.close()
+                    conn.close()
+                    print(f"↺ Evento {event_key} já processado")
+                    return None
+            
+            now = datetime.now().replace(microsecond=0)
+            key = (wa_id, wa_id_received, phone_number_id)
+            # Calcula expiração (24h a partir de agora); a sessão é resolvida abaixo
+            expires_at = now + timedelta(hours=24)
+            message = session_message_row(
+                wa_id, wa_id_received, phone_number_id, None, content, payload,
+                is_user_message, message_status, wamid, now, expires_at
+            )
             
-            # Verifica se existe sessão ativa
-            active_session = self.get_active_session(wa_id, wa_id_received, phone_number_id)
-            
-            if active_session:
-                # Usa sessão existente
-                session_id = active_session['session_id']
-                print(f"✓ Usando sessão existente: {session_id}")
-            else:
-                # Cria nova sessão
-                session_id = str(uuid.uuid4())
-                print(f"✓ Nova sessão criada: {session_id}")
-            
-            # Calcula expiração (24h a partir de agora)
-            expires_at = datetime.now() + timedelta(hours=24)
+            # Sessão em cache evita o SELECT da última mensagem; o insert confere
+            # que ela segue ativa (o cache só é confiável quanto ao expires_at)
+            inserted = False
+            cached = session_cache.get(key, now)
+            if cached:
+                message["session_id"] = resolve_session({"session_id": cached[0], "expires_at": cached[1]}, now)
+                cur.execute(SESSION_MESSAGE_INSERT_IF_ACTIVE, session_message_params(message) + (cached[0],))
+                inserted = cur.rowcount > 0
+                if not inserted:
+                    print(f"↺ Sessão {cached[0]} encerrada por outro processo")
+                    session_cache.invalidate_session(cached[0])
+            
+            if not inserted:
+                # Última mensagem ativa e não expirada da conversa (mesma transação do insert)
+                cur.execute(LAST_SESSION_QUERY, (wa_id, wa_id_received, phone_number_id, now))
+                message["session_id"] = resolve_session(cur.fetchone(), now)
+                cur.execute(SESSION_MESSAGE_INSERT, session_message_params(message))
+            
+            # Atualiza o resumo da conversa na mesma transação
+            message["id"] = cur.lastrowid
+            cur.execute(CONVERSATION_STATE_UPSERT, conversation_state_params(message))
             
-            # Insere mensagem
-            cur.execute("""
-                INSERT INTO chat_session_message 
-                (wa_id, wa_id_received, phone_number_id, session_id, content, payload, 
-                 is_user_message, message_status, expires_at, is_active)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                wa_id,
-                wa_id_received,
-                phone_number_id,
-                session_id,
-                content,
-                json.dumps(payload),
-                is_user_message,
-                message_status,
-                expires_at,
-                True
-            ))
-            
-            message_id = cur.lastrowid
             conn.commit()
-            
-            # Busca mensagem criada
-            cur.execute("SELECT * FROM chat_session_message WHERE id = %s", (message_id,))
-            message = cur.fetchone()
-            
             cur.close()
             conn.close()
+            session_cache.set(key, message["session_id"], expires_at)
             
-            print(f"  └─ Mensagem ID {message_id} salva na sessão")
+            print(f"  └─ Mensagem ID {message['id']} salva na sessão")
             print(f"  └─ Expira em: {expires_at.strftime('%d/%m/%Y %H:%M:%S')}")
             
             return message
-            
+        
         except Error as e:
             print(f"Erro ao criar mensagem na sessão: {e}")
             return None
+        finally:
+            if conn:
+                conn.close()
 
     def deactivate_session(self, session_id: str) -> bool:
         """Desativa todas as mensagens de uma sessão"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return False
             
             cur = conn.cursor()
-            cur.execute("""
-                UPDATE chat_session_message 
-                SET is_active = FALSE 
-                WHERE session_id = %s
-            """, (session_id,))
+            cur.execute(SESSION_DEACTIVATE, (session_id,))
+            rows_affected = cur.rowcount
+            cur.execute(CONVERSATION_STATE_SESSION_END, (session_id,))
             conn.commit()
             
-            rows_affected = cur.rowcount
             cur.close()
             conn.close()
             
+            session_cache.invalidate_session(session_id)
             print(f"✓ Sessão {session_id} desativada ({rows_affected} mensagens)")
             return True
-            
+        
         except Error as e:
             print(f"Erro ao desativar sessão: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
+
+    def deactivate_expired_sessions(self, limit: int = 1000) -> Optional[int]:
+        """
+        Desativa até `limit` sessões expiradas (sem nenhuma mensagem válida).
+        
+        A sessão é desativada inteira pelo session_id, junto com o
+        session_expires_at de conversation_state e o cache de sessões. Lote
+        limitado para não segurar locks por muito tempo; o SessionSweeper
+        repete até sobrar menos que `limit`. Retorna as sessões desativadas.
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return None
+            
+            cur = conn.cursor()
+            now = datetime.now()
+            cur.execute(EXPIRED_SESSIONS_QUERY, (now, now, limit))
+            session_ids = [row[0] for row in cur.fetchall()]
+            if session_ids:
+                cur.execute(sessions_deactivate(len(session_ids)), tuple(session_ids))
+                cur.execute(conversation_state_sessions_end(len(session_ids)), tuple(session_ids))
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+            for session_id in session_ids:
+                session_cache.invalidate_session(session_id)
+            return len(session_ids)
+        
+        except Error as e:
+            print(f"Erro ao desativar sessões expiradas: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
 
     def get_session_messages(self, session_id: str) -> List[Dict[str, Any]]:
         """Lista todas as mensagens de uma sessão"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return []
             
             cur = conn.cursor(dictionary=True)
-            cur.execute("""
-                SELECT * FROM chat_session_message
-                WHERE session_id = %s
-                ORDER BY create_in ASC
-            """, (session_id,))
+            cur.execute(SESSION_MESSAGES_QUERY, (session_id,))
             
             messages = cur.fetchall()
             cur.close()
             conn.close()
             
-            return messages
-            
+            # Sessão que começou num mês já arquivado (PartitionArchiver)
+            return chat_archive.session_messages(session_id, messages)
+        
         except Error as e:
             print(f"Erro ao buscar mensagens da sessão: {e}")
             return []
+        finally:
+            if conn:
+                conn.close()
 
     def update_message_status(self, message_id: int, status: str) -> bool:
         """Atualiza status da mensagem (sent, delivered, read, failed)"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return False
             
-            cur = conn.cursor()
-            cur.execute("""
-                UPDATE chat_session_message 
-                SET message_status = %s 
-                WHERE id = %s
-            """, (status, message_id))
+            cur = conn.cursor(dictionary=True)
+            cur.execute(MESSAGE_STATUS_LOCK, (message_id,))
+            message = cur.fetchone()
+            cur.execute(MESSAGE_STATUS_UPDATE, (status, message_id))
+            
+            # Mantém os contadores da sessão atual da conversa
+            if message and message['message_status'] != status:
+                cur.execute(CONVERSATION_STATE_STATUS_UPDATE, message_status_params(message, status))
             conn.commit()
             cur.close()
             conn.close()
             
             return True
-            
+        
         except Error as e:
             print(f"Erro ao atualizar status da mensagem: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
+
+    def apply_message_statuses(self, statuses: Dict[str, str], event_keys: Iterable[str] = ()) -> Optional[int]:
+        """
+        Aplica status de entrega/leitura da Meta ({wamid: status}) em lote.
+        
+        Um UPDATE por status de destino; o status só avança (sent < delivered
+        < read < failed), então eventos atrasados não regridem uma mensagem
+        já lida. As chaves dos eventos (status:<wamid>:<status>) entram em
+        processed_event na mesma transação. Retorna quantas mensagens mudaram
+        (None em erro).
+        """
+        if not statuses:
+            return 0
+        
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return None
+            
+            cur = conn.cursor(dictionary=True)
+            cur.execute(status_lock_query(len(statuses)), tuple(statuses))
+            ids_by_status, conversations = plan_statuses(cur.fetchall(), statuses)
+            
+            updated = 0
+            for status, ids in ids_by_status.items():
+                cur.execute(status_update_query(len(ids)), (status, *ids, STATUS_RANK[status]))
+                updated += cur.rowcount
+            
+            if conversations:
+                cur.executemany(CONVERSATION_STATE_STATUS_UPDATE, status_update_params(conversations))
+            keys = [(key,) for key in event_keys]
+            if keys:
+                cur.executemany(PROCESSED_EVENT_INSERT, keys)
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+            return updated
+        
+        except Error as e:
+            print(f"Erro ao aplicar status das mensagens: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
 
     def mark_bot_replied(self, message_id: int) -> bool:
         """Marca que o bot respondeu a mensagem"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return False
             
             cur = conn.cursor()
-            cur.execute("""
-                UPDATE chat_session_message 
-                SET bot_replied = TRUE 
-                WHERE id = %s
-            """, (message_id,))
+            cur.execute(BOT_REPLIED_UPDATE, (message_id,))
+            if cur.rowcount:
+                cur.execute(CONVERSATION_STATE_BOT_REPLY, (message_id,))
             conn.commit()
             cur.close()
             conn.close()
             
             return True
-            
+        
         except Error as e:
             print(f"Erro ao marcar bot replied: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
 
     def update_flow_state(self, message_id: int, flow_state: Dict[str, Any]) -> bool:
         """Atualiza o estado do flow"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return False
             
             cur = conn.cursor()
-            cur.execute("""
-                UPDATE chat_session_message 
-                SET flow_state = %s 
-                WHERE id = %s
-            """, (json.dumps(flow_state), message_id))
+            cur.execute(FLOW_STATE_UPDATE, (json.dumps(flow_state), message_id))
             conn.commit()
             cur.close()
             conn.close()
             
             return True
-            
+        
         except Error as e:
             print(f"Erro ao atualizar flow state: {e}")
             return False
+        finally:
+            if conn:
+                conn.close()
 
     def get_user_sessions(self, wa_id: str, phone_number_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Lista últimas sessões do usuário"""
+        conn = None
         try:
             conn = self._get_connection()
             if not conn:
                 return []
             
             cur = conn.cursor(dictionary=True)
-            cur.execute("""
-                SELECT DISTINCT session_id, wa_id, wa_id_received, phone_number_id,
-                       MIN(create_in) as session_start,
-                       MAX(create_in) as last_message,
-                       MAX(expires_at) as expires_at,
-                       MAX(is_active) as is_active,
-                       COUNT(*) as message_count
-                FROM chat_session_message
-                WHERE wa_id = %s AND phone_number_id = %s
-                GROUP BY session_id, wa_id, wa_id_received, phone_number_id
-                ORDER BY last_message DESC
-                LIMIT %s
-            """, (wa_id, phone_number_id, limit))
+            cur.execute(USER_SESSIONS_QUERY, (wa_id, phone_number_id, limit))
             
             sessions = cur.fetchall()
             cur.close()
             conn.close()
             
-            return sessions
-            
+            # Sessões (ou o começo delas) em meses já arquivados
+            return chat_archive.complete_sessions(sessions, wa_id, phone_number_id, limit)
+        
         except Error as e:
             print(f"Erro ao buscar sessões do usuário: {e}")
             return []
+        finally:
+            if conn:
+                conn.close()
+
+    def get_conversation_timeline(
+        self,
+        wa_id: str,
+        phone_number_id: str,
+        limit: int = 50,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        include_payload: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Página da linha do tempo de uma conversa numa única consulta.
+        
+        Usa o índice (wa_id, phone_number_id, create_in, id). Sem cursor traz as
+        mensagens mais recentes; `before` pagina para trás e `after` busca as
+        mais novas. As mensagens voltam em ordem cronológica.
+        """
+        before_keys = decode_cursor(before, "timeline", 2)
+        after_keys = decode_cursor(after, "timeline", 2)
+        
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return empty_timeline(after)
+            
+            cur = conn.cursor(dictionary=True)
+            cur.execute(*timeline_query(wa_id, phone_number_id, limit, before_keys, after_keys, include_payload))
+            rows = cur.fetchall()
+            cur.close()
+            conn.close()
+            
+            # Meses antigos saem do banco para o arquivo em disco (PartitionArchiver)
+            rows = chat_archive.complete_timeline(
+                rows, wa_id, phone_number_id, limit + 1, before_keys, after_keys, include_payload
+            )
+            return timeline_page(rows, limit, after, after_keys)
+        except Error as e:
+            print(f"Erro ao buscar linha do tempo da conversa: {e}")
+            return empty_timeline(after)
+        finally:
+            if conn:
+                conn.close()
+
+    def get_active_conversations(
+        self,
+        phone_number_id: str,
+        limit: int = 50,
+        skip: int = 0,
+        unread_only: bool = False
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Conversas com sessão ativa do número, mais recentes primeiro.
+        
+        Lê o resumo mantido em conversation_state (sem agregar as mensagens).
+        Retorna (página, total).
+        """
+        page_query, count_query, params = active_conversations_queries(phone_number_id, unread_only)
+        
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return [], 0
+            
+            cur = conn.cursor(dictionary=True)
+            cur.execute(page_query, params + (limit, skip))
+            conversations = cur.fetchall()
+            
+            cur.execute(count_query, params)
+            total = cur.fetchone()['total']
+            cur.close()
+            conn.close()
+            return conversations, total
+        except Error as e:
+            print(f"Erro ao listar conversas ativas: {e}")
+            return [], 0
+        finally:
+            if conn:
+                conn.close()
+
+    def get_conversations_summary(self, phone_number_id: str) -> Optional[Dict[str, Any]]:
+        """Totais das conversas com sessão ativa do número (a partir de conversation_state)"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            if not conn:
+                return None
+            
+            cur = conn.cursor(dictionary=True)
+            cur.execute(CONVERSATIONS_SUMMARY_QUERY, (phone_number_id, datetime.now()))
+            summary = cur.fetchone()
+            cur.close()
+            conn.close()
+            
+            return conversations_summary(summary)
+        except Error as e:
+            print(f"Erro ao buscar resumo das conversas: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
 
 # Instância global
 db = DatabaseStorage()
\ No newline at end of file
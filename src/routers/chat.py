@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, status, Query, Depends
 from pydantic import BaseModel
 from typing import Optional, List
 from src.db.storage import db
+from src.utils.fast_json import FastJSONResponse
 router = APIRouter(
     prefix="/chat",
     tags=["Chat"]
@@ -14,6 +15,7 @@ class MessageCreate(BaseModel):
     phone_number_id: str
     content: str
     is_user_message: bool = True
+    wamid: Optional[str] = None  # id retornado pela API da Meta no envio
 
 class MessageStatusUpdate(BaseModel):
     status: str  # sent, delivered, read, failed
@@ -54,11 +56,12 @@ def get_session_messages(session_id: str):
     if not messages:
         raise HTTPException(status_code=404, detail="Sessão não encontrada")
     
-    return {
+    # Resposta pronta: pula o jsonable_encoder (listas grandes de mensagens)
+    return FastJSONResponse({
         "session_id": session_id,
         "total": len(messages),
         "messages": messages
-    }
+    })
 
 @router.get("/active-session")
 def get_active_session(
@@ -92,7 +95,8 @@ def create_message(payload: MessageCreate):
         content=payload.content,
         payload={"content": payload.content, "is_user_message": payload.is_user_message},
         is_user_message=payload.is_user_message,
-        message_status='sent'
+        message_status='sent',
+        wamid=payload.wamid
     )
     
     if not message:
@@ -159,44 +163,49 @@ def get_conversation(
     wa_id: str,
     wa_id_received: str,
     phone_number_id: str,
-    limit: int = Query(50, ge=1, le=200)
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None, description="before_cursor: página de mensagens mais antigas"),
+    after: Optional[str] = Query(None, description="after_cursor: mensagens mais novas que a página atual"),
+    include_payload: bool = Query(False, description="Inclui o payload bruto de cada mensagem"),
+    include_sessions: bool = Query(True, description="Inclui sessions/total_sessions (false evita a consulta extra ao paginar)")
 ):
-    """Busca a conversa completa entre dois usuários"""
-    sessions = db.get_user_sessions(wa_id, phone_number_id, limit)
+    """
+    Busca a conversa entre dois usuários, paginada por cursor (uma consulta por página).
     
-    if not sessions:
-        return {
-            "wa_id": wa_id,
-            "wa_id_received": wa_id_received,
-            "phone_number_id": phone_number_id,
-            "total_messages": 0,
-            "sessions": [],
-            "messages": []
-        }
+    sessions/total_sessions continuam na resposta (últimas `limit` sessões);
+    clientes que só paginam as mensagens podem desligar com include_sessions=false.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use apenas before ou after")
     
-    # Coleta todas as mensagens de todas as sessões
-    all_messages = []
-    for session in sessions:
-        messages = db.get_session_messages(session['session_id'])
-        all_messages.extend(messages)
+    try:
+        page = db.get_conversation_timeline(
+            wa_id, phone_number_id, limit,
+            before=before, after=after, include_payload=include_payload
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Ordena por data
-    all_messages.sort(key=lambda x: x['create_in'])
+    sessions = db.get_user_sessions(wa_id, phone_number_id, limit) if include_sessions else None
     
-    return {
+    return FastJSONResponse({
         "wa_id": wa_id,
         "wa_id_received": wa_id_received,
         "phone_number_id": phone_number_id,
-        "total_messages": len(all_messages),
-        "total_sessions": len(sessions),
+        "total_messages": len(page["messages"]),
+        "total_sessions": len(sessions) if sessions is not None else None,
         "sessions": sessions,
-        "messages": all_messages
-    }
+        "before_cursor": page["before_cursor"],
+        "after_cursor": page["after_cursor"],
+        "has_more_after": page["has_more_after"],
+        "messages": page["messages"]
+    })
 
 @router.get("/statistics/{phone_number_id}")
 def get_chat_statistics(phone_number_id: str):
     """Retorna estatísticas de chat para um número"""
     # Busca todas as mensagens do número
+    conn = None
     try:
         conn = db._get_connection()
         if not conn:
@@ -260,6 +269,9 @@ def get_chat_statistics(phone_number_id: str):
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro: {str(e)}")
+    finally:
+        if conn:
+            conn.close()
 
 @router.get("/active-chats/{phone_number_id}")
 def get_active_chats(
@@ -269,48 +281,7 @@ def get_active_chats(
 ):
     """Retorna todos os chats ativos (conversas) para um phone_number_id"""
     try:
-        conn = db._get_connection()
-        if not conn:
-            raise HTTPException(status_code=500, detail="Erro ao conectar ao banco")
-        
-        cur = conn.cursor(dictionary=True)
-        
-        # Busca todas as conversas ativas agrupadas por wa_id
-        cur.execute("""
-            SELECT 
-                wa_id,
-                phone_number_id,
-                MAX(c.name) as contact_name,
-                COUNT(DISTINCT csm.session_id) as total_sessions,
-                COUNT(csm.id) as total_messages,
-                SUM(CASE WHEN csm.is_user_message = TRUE THEN 1 ELSE 0 END) as user_messages,
-                SUM(CASE WHEN csm.is_user_message = FALSE THEN 1 ELSE 0 END) as bot_messages,
-                SUM(CASE WHEN csm.bot_replied = TRUE THEN 1 ELSE 0 END) as bot_replies,
-                MAX(csm.create_in) as last_message_at,
-                MAX(CASE WHEN csm.is_active = TRUE THEN csm.expires_at END) as session_expires_at,
-                MAX(csm.is_active) as has_active_session,
-                MAX(CASE WHEN csm.message_status IN ('delivered', 'read') THEN csm.create_in END) as last_read_at
-            FROM chat_session_message csm
-            LEFT JOIN contacts c ON csm.wa_id = c.wa_id AND csm.phone_number_id = c.create_for_phone_number
-            WHERE csm.phone_number_id = %s AND csm.is_active = TRUE
-            GROUP BY csm.wa_id, csm.phone_number_id
-            ORDER BY csm.create_in DESC
-            LIMIT %s OFFSET %s
-        """, (phone_number_id, limit, skip))
-        
-        chats = cur.fetchall()
-        
-        # Total de chats ativos
-        cur.execute("""
-            SELECT COUNT(DISTINCT wa_id) as total
-            FROM chat_session_message
-            WHERE phone_number_id = %s AND is_active = TRUE
-        """, (phone_number_id,))
-        
-        total_chats = cur.fetchone()['total']
-        
-        cur.close()
-        conn.close()
+        chats, total_chats = db.get_active_conversations(phone_number_id, limit=limit, skip=skip)
         
         # Formata resposta
         formatted_chats = []
@@ -324,7 +295,8 @@ def get_active_chats(
                 "user_messages": chat['user_messages'],
                 "bot_messages": chat['bot_messages'],
                 "bot_replies": chat['bot_replies'],
-                "has_active_session": bool(chat['has_active_session']),
+                "unread_count": chat['unread_count'],
+                "has_active_session": True,
                 "last_message_at": chat['last_message_at'].strftime('%Y-%m-%d %H:%M:%S') if chat['last_message_at'] else None,
                 "last_read_at": chat['last_read_at'].strftime('%Y-%m-%d %H:%M:%S') if chat['last_read_at'] else None,
                 "session_expires_at": chat['session_expires_at'].strftime('%Y-%m-%d %H:%M:%S') if chat['session_expires_at'] else None
@@ -350,52 +322,11 @@ def get_unread_chats(
 ):
     """Retorna apenas os chats com mensagens não lidas"""
     try:
-        conn = db._get_connection()
-        if not conn:
-            raise HTTPException(status_code=500, detail="Erro ao conectar ao banco")
-        
-        cur = conn.cursor(dictionary=True)
-        
-        # Busca conversas com mensagens não lidas (status != 'read')
-        cur.execute("""
-            SELECT 
-                wa_id,
-                phone_number_id,
-                MAX(c.name) as contact_name,
-                COUNT(DISTINCT csm.session_id) as total_sessions,
-                COUNT(csm.id) as total_messages,
-                SUM(CASE WHEN csm.message_status NOT IN ('read', 'delivered') THEN 1 ELSE 0 END) as unread_count,
-                SUM(CASE WHEN csm.is_user_message = TRUE THEN 1 ELSE 0 END) as user_messages,
-                SUM(CASE WHEN csm.is_user_message = FALSE THEN 1 ELSE 0 END) as bot_messages,
-                MAX(csm.create_in) as last_message_at,
-                MAX(csm.content) as last_message_content
-            FROM chat_session_message csm
-            LEFT JOIN contacts c ON csm.wa_id = c.wa_id AND csm.phone_number_id = c.create_for_phone_number
-            WHERE csm.phone_number_id = %s 
-              AND csm.is_active = TRUE
-              AND csm.message_status NOT IN ('read', 'delivered')
-            GROUP BY csm.wa_id, csm.phone_number_id
-            ORDER BY csm.create_in DESC
-            LIMIT %s OFFSET %s
-        """, (phone_number_id, limit, skip))
-        
-        chats = cur.fetchall()
-        
-        # Total de chats com não lidos
-        cur.execute("""
-            SELECT COUNT(DISTINCT wa_id) as total
-            FROM chat_session_message
-            WHERE phone_number_id = %s 
-              AND is_active = TRUE
-              AND message_status NOT IN ('read', 'delivered')
-        """, (phone_number_id,))
-        
-        total_unread_chats = cur.fetchone()['total']
-        
-        cur.close()
-        conn.close()
+        chats, total_unread_chats = db.get_active_conversations(
+            phone_number_id, limit=limit, skip=skip, unread_only=True
+        )
         
-        # Formata resposta
+        # Formata resposta (contagens só das mensagens não lidas da sessão ativa)
         formatted_chats = []
         for chat in chats:
             formatted_chats.append({
@@ -403,9 +334,9 @@ def get_unread_chats(
                 "contact_name": chat['contact_name'] or "Desconhecido",
                 "phone_number_id": chat['phone_number_id'],
                 "unread_count": chat['unread_count'],
-                "total_messages": chat['total_messages'],
-                "user_messages": chat['user_messages'],
-                "bot_messages": chat['bot_messages'],
+                "total_messages": chat['unread_count'],
+                "user_messages": chat['unread_user_messages'],
+                "bot_messages": chat['unread_count'] - chat['unread_user_messages'],
                 "last_message_at": chat['last_message_at'].strftime('%Y-%m-%d %H:%M:%S') if chat['last_message_at'] else None,
                 "last_message_content": chat['last_message_content']
             })
@@ -426,70 +357,17 @@ def get_unread_chats(
 def get_chats_summary(phone_number_id: str):
     """Retorna um resumo de todos os chats do número"""
     try:
-        conn = db._get_connection()
-        if not conn:
+        result = db.get_conversations_summary(phone_number_id)
+        if result is None:
             raise HTTPException(status_code=500, detail="Erro ao conectar ao banco")
         
-        cur = conn.cursor(dictionary=True)
-        
-        # Total de chats ativos
-        cur.execute("""
-            SELECT COUNT(DISTINCT wa_id) as total
-            FROM chat_session_message
-            WHERE phone_number_id = %s AND is_active = TRUE
-        """, (phone_number_id,))
-        total_active = cur.fetchone()['total']
-        
-        # Chats com não lidos
-        cur.execute("""
-            SELECT COUNT(DISTINCT wa_id) as total
-            FROM chat_session_message
-            WHERE phone_number_id = %s 
-              AND is_active = TRUE
-              AND message_status NOT IN ('read', 'delivered')
-        """, (phone_number_id,))
-        unread_chats = cur.fetchone()['total']
-        
-        # Estatísticas gerais
-        cur.execute("""
-            SELECT 
-                COUNT(*) as total_messages,
-                SUM(CASE WHEN is_user_message = TRUE THEN 1 ELSE 0 END) as user_messages,
-                SUM(CASE WHEN is_user_message = FALSE THEN 1 ELSE 0 END) as bot_messages,
-                SUM(CASE WHEN bot_replied = TRUE THEN 1 ELSE 0 END) as bot_replies,
-                COUNT(DISTINCT session_id) as total_sessions
-            FROM chat_session_message
-            WHERE phone_number_id = %s AND is_active = TRUE
-        """, (phone_number_id,))
-        
-        stats = cur.fetchone()
-        
-        # Distribuição por status
-        cur.execute("""
-            SELECT message_status, COUNT(*) as count
-            FROM chat_session_message
-            WHERE phone_number_id = %s AND is_active = TRUE
-            GROUP BY message_status
-        """, (phone_number_id,))
-        
-        status_dist = {row['message_status']: row['count'] for row in cur.fetchall()}
-        
-        cur.close()
-        conn.close()
-        
         return {
             "phone_number_id": phone_number_id,
-            "summary": {
-                "total_active_chats": total_active,
-                "unread_chats": unread_chats,
-                "total_messages": stats['total_messages'],
-                "user_messages": stats['user_messages'],
-                "bot_messages": stats['bot_messages'],
-                "bot_replies": stats['bot_replies'],
-                "total_sessions": stats['total_sessions']
-            },
-            "status_distribution": status_dist
+            "summary": result['summary'],
+            "status_distribution": result['status_distribution']
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Erro: {str(e)}")
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, status, Query
 from pydantic import BaseModel
 from typing import Optional, List
 from src.db.storage import db
+from src.utils.fast_json import FastJSONResponse
 
 router = APIRouter(
     prefix="/contacts",
@@ -28,17 +29,20 @@ class ContactResponse(BaseModel):
 @router.get("/by-phone/{phone_number_id}")
 def get_contacts_by_phone(
     phone_number_id: str, 
-    skip: int = Query(0, ge=0), 
-    limit: int = Query(100, ge=1, le=500)
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior")
 ):
-    """Lista contatos por phone_number_id (settings)"""
-    contacts = db.get_contacts_by_phone_number(phone_number_id, skip, limit)
-    return {
+    """Lista contatos por phone_number_id (settings), paginado por cursor"""
+    try:
+        contacts, next_cursor = db.get_contacts_by_phone_number(phone_number_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({
         "total": len(contacts),
-        "skip": skip,
         "limit": limit,
+        "next_cursor": next_cursor,
         "data": contacts
-    }
+    })
 
 @router.get("/{contact_id}")
 def get_contact(contact_id: int):
@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from src.db.storage import db
+from src.db.async_storage import adb
+from src.db.session_cache import session_cache
+from src.db.settings_cache import settings_registry
+from src.utils.ingest_queue import ingest_queue
+from src.utils.status_pipeline import status_pipeline
+from src.utils.scheduler import scheduler
+from src.utils.idempotency import deduplicator
+from src.utils.websocket_manager import manager
+from src.utils.chat_updates import chat_updates
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["Sistema"]
+)
+
+@router.get("/", summary="Métricas internas da API")
+def get_metrics():
+    """Retorna métricas de ingestão e infraestrutura"""
+    return {
+        "ingest": ingest_queue.stats(),
+        "db_pool": db.pool.stats(),
+        "db_pool_async": adb.pool.stats(),
+        "session_cache": session_cache.stats(),
+        "settings_registry": settings_registry.stats(),
+        "statuses": status_pipeline.stats(),
+        "idempotency": deduplicator.stats(),
+        "scheduler": scheduler.stats(),
+        "websocket": manager.stats(),
+        "chat_updates": chat_updates.stats()
+    }
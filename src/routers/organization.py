@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Query, Response
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from src.db.storage import db
@@ -41,9 +41,18 @@ def create_organization(payload: OrgCreate):
     return org
 
 @router.get("/")
-def list_organizations(skip: int = 0, limit: int = 100):
-    """Lista todas as organizações"""
-    orgs = db.get_all_organizations(skip, limit)
+def list_organizations(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Valor do header X-Next-Cursor da página anterior")
+):
+    """Lista todas as organizações (próxima página no header X-Next-Cursor)"""
+    try:
+        orgs, next_cursor = db.get_all_organizations(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return orgs
 
 @router.get("/{org_id}")
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Query, Response
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 from src.db.storage import db
@@ -55,9 +55,19 @@ def create_user(user: UserCreate):
 
 
 @router.get("/", response_model=List[UserResponse])
-def get_users(skip: int = 0, limit: int = 100):
-    """Lista todos os usuários"""
-    users = db.get_users(skip, limit)
+def get_users(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Valor do header X-Next-Cursor da página anterior")
+):
+    """Lista todos os usuários (próxima página no header X-Next-Cursor)"""
+    try:
+        users, next_cursor = db.get_users(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return [
         {
@@ -1,10 +1,16 @@
 from fastapi import APIRouter, Request
 from fastapi import Query, HTTPException
 from fastapi.responses import PlainTextResponse
+import os
+import orjson
 from src.db.storage import db
+from src.db.async_storage import adb
 from src.utils.filter import process_webhook_payload
+from src.utils.ingest_queue import ingest_queue, INGEST_MODE
+from src.utils.idempotency import deduplicator
 
-WEBHOOK_VERIFY_TOKEN = "7b5a67574d8b1d77d2803b24946950f0"
+# Token global opcional; por padrão vale o webhook_verify_token de qualquer settings
+WEBHOOK_VERIFY_TOKEN = os.getenv("WEBHOOK_VERIFY_TOKEN")
 
 router = APIRouter(
     tags=["Webhook"]
@@ -25,7 +31,11 @@ def verify(
     hub_verify_token: str = Query(None, alias="hub.verify_token"),
 ):
     """Verifica o webhook do WhatsApp"""
-    if hub_mode == "subscribe" and hub_verify_token == WEBHOOK_VERIFY_TOKEN:        
+    valid_token = (
+        (WEBHOOK_VERIFY_TOKEN and hub_verify_token == WEBHOOK_VERIFY_TOKEN)
+        or db.is_webhook_verify_token(hub_verify_token)
+    )
+    if hub_mode == "subscribe" and valid_token:
         return PlainTextResponse(hub_challenge or "", status_code=200)
     raise HTTPException(status_code=403, detail="Invalid verify token")
 
@@ -35,14 +45,34 @@ async def receive_webhook(request: Request):
     """
     Recebe qualquer payload enviado para o webhook e processa
     """
-    data = await request.json()
+    if INGEST_MODE == "queue":
+        # Só grava o corpo bruto no journal; os workers salvam e processam
+        await ingest_queue.put(await request.body())
+        return {"status": "ok", "queued": True}
+
+    # Bytes originais: são eles que vão para o banco, sem re-serializar
+    body = await request.body()
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    
+    # Descarta reenvios da Meta antes de gravar ou transmitir qualquer coisa
+    payload, claimed = await deduplicator.filter_payload(data)
+    if payload is None:
+        print("\n↺ Webhook reenviado descartado (eventos já processados)\n")
+        return {"status": "ok", "duplicate": True}
     
     # Salva o webhook completo no banco
-    webhook_id = db.save_webhook(data)
+    webhook_id = await adb.save_webhook(body)
     if webhook_id:
         print(f"\n✓ Webhook #{webhook_id} salvo no banco de dados\n")
 
-    # Processa o payload
-    process_webhook_payload(data)
+    # Processa o payload (em falha, o reenvio da Meta precisa ser aceito)
+    try:
+        await process_webhook_payload(payload)
+    except Exception:
+        deduplicator.release(claimed)
+        raise
 
     return {"status": "ok", "webhook_id": webhook_id}
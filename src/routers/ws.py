@@ -1,4 +1,5 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
+from typing import Optional
 from src.utils.websocket_manager import manager
 
 router = APIRouter(
@@ -8,10 +9,12 @@ router = APIRouter(
 @router.websocket("/ws/chat/{phone_number_id}")
 async def websocket_chat_endpoint(
     websocket: WebSocket,
-    phone_number_id: str
+    phone_number_id: str,
+    resume_from: Optional[int] = Query(None, description="Última seq recebida: reenvia os eventos perdidos"),
+    encoding: Optional[str] = Query(None, description="json (padrão) ou msgpack; também aceito via subprotocolo")
 ):
     """WebSocket para receber mensagens de um phone_number_id específico"""
-    await manager.connect(websocket, phone_number_id)
+    await manager.connect(websocket, phone_number_id, encoding)
     
     try:
         # Envia mensagem de boas-vindas
@@ -19,13 +22,18 @@ async def websocket_chat_endpoint(
             "type": "connection",
             "status": "connected",
             "phone_number_id": phone_number_id,
+            "last_seq": manager.last_seq(phone_number_id),
             "message": f"Conectado ao chat {phone_number_id}"
         }, websocket)
         
+        # Reconexão: reenvia o que foi perdido (ou pede resync)
+        if resume_from is not None:
+            manager.resume(websocket, resume_from)
+        
         # Mantém conexão aberta
         while True:
             # Recebe mensagens do cliente (se necessário)
-            data = await websocket.receive_text()
+            data = await manager.receive(websocket)
             
             # Pode processar comandos do cliente aqui
             # Exemplo: marcar mensagem como lida
@@ -35,19 +43,27 @@ async def websocket_chat_endpoint(
         print(f"Cliente desconectado de {phone_number_id}")
 
 @router.websocket("/ws/global")
-async def websocket_global_endpoint(websocket: WebSocket):
+async def websocket_global_endpoint(
+    websocket: WebSocket,
+    resume_from: Optional[int] = Query(None, description="Última seq recebida: reenvia os eventos perdidos"),
+    encoding: Optional[str] = Query(None, description="json (padrão) ou msgpack; também aceito via subprotocolo")
+):
     """WebSocket global - recebe todas as mensagens"""
-    await manager.connect(websocket)
+    await manager.connect(websocket, encoding=encoding)
     
     try:
         await manager.send_personal_message({
             "type": "connection",
             "status": "connected",
+            "last_seq": manager.last_seq(),
             "message": "Conectado globalmente - recebendo todas as mensagens"
         }, websocket)
         
+        if resume_from is not None:
+            manager.resume(websocket, resume_from)
+        
         while True:
-            data = await websocket.receive_text()
+            data = await manager.receive(websocket)
             
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -56,21 +72,27 @@ async def websocket_global_endpoint(websocket: WebSocket):
 @router.websocket("/ws/chats/{phone_number_id}")
 async def websocket_chats_list_endpoint(
     websocket: WebSocket,
-    phone_number_id: str
+    phone_number_id: str,
+    resume_from: Optional[int] = Query(None, description="Última seq recebida: reenvia os eventos perdidos"),
+    encoding: Optional[str] = Query(None, description="json (padrão) ou msgpack; também aceito via subprotocolo")
 ):
     """WebSocket para receber atualizações da lista de chats"""
-    await manager.connect(websocket, f"chats_{phone_number_id}")
+    await manager.connect(websocket, f"chats_{phone_number_id}", encoding)
     
     try:
         await manager.send_personal_message({
             "type": "connection",
             "status": "connected",
             "phone_number_id": phone_number_id,
+            "last_seq": manager.last_seq(f"chats_{phone_number_id}"),
             "message": "Conectado à lista de chats"
         }, websocket)
         
+        if resume_from is not None:
+            manager.resume(websocket, resume_from)
+        
         while True:
-            data = await websocket.receive_text()
+            data = await manager.receive(websocket)
             
     except WebSocketDisconnect:
         manager.disconnect(websocket, f"chats_{phone_number_id}")
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+Benchmark da serialização das maiores respostas da API.
+
+Compara o caminho padrão do FastAPI (jsonable_encoder + json.dumps) com o
+FastJSONResponse (orjson) em respostas sintéticas no formato de
+/chat/conversation, /chat/sessions/{id}/messages e /contacts/by-phone.
+
+Uso: python -m src.test.bench_json [repetições]
+"""
+import os
+import sys
+import json
+import time
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from src.utils.fast_json import FastJSONResponse
+
+JSON_DIR = os.path.join(os.path.dirname(__file__), "json")
+
+
+def _sample_payload() -> str:
+    with open(os.path.join(JSON_DIR, "webhook_enviou_texto.json"), encoding="utf-8") as f:
+        return json.dumps(json.load(f))
+
+
+def _message(i: int, now: datetime, payload: str = None) -> dict:
+    row = {
+        "id": i,
+        "wa_id": "5511999999999",
+        "wa_id_received": "5511888888888",
+        "phone_number_id": "123456789012345",
+        "session_id": "2f1c6a8e-3b7d-4c1e-9a55-0d7e8b6f4a21",
+        "flow_state": "menu",
+        "message_status": "read",
+        "is_user_message": i % 2 == 0,
+        "bot_replied": i % 3 == 0,
+        "content": f"Mensagem de teste número {i} com acentuação e emoji 👍",
+        "create_in": now - timedelta(minutes=i),
+        "updated_at": now - timedelta(minutes=i) + timedelta(seconds=5),
+        "expires_at": now + timedelta(hours=24),
+        "is_active": True,
+        "wamid": f"wamid.HBgNNTUxMTk5OTk5OTk5ORUCABIYFjNFQjA{i:08d}",
+    }
+    if payload is not None:
+        row["payload"] = payload
+    return row
+
+
+def build_responses() -> dict:
+    now = datetime.now()
+    payload = _sample_payload()
+    conversation = {
+        "wa_id": "5511999999999",
+        "wa_id_received": "5511888888888",
+        "phone_number_id": "123456789012345",
+        "total_messages": 200,
+        "before_cursor": "eyJrIjpbIjIwMjQtMDEtMDEiLDFdfQ",
+        "after_cursor": None,
+        "has_more_after": False,
+        "messages": [_message(i, now, payload) for i in range(200)],
+    }
+    session = {
+        "session_id": "2f1c6a8e-3b7d-4c1e-9a55-0d7e8b6f4a21",
+        "total": 500,
+        "messages": [_message(i, now) for i in range(500)],
+    }
+    contacts = {
+        "total": 500,
+        "limit": 500,
+        "next_cursor": "eyJrIjpbMTcwNDA2NzIwMCwxXX0",
+        "data": [
+            {
+                "id": i,
+                "wa_id": f"55119{i:08d}",
+                "profile": "human",
+                "name": f"Contato {i}",
+                "create_in": now - timedelta(days=i),
+                "activate_bot": bool(i % 2),
+                "activate_automatic_message": False,
+                "create_for_phone_number": "123456789012345",
+                "last_message_timestamp": 1704067200 + i,
+            }
+            for i in range(500)
+        ],
+    }
+    return {
+        "/chat/conversation (200 c/ payload)": conversation,
+        "/chat/sessions/{id}/messages (500)": session,
+        "/contacts/by-phone (500)": contacts,
+    }
+
+
+def _timeit(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(repeat: int = 200) -> None:
+    for name, content in build_responses().items():
+        baseline = _timeit(lambda: JSONResponse(jsonable_encoder(content)), repeat)
+        encoded = _timeit(lambda: FastJSONResponse(jsonable_encoder(content)), repeat)
+        direct = _timeit(lambda: FastJSONResponse(content), repeat)
+        size = len(FastJSONResponse(content).body)
+        print(f"{name} — {size / 1024:.0f} KB")
+        print(f"  └─ jsonable_encoder + json:   {baseline:7.2f} ms")
+        print(f"  └─ jsonable_encoder + orjson: {encoded:7.2f} ms ({baseline / encoded:4.1f}x)")
+        print(f"  └─ orjson direto:             {direct:7.2f} ms ({baseline / direct:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
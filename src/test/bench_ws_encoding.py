@@ -0,0 +1,94 @@
+"""
+Benchmark das codificações dos frames WebSocket.
+
+Compara tamanho e CPU por frame de JSON e MessagePack, sem e com
+permessage-deflate (deflate com contexto compartilhado entre mensagens,
+como o websockets faz por padrão), numa sequência de eventos no formato
+de /ws/global (new_message + chat_updated).
+
+Uso: python -m src.test.bench_ws_encoding [frames]
+"""
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+from src.utils.ws_codec import JSON, MSGPACK, encode, to_msgpack
+from src.utils.websocket_manager import with_seq
+
+
+def build_events(total: int) -> list:
+    now = datetime.now()
+    events = []
+    for i in range(total):
+        wa_id = f"55119{i % 40:08d}"
+        events.append({
+            "type": "new_message",
+            "phone_number_id": "123456789012345",
+            "wa_id": wa_id,
+            "contact_name": f"Contato {i % 40}",
+            "message": {
+                "id": 100000 + i,
+                "content": f"Mensagem {i}: bom dia, gostaria de saber o valor do imóvel 👍",
+                "message_type": "text",
+                "timestamp": str(int((now + timedelta(seconds=i)).timestamp())),
+                "is_user_message": True,
+                "session_id": f"2f1c6a8e-3b7d-4c1e-9a55-{i % 40:012d}",
+            },
+        })
+        events.append({
+            "type": "chat_updated",
+            "phone_number_id": "123456789012345",
+            "wa_id": wa_id,
+            "contact_name": f"Contato {i % 40}",
+            "last_message": f"Mensagem {i}",
+            "timestamp": str(int((now + timedelta(seconds=i)).timestamp())),
+            "merged": 1,
+        })
+    return events
+
+
+def _deflate(frames: list) -> list:
+    # Um compressor por conexão, SYNC_FLUSH por mensagem (RFC 7692 com context takeover)
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    out = []
+    for frame in frames:
+        data = frame.encode("utf-8") if isinstance(frame, str) else frame
+        out.append(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+    return out
+
+
+def main(total: int = 5000) -> None:
+    events = build_events(total // 2)
+    frames = len(events)
+
+    started = time.perf_counter()
+    json_frames = [with_seq(encode(e, JSON), i + 1) for i, e in enumerate(events)]
+    json_us = (time.perf_counter() - started) / frames * 1e6
+
+    started = time.perf_counter()
+    packed_frames = [to_msgpack(f) for f in json_frames]
+    pack_us = (time.perf_counter() - started) / frames * 1e6
+
+    started = time.perf_counter()
+    json_deflated = _deflate(json_frames)
+    json_deflate_us = (time.perf_counter() - started) / frames * 1e6
+
+    started = time.perf_counter()
+    packed_deflated = _deflate(packed_frames)
+    pack_deflate_us = (time.perf_counter() - started) / frames * 1e6
+
+    json_bytes = sum(len(f.encode("utf-8")) for f in json_frames)
+    rows = [
+        ("json", json_bytes, json_us),
+        ("msgpack", sum(len(f) for f in packed_frames), json_us + pack_us),
+        ("json + deflate", sum(len(f) for f in json_deflated), json_us + json_deflate_us),
+        ("msgpack + deflate", sum(len(f) for f in packed_deflated), json_us + pack_us + pack_deflate_us),
+    ]
+    print(f"{frames} frames")
+    for name, size, cpu in rows:
+        print(f"  └─ {name:<18} {size / frames:7.1f} B/frame ({size / json_bytes:6.1%})  {cpu:6.2f} µs/frame")
+    print(f"  └─ {MSGPACK} converte uma vez por frame, não por conexão")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
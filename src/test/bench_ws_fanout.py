@@ -0,0 +1,101 @@
+"""
+Benchmark do fan-out do ConnectionManager com sockets falsos.
+
+Mede o tempo até um broadcast chegar a N dashboards comparando o laço
+antigo (send_json sequencial, re-serializando a cada envio) com as filas
+por conexão (serializa uma vez, enfileira sem bloquear e cada conexão
+escreve na sua tarefa). Cada socket simula a latência de escrita da rede;
+alguns ficam "travados" e são removidos pelo timeout de envio.
+
+Uso: python -m src.test.bench_ws_fanout [conexões] [travados]
+"""
+import sys
+import json
+import time
+import asyncio
+from datetime import datetime
+from src.utils.websocket_manager import ConnectionManager
+
+SEND_LATENCY = 0.0005   # 0,5 ms por envio (buffer do socket cheio, rede lenta)
+STUCK_LATENCY = 30.0    # cliente travado (aba em rede móvel ruim)
+
+
+class FakeSocket:
+    scope = {}
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.frames = 0
+
+    async def accept(self, subprotocol: str = None) -> None:
+        pass
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        await asyncio.sleep(self.latency)
+        self.frames += 1
+
+    async def send_json(self, message: dict) -> None:
+        await self.send_text(json.dumps(message))
+
+
+def _message() -> dict:
+    return {
+        "type": "new_message",
+        "phone_number_id": "123456789012345",
+        "data": {
+            "wa_id": "5511999999999",
+            "content": "Mensagem de teste com acentuação 👍",
+            "timestamp": datetime.now().isoformat(),
+            "is_user_message": True,
+        },
+    }
+
+
+async def _sequential(connections, message) -> None:
+    # Laço original do ConnectionManager
+    for connection in connections:
+        try:
+            await connection.send_json(message)
+        except Exception:
+            pass
+
+
+async def _delivered(sockets, frames: int) -> None:
+    while any(s.frames < frames for s in sockets):
+        await asyncio.sleep(0.001)
+
+
+async def main(total: int = 1000, stuck: int = 5) -> None:
+    message = _message()
+    sockets = [FakeSocket(STUCK_LATENCY if i < stuck else SEND_LATENCY) for i in range(total)]
+    healthy = sockets[stuck:]
+
+    started = time.perf_counter()
+    await _sequential(healthy, message)
+    sequential = (time.perf_counter() - started) * 1000
+    print(f"Sequencial ({len(healthy)} saudáveis): {sequential:8.1f} ms"
+          f"  (+{STUCK_LATENCY:.0f}s por cliente travado)")
+
+    manager = ConnectionManager(send_timeout=1.0)
+    for socket in sockets:
+        await manager.connect(socket)
+
+    started = time.perf_counter()
+    manager.publish_global(message)
+    publish = (time.perf_counter() - started) * 1000
+    await _delivered(healthy, 2)
+    delivered = (time.perf_counter() - started) * 1000
+    print(f"Filas      ({total}, {stuck} travados):  {delivered:8.1f} ms até os saudáveis receberem"
+          f"  └─ publish: {publish:.2f} ms")
+
+    await asyncio.sleep(1.1)
+    stats = manager.stats()
+    print(f"  └─ {stats['connections']} conexões após remover {stats['evicted']} por timeout")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
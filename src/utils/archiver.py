@@ -0,0 +1,145 @@
+import os
+import asyncio
+from datetime import date
+from typing import Any, Dict, Iterator, List
+from dotenv import load_dotenv
+from src.db.storage import db
+from src.db.archive import chat_archive
+from src.db.queries import placeholders
+from src.db.partitions import (
+    add_months, month_start, is_partitioned, ensure_future_partitions,
+    closed_partitions, drop_partition
+)
+from src.utils.scheduler import PeriodicTask
+
+load_dotenv()
+
+CHAT_ARCHIVE_INTERVAL = float(os.getenv("CHAT_ARCHIVE_INTERVAL") or 3600)
+# Meses completos que continuam no banco antes de ir para o arquivo
+CHAT_ARCHIVE_AFTER_MONTHS = int(os.getenv("CHAT_ARCHIVE_AFTER_MONTHS") or 3)
+CHAT_PARTITION_MONTHS_AHEAD = int(os.getenv("CHAT_PARTITION_MONTHS_AHEAD") or 2)
+ARCHIVE_EXPORT_CHUNK = 5000
+# Ordem do arquivo: conversa, data e id (um lote por vez, sem juntar o mês em memória)
+EXPORT_KEY = ("wa_id", "phone_number_id", "create_in", "id")
+EXPORT_ORDER = ", ".join(EXPORT_KEY)
+
+# Só um worker mantém as partições por vez
+ARCHIVE_LOCK = "whatsapp_webhook_chat_archiver"
+TABLE = "chat_session_message"
+
+
+class PartitionArchiver(PeriodicTask):
+    """
+    Manutenção das partições mensais de chat_session_message.
+
+    Cria as partições dos próximos meses e move as partições fechadas há
+    mais de CHAT_ARCHIVE_AFTER_MONTHS meses para o ChatArchive em disco:
+    exporta em lotes direto para o arquivo, confere a contagem e só então
+    faz DROP PARTITION.
+    """
+
+    name = "chat_archiver"
+
+    def __init__(
+        self,
+        interval: float = CHAT_ARCHIVE_INTERVAL,
+        after_months: int = CHAT_ARCHIVE_AFTER_MONTHS,
+        months_ahead: int = CHAT_PARTITION_MONTHS_AHEAD
+    ):
+        super().__init__(interval)
+        self.after_months = max(1, after_months)
+        self.months_ahead = max(1, months_ahead)
+        self.partitions_created = 0
+        self.partitions_archived = 0
+        self.rows_archived = 0
+        self.bytes_written = 0
+        self.skipped = 0
+
+    async def run_once(self) -> None:
+        await asyncio.to_thread(self._run)
+
+    def _run(self) -> None:
+        conn = db._get_connection()
+        if not conn:
+            raise RuntimeError("sem conexão com o banco")
+
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT GET_LOCK(%s, 0)", (ARCHIVE_LOCK,))
+            if not cur.fetchone()[0]:
+                self.skipped += 1
+                return
+            try:
+                if not is_partitioned(cur, TABLE):
+                    return
+                created = ensure_future_partitions(cur, TABLE, self.months_ahead)
+                if created:
+                    self.partitions_created += len(created)
+                    print(f"✓ Partições criadas em {TABLE}: {', '.join(created)}")
+
+                cutoff = add_months(month_start(date.today()), -self.after_months)
+                for name in closed_partitions(cur, TABLE, cutoff):
+                    self._archive(cur, name)
+            finally:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (ARCHIVE_LOCK,))
+                cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _archive(self, cur, name: str) -> None:
+        cur.execute(
+            f"SELECT * FROM {TABLE} PARTITION ({name}) ORDER BY {EXPORT_ORDER} LIMIT %s",
+            (ARCHIVE_EXPORT_CHUNK,)
+        )
+        chunk = cur.fetchall()
+        columns = [d[0] for d in cur.description]
+
+        rows, size = 0, 0
+        if chunk:
+            rows, size = chat_archive.write(name, columns, self._chunks(cur, name, columns, chunk))
+
+        cur.execute(f"SELECT COUNT(*) FROM {TABLE} PARTITION ({name})")
+        count = cur.fetchone()[0]
+        if count != rows:
+            chat_archive.remove(name)
+            raise RuntimeError(f"partição {name} mudou durante a exportação ({count} != {rows})")
+
+        if rows:
+            self.bytes_written += size
+            print(f"✓ Partição {name} arquivada: {rows} mensagens, {size} bytes")
+        drop_partition(cur, TABLE, name)
+        self.partitions_archived += 1
+        self.rows_archived += rows
+
+    def _chunks(self, cur, name: str, columns: List[str], chunk: List[Any]) -> Iterator[List[Any]]:
+        """Lotes da partição na ordem do arquivo (keyset pelo idx_contact_history + id)"""
+        keys = [columns.index(column) for column in EXPORT_KEY]
+        while chunk:
+            yield chunk
+            if len(chunk) < ARCHIVE_EXPORT_CHUNK:
+                return
+            last = chunk[-1]
+            cur.execute(
+                f"SELECT * FROM {TABLE} PARTITION ({name}) "
+                f"WHERE ({EXPORT_ORDER}) > ({placeholders(len(keys))}) "
+                f"ORDER BY {EXPORT_ORDER} LIMIT %s",
+                (*[last[i] for i in keys], ARCHIVE_EXPORT_CHUNK)
+            )
+            chunk = cur.fetchall()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "after_months": self.after_months,
+            "partitions_created": self.partitions_created,
+            "partitions_archived": self.partitions_archived,
+            "rows_archived": self.rows_archived,
+            "bytes_written": self.bytes_written,
+            "skipped_locked": self.skipped,
+            "archive": chat_archive.stats(),
+        }
+
+
+# Instância global
+partition_archiver = PartitionArchiver()
@@ -0,0 +1,276 @@
+import os
+import struct
+import asyncio
+from typing import Any, Callable, Dict, Optional, Set
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# memory: só o processo atual | unix: compartilha entre os workers da máquina
+WS_BUS = os.getenv("WS_BUS") or "memory"
+WS_BUS_PATH = os.getenv("WS_BUS_PATH") or "/tmp/whatsapp_webhook_ws.sock"
+# Bytes pendentes por worker conectado antes de descartar frames para ele
+WS_BUS_MAX_BUFFER = int(os.getenv("WS_BUS_MAX_BUFFER") or 8 * 1024 * 1024)
+WS_BUS_RETRY = 0.5
+
+_HEADER = struct.Struct(">I")
+
+# Entrega um frame já serializado (canal, seq, frame) às conexões locais
+Deliver = Callable[[str, int, str], int]
+
+
+class BroadcastBus:
+    """
+    Barramento de broadcast do ConnectionManager.
+
+    publish() numera o frame (sequência monotônica por canal), entrega às
+    conexões deste processo e o repassa aos demais processos/nós; o que
+    chega de fora é entregue via `deliver`. Implementações trocam só o
+    transporte e quem numera.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.deliver: Optional[Deliver] = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        # Último número de sequência visto por canal
+        self.sequences: Dict[str, int] = {}
+
+    def bind(self, deliver: Deliver) -> None:
+        self.deliver = deliver
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def next_seq(self, channel: str) -> int:
+        seq = self.sequences.get(channel, 0) + 1
+        self.sequences[channel] = seq
+        return seq
+
+    def _receive(self, channel: str, seq: int, data: str) -> int:
+        if seq > self.sequences.get(channel, 0):
+            self.sequences[channel] = seq
+        return self.deliver(channel, seq, data) if self.deliver else 0
+
+    def publish(self, channel: str, data: str) -> int:
+        """Publica o frame; retorna quantas conexões locais o receberam"""
+        self.published += 1
+        return self._receive(channel, self.next_seq(channel), data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class MemoryBus(BroadcastBus):
+    """Só o processo atual (um worker, testes)"""
+
+    name = "memory"
+
+
+def _encode_frame(channel: str, seq: int, data: str) -> bytes:
+    payload = f"{channel}\n{seq}\n".encode("utf-8") + data.encode("utf-8")
+    return _HEADER.pack(len(payload)) + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    """(canal, seq, frame); seq 0 = ainda não numerado (worker -> broker)"""
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    payload = await reader.readexactly(size)
+    channel, seq, data = payload.split(b"\n", 2)
+    return channel.decode("utf-8"), int(seq), data.decode("utf-8")
+
+
+class UnixSocketBus(BroadcastBus):
+    """
+    Barramento entre os workers da mesma máquina via socket Unix.
+
+    O primeiro worker que pega o flock de `<path>.lock` vira o broker:
+    escuta no socket, numera cada frame recebido e o devolve a todos os
+    workers (inclusive quem publicou), então todos veem a mesma sequência.
+    Os demais se conectam a ele. Se o broker cair, os workers tentam de
+    novo e um deles assume, continuando das últimas sequências que viu.
+    Enquanto desconectado, o frame só chega às conexões locais (contado
+    em `dropped`).
+    """
+
+    name = "unix"
+
+    def __init__(self, path: str = WS_BUS_PATH, max_buffer: int = WS_BUS_MAX_BUFFER):
+        super().__init__()
+        self.path = path
+        self.max_buffer = max_buffer
+        self.role: Optional[str] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._task: Optional[asyncio.Task] = None
+        self.relayed = 0
+        self.reconnects = 0
+
+    async def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        peers = list(self._peers)
+        self._peers.clear()
+        for writer in peers:
+            writer.close()
+        for writer in peers:
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+        if self._server:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self._release_lock()
+        self.role = None
+
+    def _release_lock(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _try_lock(self) -> bool:
+        # fcntl só existe em POSIX; importado aqui para o modo memory rodar em qualquer SO
+        import fcntl
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._try_lock():
+                    await self._serve()
+                else:
+                    await self._connect()
+            except asyncio.CancelledError:
+                raise
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Broker ainda subindo (ou assumindo após uma queda)
+                pass
+            except Exception as e:
+                print(f"⚠ Barramento WebSocket ({self.path}): {e}")
+            if self._server:
+                self._server.close()
+                self._server = None
+            self._release_lock()
+            self.role = None
+            self._peers.clear()
+            self.reconnects += 1
+            await asyncio.sleep(WS_BUS_RETRY)
+
+    async def _serve(self) -> None:
+        # Socket antigo de um broker que morreu: o flock garante que ninguém o usa
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path)
+        self.role = "broker"
+        print(f"✓ Barramento WebSocket: broker em {self.path}")
+        await self._server.serve_forever()
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._peers.add(writer)
+        try:
+            while True:
+                channel, _, data = await _read_frame(reader)
+                self.received += 1
+                seq = self.next_seq(channel)
+                self._receive(channel, seq, data)
+                frame = _encode_frame(channel, seq, data)
+                for peer in list(self._peers):
+                    self._write(peer, frame)
+                    self.relayed += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _connect(self) -> None:
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self.role = "client"
+        self._peers = {writer}
+        print(f"✓ Barramento WebSocket: conectado ao broker {self.path}")
+        try:
+            while True:
+                channel, seq, data = await _read_frame(reader)
+                self.received += 1
+                self._receive(channel, seq, data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print("⚠ Barramento WebSocket: broker desconectado, reconectando")
+        finally:
+            self._peers.clear()
+            writer.close()
+
+    def _write(self, writer: asyncio.StreamWriter, frame: bytes) -> None:
+        # Worker que não consome: descarta em vez de acumular memória
+        if writer.is_closing() or writer.transport.get_write_buffer_size() > self.max_buffer:
+            self.dropped += 1
+            return
+        writer.write(frame)
+
+    def publish(self, channel: str, data: str) -> int:
+        self.published += 1
+        if self.role == "client" and self._peers:
+            # O broker numera e devolve o frame a todos, inclusive a este worker
+            for peer in list(self._peers):
+                self._write(peer, _encode_frame(channel, 0, data))
+            return 0
+
+        if self.role != "broker":
+            self.dropped += 1
+        seq = self.next_seq(channel)
+        delivered = self._receive(channel, seq, data)
+        if self._peers:
+            frame = _encode_frame(channel, seq, data)
+            for peer in list(self._peers):
+                self._write(peer, frame)
+        return delivered
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "path": self.path,
+            "role": self.role,
+            "peers": len(self._peers),
+            "relayed": self.relayed,
+            "reconnects": self.reconnects,
+        }
+
+
+def create_bus(backend: str = WS_BUS) -> BroadcastBus:
+    if backend == "unix":
+        return UnixSocketBus()
+    if backend != "memory":
+        print(f"⚠ WS_BUS inválido ({backend}), usando memory")
+    return MemoryBus()
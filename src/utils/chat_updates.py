@@ -0,0 +1,79 @@
+import os
+import asyncio
+from typing import Any, Dict
+from dotenv import load_dotenv
+from src.utils.websocket_manager import manager
+
+load_dotenv()
+
+# Janela para juntar os chat_updated de um canal chats_ (0 envia na hora)
+WS_CHAT_COALESCE_MS = float(os.getenv("WS_CHAT_COALESCE_MS") or 250)
+
+
+class ChatUpdateCoalescer:
+    """
+    Junta os eventos chat_updated dos canais chats_{phone_number_id}.
+
+    O primeiro update de um canal abre uma janela de WS_CHAT_COALESCE_MS;
+    os que chegam nela são mesclados por wa_id (fica o estado mais recente)
+    e, ao fechar, sai um frame por conversa com `merged` = quantos updates
+    ele representa. O atraso máximo de um update é a janela.
+    """
+
+    def __init__(self, window_ms: float = WS_CHAT_COALESCE_MS):
+        self.window = window_ms / 1000
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+        # Métricas
+        self.updates = 0
+        self.frames = 0
+        self.merged = 0
+
+    def publish(self, phone_number_id: str, update: Dict[str, Any]) -> None:
+        """Agenda o chat_updated de uma conversa (não bloqueia)"""
+        channel = f"chats_{phone_number_id}"
+        self.updates += 1
+        if self.window <= 0:
+            self.frames += 1
+            manager.publish_to_phone(channel, {**update, "merged": 1})
+            return
+
+        pending = self._pending.setdefault(channel, {})
+        wa_id = update.get("wa_id")
+        previous = pending.get(wa_id)
+        if previous:
+            self.merged += 1
+            pending[wa_id] = {**previous, **update, "merged": previous["merged"] + 1}
+        else:
+            pending[wa_id] = {**update, "merged": 1}
+
+        if channel not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[channel] = loop.call_later(self.window, self._flush, channel)
+
+    def _flush(self, channel: str) -> None:
+        self._timers.pop(channel, None)
+        for update in self._pending.pop(channel, {}).values():
+            self.frames += 1
+            manager.publish_to_phone(channel, update)
+
+    def flush(self) -> None:
+        """Envia tudo que está pendente (desligamento)"""
+        for channel in list(self._timers):
+            self._timers[channel].cancel()
+            self._flush(channel)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000,
+            "updates": self.updates,
+            "frames": self.frames,
+            "merged": self.merged,
+            "pending_channels": len(self._pending),
+            "frames_saved": round(1 - self.frames / self.updates, 4) if self.updates else 0.0,
+        }
+
+
+# Instância global
+chat_updates = ChatUpdateCoalescer()
@@ -0,0 +1,17 @@
+import zlib
+import struct
+
+# Nível do zlib para os corpos brutos (6 = padrão, bom equilíbrio CPU/tamanho)
+COMPRESS_LEVEL = 6
+
+_LENGTH = struct.Struct("<I")
+
+
+def mysql_compress(data: bytes, level: int = COMPRESS_LEVEL) -> bytes:
+    """
+    Comprime no mesmo formato do COMPRESS() do MySQL (4 bytes com o tamanho
+    original, little-endian, + stream zlib), então UNCOMPRESS() lê direto no SQL.
+    """
+    if not data:
+        return b""
+    return _LENGTH.pack(len(data)) + zlib.compress(data, level)
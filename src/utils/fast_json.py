@@ -0,0 +1,43 @@
+from decimal import Decimal
+from typing import Any
+import orjson
+from fastapi.responses import JSONResponse
+
+# Chaves não-string (ex.: ids numéricos) viram string, como no json padrão
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value: Any) -> Any:
+    """Tipos que o orjson não serializa sozinho (mesmo resultado do jsonable_encoder)"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """Serializa para JSON (bytes UTF-8); datetime sai em ISO 8601 direto do orjson"""
+    return orjson.dumps(value, default=_default, option=ORJSON_OPTIONS)
+
+
+def dumps_text(value: Any) -> str:
+    """Mesmo que dumps, como texto (frames de texto do WebSocket)"""
+    return dumps(value).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse renderizada com orjson.
+
+    É a classe padrão da aplicação. Endpoints grandes podem retornar
+    FastJSONResponse(conteudo) diretamente para pular também o
+    jsonable_encoder do FastAPI (o orjson já trata datetime e afins).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,7 +1,9 @@
-from typing import Any, Dict
-from src.db.storage import db
+from typing import Any, Dict, List
+from src.db.async_storage import adb
 from src.utils.websocket_manager import manager
-import asyncio
+from src.utils.chat_updates import chat_updates
+from src.utils.status_pipeline import status_pipeline
+from src.utils.idempotency import deduplicator, message_key, status_key
 
 
 def receiver_from_metadata(metadata: Dict[str, Any]) -> str:
@@ -54,7 +56,7 @@ def translate_status(status: str) -> str:
     return mapa.get((status or "").lower(), status or "-")
 
 
-def process_messages(value: Dict[str, Any]) -> None:
+async def process_messages(value: Dict[str, Any]) -> None:
     """Processa mensagens recebidas"""
     metadata = value.get("metadata", {})
     receiver = receiver_from_metadata(metadata)
@@ -77,21 +79,22 @@ def process_messages(value: Dict[str, Any]) -> None:
         print(f"Timestamp: {timestamp}")
         print("="*50 + "\n")
         
-        # Salva/atualiza contato
-        for contact in value.get("contacts", []):
-            wa_id = contact.get("wa_id")
-            name = (contact.get("profile") or {}).get("name")
-            if wa_id and phone_number_id != "-":
-                db.save_or_update_contact(
-                    wa_id=wa_id,
-                    name=name or wa_id,
-                    phone_number_id=phone_number_id,
-                    timestamp=int(timestamp)
-                )
-
-
-def process_statuses(value: Dict[str, Any]) -> None:
-    """Processa atualizações de status"""
+        # Salva/atualiza contatos
+        if phone_number_id != "-":
+            await adb.save_contacts_batch([
+                {
+                    "wa_id": contact.get("wa_id"),
+                    "name": (contact.get("profile") or {}).get("name") or contact.get("wa_id"),
+                    "phone_number_id": phone_number_id,
+                    "timestamp": int(timestamp)
+                }
+                for contact in value.get("contacts", [])
+                if contact.get("wa_id")
+            ])
+
+
+async def process_statuses(value: Dict[str, Any]) -> None:
+    """Processa atualizações de status e grava o status nas mensagens (por wamid)"""
     metadata = value.get("metadata", {})
     business = metadata.get("display_phone_number") or metadata.get("phone_number_id") or "-"
 
@@ -108,6 +111,13 @@ def process_statuses(value: Dict[str, Any]) -> None:
         print(f"Status da mensagem: {status_pt}")
         print(f"Mensagem ID: {msg_id}")
         print("="*50 + "\n")
+    
+    # Agrupado com os status de outros webhooks e gravado em lote (com as chaves de idempotência)
+    statuses = value.get("statuses", [])
+    keys = [k for k in map(status_key, statuses) if k]
+    if not await status_pipeline.submit(statuses, keys):
+        # Falhou: libera as chaves para o reenvio da Meta ser aceito
+        deduplicator.release(keys)
 
 
 def process_contacts_only(value: Dict[str, Any]) -> None:
@@ -128,8 +138,35 @@ def process_contacts_only(value: Dict[str, Any]) -> None:
         print("="*50 + "\n")
 
 
-def process_webhook_payload(data: dict):
+def extract_contacts(data: dict) -> List[Dict[str, Any]]:
+    """Extrai os contatos (remetentes) de todas as mensagens do payload"""
+    contacts = []
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            phone_number_id = value.get("metadata", {}).get("phone_number_id", "-")
+            
+            contact_name = "Desconhecido"
+            if value.get("contacts"):
+                contact_name = value["contacts"][0].get("profile", {}).get("name", "Desconhecido")
+            
+            for message in value.get("messages") or []:
+                contacts.append({
+                    "wa_id": message.get("from"),
+                    "name": contact_name,
+                    "phone_number_id": phone_number_id,
+                    "timestamp": int(message.get("timestamp"))
+                })
+    return contacts
+
+
+async def process_webhook_payload(data: dict):
     """Processa o payload do webhook"""
+    # Upsert de todos os contatos do payload num único statement
+    contacts = extract_contacts(data)
+    if contacts:
+        await adb.save_contacts_batch(contacts)
+    
     for entry in data.get("entry", []):
         for change in entry.get("changes", []):
             value = change.get("value", {})
@@ -150,27 +187,22 @@ def process_webhook_payload(data: dict):
                         profile = contacts[0].get("profile", {})
                         contact_name = profile.get("name", "Desconhecido")
                     
-                    db.save_or_update_contact(
-                        wa_id=msg_from,
-                        name=contact_name,
-                        phone_number_id=phone_number_id,
-                        timestamp=int(timestamp)
-                    )
-                    
                     content = ""
                     if msg_type == "text":
                         content = message.get("text", {}).get("body", "")
                     elif msg_type in ["image", "video", "audio", "document"]:
                         content = f"[{msg_type.upper()}] {message.get(msg_type, {}).get('caption', 'Sem legenda')}"
                     
-                    saved_message = db.create_session_message(
+                    saved_message = await adb.create_session_message(
                         wa_id=msg_from,
                         wa_id_received=metadata.get("display_phone_number", phone_number_id),
                         phone_number_id=phone_number_id,
                         content=content,
                         payload=message,
                         is_user_message=True,
-                        message_status='received'
+                        message_status='received',
+                        wamid=message.get("id"),
+                        event_key=message_key(message)
                     )
                     
                     # 🔥 ENVIA VIA WEBSOCKET
@@ -190,15 +222,15 @@ def process_webhook_payload(data: dict):
                             }
                         }
                         
-                        # Envia para conexões específicas do número
-                        asyncio.create_task(manager.broadcast_to_phone(phone_number_id, ws_payload))
+                        # Enfileira (sem bloquear) para conexões específicas do número
+                        manager.publish_to_phone(phone_number_id, ws_payload)
                         
-                        # Envia para conexões globais
-                        asyncio.create_task(manager.broadcast_global(ws_payload))
+                        # Enfileira para conexões globais
+                        manager.publish_global(ws_payload)
                         
-                        # Envia atualização para lista de chats
-                        asyncio.create_task(manager.broadcast_to_phone(
-                            f"chats_{phone_number_id}",
+                        # Atualização da lista de chats (agrupada por conversa em janelas curtas)
+                        chat_updates.publish(
+                            phone_number_id,
                             {
                                 "type": "chat_updated",
                                 "phone_number_id": phone_number_id,
@@ -207,14 +239,17 @@ def process_webhook_payload(data: dict):
                                 "last_message": content,
                                 "timestamp": timestamp
                             }
-                        ))
+                        )
+                    else:
+                        # Não salvou (ou outro worker já salvou): libera a chave em memória
+                        deduplicator.release([message_key(message)])
                     
                     print(f"  └─ Tipo: {msg_type}")
                     if msg_type == "text":
                         print(f"  └─ Mensagem: {content}")
             
             if value.get("statuses"):
-                process_statuses(value)
+                await process_statuses(value)
             
             if value.get("contacts") and not value.get("messages") and not value.get("statuses"):
                 process_contacts_only(value)
\ No newline at end of file
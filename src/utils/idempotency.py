@@ -0,0 +1,203 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from src.db.async_storage import adb
+from src.utils.scheduler import PeriodicTask
+
+load_dotenv()
+
+# Quantas chaves recentes ficam em memória (o resto é conferido na processed_event)
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE") or 100000)
+# Por quantos dias um evento processado bloqueia reenvios (a Meta reenvia por até 7 dias)
+IDEMPOTENCY_TTL_DAYS = int(os.getenv("IDEMPOTENCY_TTL_DAYS") or 7)
+IDEMPOTENCY_PRUNE_INTERVAL = float(os.getenv("IDEMPOTENCY_PRUNE_INTERVAL") or 3600)
+IDEMPOTENCY_PRUNE_BATCH = 5000
+# Pausa entre lotes para não disputar locks com o ingest
+IDEMPOTENCY_PRUNE_PAUSE = 0.05
+
+
+def message_key(message: Dict[str, Any]) -> Optional[str]:
+    wamid = message.get("id")
+    return f"message:{wamid}" if wamid else None
+
+
+def status_key(status: Dict[str, Any]) -> Optional[str]:
+    wamid = status.get("id")
+    return f"status:{wamid}:{status.get('status')}" if wamid else None
+
+
+class EventDeduplicator:
+    """
+    Descarta mensagens e status que a Meta reenviou.
+
+    Cada evento vira uma chave (message:<wamid> / status:<wamid>:<status>).
+    Um conjunto LRU em memória responde os reenvios recentes sem ir ao banco;
+    as demais chaves são conferidas na processed_event. A chave só é gravada
+    lá na mesma transação que aplica o evento (create_session_message /
+    apply_message_statuses), então um processamento que falha ou um processo
+    que morre no meio não deixa o evento marcado: o reenvio da Meta ou o
+    replay do journal o processam de novo. Em erro do banco o evento segue
+    (melhor duplicar do que perder).
+    """
+
+    def __init__(self, max_size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+
+        # Métricas
+        self.events = 0
+        self.duplicates = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.released = 0
+        self.db_errors = 0
+
+    def _remember(self, keys: List[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._recent[key] = None
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.max_size:
+                self._recent.popitem(last=False)
+
+    async def claim(self, keys: List[str]) -> List[str]:
+        """
+        Retorna as chaves novas (na ordem recebida); as repetidas são descartadas.
+
+        As novas ficam reservadas só em memória até o processamento terminar;
+        se ele falhar, quem chamou devolve as chaves com `release`.
+        """
+        self.events += len(keys)
+        unseen = []
+        with self._lock:
+            for key in keys:
+                if key in self._recent:
+                    self._recent.move_to_end(key)
+                    self.memory_hits += 1
+                elif key not in unseen:
+                    unseen.append(key)
+        # Marca antes de ir ao banco: requisições simultâneas já veem a chave
+        self._remember(unseen)
+
+        processed = await adb.find_processed_events(unseen) if unseen else set()
+        if processed is None:
+            self.db_errors += 1
+            processed = set()
+        fresh = [key for key in unseen if key not in processed]
+        self.db_hits += len(processed)
+        self.duplicates += len(keys) - len(fresh)
+        return fresh
+
+    def release(self, keys: List[str]) -> None:
+        """Esquece chaves cujo processamento falhou, para o reenvio ser aceito"""
+        keys = [k for k in keys if k]
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                self._recent.pop(key, None)
+        self.released += len(keys)
+
+    async def filter_payload(self, data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """
+        Remove do payload as mensagens e status já processados.
+
+        Retorna (payload filtrado, chaves reservadas). O payload é None quando
+        todos os eventos eram repetidos; payloads sem eventos passam direto.
+        """
+        keys = []
+        for entry in data.get("entry", []):
+            for change in entry.get("changes", []):
+                value = change.get("value", {})
+                keys.extend(k for k in map(message_key, value.get("messages") or []) if k)
+                keys.extend(k for k in map(status_key, value.get("statuses") or []) if k)
+        if not keys:
+            return data, []
+
+        fresh = set(await self.claim(keys))
+        if not fresh:
+            return None, []
+        if len(fresh) == len(keys):
+            return data, list(fresh)
+
+        entries = []
+        for entry in data.get("entry", []):
+            changes = []
+            for change in entry.get("changes", []):
+                value = dict(change.get("value", {}))
+                if value.get("messages"):
+                    value["messages"] = [m for m in value["messages"] if message_key(m) in fresh]
+                if value.get("statuses"):
+                    value["statuses"] = [s for s in value["statuses"] if status_key(s) in fresh]
+                changes.append({**change, "value": value})
+            entries.append({**entry, "changes": changes})
+        return {**data, "entry": entries}, list(fresh)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._recent),
+            "max_size": self.max_size,
+            "events": self.events,
+            "duplicates": self.duplicates,
+            "drop_rate": round(self.duplicates / self.events, 4) if self.events else 0.0,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "released": self.released,
+            "db_errors": self.db_errors,
+        }
+
+
+class ProcessedEventPruner(PeriodicTask):
+    """
+    Remove da processed_event as chaves com mais de IDEMPOTENCY_TTL_DAYS,
+    em lotes de IDEMPOTENCY_PRUNE_BATCH até esvaziar.
+    """
+
+    name = "processed_event_pruner"
+
+    def __init__(
+        self,
+        interval: float = IDEMPOTENCY_PRUNE_INTERVAL,
+        ttl_days: int = IDEMPOTENCY_TTL_DAYS,
+        batch_size: int = IDEMPOTENCY_PRUNE_BATCH
+    ):
+        super().__init__(interval)
+        self.ttl_days = max(1, ttl_days)
+        self.batch_size = max(1, batch_size)
+        self.pruned = 0
+        self.last_pruned = 0
+
+    async def run_once(self) -> None:
+        before = datetime.now() - timedelta(days=self.ttl_days)
+        total = 0
+        while True:
+            rows = await adb.prune_processed_events(before, self.batch_size)
+            if rows is None:
+                raise RuntimeError("falha ao limpar processed_event")
+            total += rows
+            if rows < self.batch_size:
+                break
+            await asyncio.sleep(IDEMPOTENCY_PRUNE_PAUSE)
+
+        self.pruned += total
+        self.last_pruned = total
+        if total:
+            print(f"✓ Idempotência: {total} eventos antigos removidos da processed_event")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "ttl_days": self.ttl_days,
+            "pruned": self.pruned,
+            "last_pruned": self.last_pruned,
+        }
+
+
+# Instâncias globais
+deduplicator = EventDeduplicator()
+processed_event_pruner = ProcessedEventPruner()
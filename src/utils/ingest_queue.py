@@ -0,0 +1,434 @@
+import os
+import orjson
+import shutil
+import struct
+import asyncio
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from mysql.connector.errors import InterfaceError, OperationalError
+from src.db.async_storage import adb
+from src.db.pool import PoolTimeout
+from src.utils.filter import process_webhook_payload
+from src.utils.idempotency import deduplicator
+
+load_dotenv()
+
+# Modo de ingestão do webhook:
+#   sync  -> salva e processa dentro da requisição (comportamento original)
+#   queue -> grava o corpo bruto no journal em disco e responde 200 na hora
+INGEST_MODE = (os.getenv("WEBHOOK_INGEST_MODE") or "sync").lower()
+QUEUE_DIR = os.getenv("WEBHOOK_QUEUE_DIR") or "data/webhook_queue"
+QUEUE_WORKERS = int(os.getenv("WEBHOOK_QUEUE_WORKERS") or 4)
+QUEUE_FSYNC = (os.getenv("WEBHOOK_QUEUE_FSYNC") or "true").lower() == "true"
+QUEUE_COMPACT_BYTES = int(os.getenv("WEBHOOK_QUEUE_COMPACT_BYTES") or 1024 * 1024)
+QUEUE_MAX_BACKOFF = 30.0
+# Tentativas de um webhook antes de ir para o dead letter (falhas com o banco
+# fora do ar não contam: essas repetem até ele voltar)
+QUEUE_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_QUEUE_MAX_ATTEMPTS") or 5)
+
+# Erros de conexão/pool: o payload não tem culpa
+TRANSIENT_ERRORS = (InterfaceError, OperationalError, PoolTimeout)
+
+_HEADER = struct.Struct(">I")
+
+
+class WebhookJournal:
+    """
+    Journal append-only em disco com os corpos brutos dos webhooks.
+
+    Cada registro é gravado como 4 bytes de tamanho + corpo. O arquivo
+    `journal.offset` guarda até onde os registros já foram processados;
+    no restart tudo que estiver depois desse offset é reprocessado.
+
+    Só um processo pode escrever no diretório: `open` pega um flock
+    exclusivo em `journal.lock` e falha se outro processo já o tem. A
+    IngestQueue usa um diretório por processo (<WEBHOOK_QUEUE_DIR>/worker-<pid>)
+    e adota no startup os journals cujo processo não existe mais.
+    """
+
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        self.log_path = os.path.join(directory, "journal.log")
+        self.offset_path = os.path.join(directory, "journal.offset")
+        self.lock_path = os.path.join(directory, "journal.lock")
+        self._lock = threading.Lock()
+        self._lock_fd: Optional[int] = None
+        self._file = None
+        self._size = 0
+        self._committed = 0
+        # start -> end dos registros já processados fora de ordem
+        self._done: Dict[int, int] = {}
+
+    def open(self) -> None:
+        """
+        Abre o journal e descarta um registro final incompleto (gravação interrompida).
+
+        RuntimeError se outro processo já está com o journal aberto.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._acquire_lock()
+        self._file = open(self.log_path, "ab+")
+        self._size = self._file.seek(0, os.SEEK_END)
+        self._committed = self._read_offset()
+        if self._committed > self._size:
+            self._committed = 0
+
+        valid_end = self._committed
+        for _, end, _ in self._iter_records(self._committed):
+            valid_end = end
+        if valid_end < self._size:
+            print(f"⚠ Journal: registro incompleto descartado ({self._size - valid_end} bytes)")
+            self._file.truncate(valid_end)
+            self._size = valid_end
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._release_lock()
+
+    def _acquire_lock(self) -> None:
+        if not self._try_lock():
+            raise RuntimeError(f"Journal {self.directory} já está aberto por outro processo")
+
+    def _try_lock(self) -> bool:
+        # fcntl só existe em POSIX; importado aqui como no barramento WebSocket
+        import fcntl
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _release_lock(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self) -> None:
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self._committed))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def _iter_records(self, start: int):
+        """Itera (start, end, corpo) a partir de um offset"""
+        with open(self.log_path, "rb") as f:
+            f.seek(start)
+            pos = start
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                (length,) = _HEADER.unpack(header)
+                body = f.read(length)
+                if len(body) < length:
+                    return
+                end = pos + _HEADER.size + length
+                yield pos, end, body
+                pos = end
+
+    def append(self, body: bytes) -> Tuple[int, int]:
+        """Grava um corpo no journal e retorna (start, end)"""
+        with self._lock:
+            start = self._size
+            self._file.write(_HEADER.pack(len(body)) + body)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._size = start + _HEADER.size + len(body)
+            return start, self._size
+
+    def adopt(self, directory: str, remove_directory: bool = True) -> Optional[int]:
+        """
+        Copia para este journal os registros pendentes de um journal órfão
+        (processo que morreu) e apaga o órfão, tudo sob o flock dele.
+        Retorna quantos foram copiados, ou None se outro processo é dono dele.
+        """
+        orphan = WebhookJournal(directory, fsync=False)
+        if not orphan._try_lock():
+            return None
+        try:
+            copied = 0
+            # Sem o log: outro processo já adotou e apagou entre o open e o flock
+            if os.path.exists(orphan.log_path):
+                for _, _, body in orphan._iter_records(orphan._read_offset()):
+                    self.append(body)
+                    copied += 1
+            if remove_directory:
+                shutil.rmtree(directory, ignore_errors=True)
+            else:
+                for path in (orphan.log_path, orphan.offset_path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            return copied
+        finally:
+            orphan._release_lock()
+
+    def pending(self) -> List[Tuple[int, int, bytes]]:
+        """Registros ainda não processados (usado no startup)"""
+        with self._lock:
+            return list(self._iter_records(self._committed))
+
+    def ack(self, start: int, end: int) -> None:
+        """Marca um registro como processado e avança o offset contíguo"""
+        with self._lock:
+            self._done[start] = end
+            advanced = False
+            while self._committed in self._done:
+                self._committed = self._done.pop(self._committed)
+                advanced = True
+            if not advanced:
+                return
+
+            # Tudo processado: compacta o journal para não crescer para sempre
+            if self._committed == self._size and self._size >= QUEUE_COMPACT_BYTES:
+                self._file.truncate(0)
+                self._size = 0
+                self._committed = 0
+            self._write_offset()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "journal_bytes": self._size,
+            "pending_bytes": self._size - self._committed,
+        }
+
+
+class DeadLetter:
+    """
+    Webhooks que falharam QUEUE_MAX_ATTEMPTS vezes, um JSON por linha
+    (falha, tentativas, erro e o corpo original) para análise e reenvio manual.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, body: bytes, error: str, attempts: int) -> None:
+        line = orjson.dumps({
+            "failed_at": datetime.now(),
+            "attempts": attempts,
+            "error": error,
+            "body": body.decode("utf-8", "replace"),
+        }) + b"\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class WebhookProcessingError(Exception):
+    """Falha ao processar um webhook já salvo; leva o id para a nova tentativa não salvar de novo"""
+
+    def __init__(self, webhook_id: int, error: Exception):
+        super().__init__(str(error))
+        self.webhook_id = webhook_id
+        self.error = error
+
+
+async def handle_webhook(
+    data: Dict[str, Any],
+    body: Optional[bytes] = None,
+    webhook_id: Optional[int] = None
+) -> Optional[int]:
+    """
+    Salva o webhook e processa o payload (usado pelos workers da fila).
+
+    `body` são os bytes originais do journal, gravados sem re-serializar.
+    Com `webhook_id` (nova tentativa de um webhook já salvo) só processa.
+    Retorna o id do webhook, 0 se todos os eventos eram reenvios já
+    processados, ou None se não conseguiu salvar (o worker tenta de novo).
+    Falha no processamento sobe como WebhookProcessingError.
+    """
+    payload, claimed = await deduplicator.filter_payload(data)
+    if payload is None:
+        return webhook_id or 0
+
+    if webhook_id is None:
+        webhook_id = await adb.save_webhook(body if body is not None else data)
+        if webhook_id is None:
+            deduplicator.release(claimed)
+            return None
+
+    try:
+        await process_webhook_payload(payload)
+    except Exception as e:
+        # As chaves só vão para processed_event junto com o efeito do evento;
+        # liberando a reserva em memória, a nova tentativa do worker reprocessa
+        deduplicator.release(claimed)
+        raise WebhookProcessingError(webhook_id, e) from e
+    return webhook_id
+
+
+class IngestQueue:
+    """
+    Fila durável do webhook drenada por um pool de workers asyncio.
+
+    Um webhook que falha QUEUE_MAX_ATTEMPTS vezes com o banco no ar (erro de
+    constraint, bug no processamento) vai para o dead letter e é confirmado
+    no journal, para não prender um worker para sempre.
+    """
+
+    def __init__(self, directory: str = QUEUE_DIR, workers: int = QUEUE_WORKERS, fsync: bool = QUEUE_FSYNC):
+        self.directory = directory
+        # Um journal por processo: vários workers do uvicorn dividem o WEBHOOK_QUEUE_DIR
+        self.journal = WebhookJournal(os.path.join(directory, f"worker-{os.getpid()}"), fsync=fsync)
+        self.dead_letter = DeadLetter(os.path.join(directory, "dead_letter.jsonl"))
+        self.workers = max(1, workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.enqueued = 0
+        self.processed = 0
+        self.discarded = 0
+        self.retries = 0
+        self.dead_lettered = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        """Abre o journal, adota os órfãos, reenfileira o que ficou pendente e sobe os workers"""
+        await asyncio.to_thread(self.journal.open)
+        await asyncio.to_thread(self._adopt_orphans)
+        self._queue = asyncio.Queue()
+
+        pending = await asyncio.to_thread(self.journal.pending)
+        for record in pending:
+            self._queue.put_nowait(record)
+        if pending:
+            print(f"✓ Journal: {len(pending)} webhooks pendentes reenfileirados")
+
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"webhook-worker-{i}")
+            for i in range(self.workers)
+        ]
+        print(f"✓ Fila de webhooks iniciada ({self.workers} workers) em {self.journal.directory}")
+
+    async def stop(self) -> None:
+        """Para os workers; o que não foi processado continua no journal (adotado no próximo startup)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        drained = not self.journal.stats()["pending_bytes"]
+        self.journal.close()
+        if drained:
+            shutil.rmtree(self.journal.directory, ignore_errors=True)
+
+    def _adopt_orphans(self) -> None:
+        """Journals de processos que morreram (e o do layout antigo, direto no diretório raiz)"""
+        if os.path.exists(os.path.join(self.directory, "journal.log")):
+            self._adopt(self.directory, remove_directory=False)
+        for name in sorted(os.listdir(self.directory)):
+            directory = os.path.join(self.directory, name)
+            if name.startswith("worker-") and os.path.abspath(directory) != os.path.abspath(self.journal.directory):
+                self._adopt(directory)
+
+    def _adopt(self, directory: str, remove_directory: bool = True) -> None:
+        copied = self.journal.adopt(directory, remove_directory)
+        if copied:
+            print(f"✓ Journal órfão {directory}: {copied} webhooks adotados")
+
+    async def put(self, body: bytes) -> None:
+        """Persiste o corpo no journal e enfileira para os workers"""
+        start, end = await asyncio.to_thread(self.journal.append, body)
+        self.enqueued += 1
+        self._queue.put_nowait((start, end, body))
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            start, end, body = await self._queue.get()
+            try:
+                try:
+                    data = orjson.loads(body)
+                except ValueError as e:
+                    print(f"✗ Webhook descartado (JSON inválido): {e}")
+                    self.discarded += 1
+                    continue
+
+                backoff = 0.5
+                attempts = 0
+                webhook_id = None
+                while True:
+                    error: Optional[BaseException] = None
+                    try:
+                        if await handle_webhook(data, body, webhook_id) is not None:
+                            self.processed += 1
+                            break
+                    except WebhookProcessingError as e:
+                        # Já salvo: a próxima tentativa não grava o webhook bruto de novo
+                        webhook_id = e.webhook_id
+                        error = e.error
+                        print(f"Erro no worker {index} ao processar webhook #{webhook_id}: {e}")
+                    except Exception as e:
+                        error = e
+                        print(f"Erro no worker {index} ao processar webhook: {e}")
+
+                    # Banco indisponível: mantém no journal e tenta de novo sem limite
+                    if not await self._is_transient(error):
+                        attempts += 1
+                        if attempts >= QUEUE_MAX_ATTEMPTS:
+                            reason = repr(error) if error else "webhook não foi salvo"
+                            await asyncio.to_thread(self.dead_letter.write, body, reason, attempts)
+                            self.dead_lettered += 1
+                            print(f"✗ Webhook movido para o dead letter após {attempts} tentativas: {reason}")
+                            break
+                    self.retries += 1
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, QUEUE_MAX_BACKOFF)
+            finally:
+                if not self._is_cancelling():
+                    await asyncio.to_thread(self.journal.ack, start, end)
+                self._queue.task_done()
+
+    @staticmethod
+    async def _is_transient(error: Optional[BaseException]) -> bool:
+        """Falha de conexão/pool, ou o banco não responde (save_webhook só devolve None)"""
+        if isinstance(error, TRANSIENT_ERRORS):
+            return True
+        return not await adb.check_connection()
+
+    @staticmethod
+    def _is_cancelling() -> bool:
+        task = asyncio.current_task()
+        return bool(task and task.cancelling())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": INGEST_MODE,
+            "workers": self.workers if self.running else 0,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "discarded": self.discarded,
+            "retries": self.retries,
+            "dead_lettered": self.dead_lettered,
+            **self.journal.stats(),
+        }
+
+
+# Instância global
+ingest_queue = IngestQueue()
@@ -0,0 +1,26 @@
+import json
+import base64
+from typing import Any, List, Optional
+
+
+def encode_cursor(kind: str, values: List[Any]) -> str:
+    """Gera o cursor opaco com as chaves de ordenação da última linha da página"""
+    raw = json.dumps({"k": kind, "v": values}, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str], kind: str, size: int) -> Optional[List[Any]]:
+    """Decodifica o cursor; ValueError se for inválido ou de outra listagem"""
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(data, dict) or data.get("k") != kind:
+        raise ValueError("Cursor inválido")
+    values = data.get("v")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Cursor inválido")
+    return values
@@ -0,0 +1,97 @@
+import time
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class PeriodicTask:
+    """
+    Tarefa de fundo executada a cada `interval` segundos dentro do event loop.
+
+    Subclasses implementam `run_once`; falhas são contadas e logadas sem
+    derrubar o loop. Intervalo <= 0 desativa a tarefa.
+    """
+
+    name = "tarefa"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.runs = 0
+        self.failures = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def run_once(self) -> None:
+        raise NotImplementedError
+
+    def start(self) -> None:
+        if self.interval <= 0 or self.running:
+            return
+        self._task = asyncio.create_task(self._loop(), name=self.name)
+        print(f"✓ Tarefa '{self.name}' iniciada (a cada {self.interval:g}s)")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                print(f"Erro na tarefa '{self.name}': {e}")
+            finally:
+                self.runs += 1
+                self.last_run_at = datetime.now()
+                self.last_duration_ms = round((time.monotonic() - started) * 1000, 2)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "interval_s": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run_at": self.last_run_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_run_at else None,
+            "last_duration_ms": self.last_duration_ms,
+        }
+
+
+class Scheduler:
+    """Registro das tarefas periódicas, iniciadas e paradas pelo lifespan"""
+
+    def __init__(self):
+        self.tasks: List[PeriodicTask] = []
+
+    def add(self, task: PeriodicTask) -> None:
+        if task not in self.tasks:
+            self.tasks.append(task)
+
+    def start(self) -> None:
+        for task in self.tasks:
+            task.start()
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            await task.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {task.name: task.stats() for task in self.tasks}
+
+
+# Instância global
+scheduler = Scheduler()
@@ -0,0 +1,75 @@
+import os
+import asyncio
+from typing import Any, Dict
+from dotenv import load_dotenv
+from src.db.async_storage import adb
+from src.utils.scheduler import PeriodicTask
+
+load_dotenv()
+
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL") or 60)
+SESSION_SWEEP_BATCH = int(os.getenv("SESSION_SWEEP_BATCH") or 1000)
+SESSION_SWEEP_MAX_BATCHES = int(os.getenv("SESSION_SWEEP_MAX_BATCHES") or 50)
+# Pausa entre lotes para não disputar locks com o ingest
+SESSION_SWEEP_PAUSE = 0.05
+
+
+class SessionSweeper(PeriodicTask):
+    """
+    Desativa (is_active = FALSE) as sessões expiradas.
+
+    Substitui a desativação preguiçosa que acontecia na leitura: cada
+    execução roda lotes de SESSION_SWEEP_BATCH sessões (achadas pelo índice
+    idx_active e sem nenhuma mensagem ainda válida) até esvaziar ou atingir
+    SESSION_SWEEP_MAX_BATCHES; o que sobrar fica para a próxima.
+    """
+
+    name = "session_sweeper"
+
+    def __init__(
+        self,
+        interval: float = SESSION_SWEEP_INTERVAL,
+        batch_size: int = SESSION_SWEEP_BATCH,
+        max_batches: int = SESSION_SWEEP_MAX_BATCHES
+    ):
+        super().__init__(interval)
+        self.batch_size = max(1, batch_size)
+        self.max_batches = max(1, max_batches)
+        self.deactivated = 0
+        self.batches = 0
+        self.last_deactivated = 0
+        self.backlog = False
+
+    async def run_once(self) -> None:
+        total = 0
+        self.backlog = False
+        for i in range(self.max_batches):
+            sessions = await adb.deactivate_expired_sessions(self.batch_size)
+            if sessions is None:
+                raise RuntimeError("falha ao desativar sessões expiradas")
+            self.batches += 1
+            total += sessions
+            if sessions < self.batch_size:
+                break
+            if i == self.max_batches - 1:
+                self.backlog = True
+            await asyncio.sleep(SESSION_SWEEP_PAUSE)
+
+        self.deactivated += total
+        self.last_deactivated = total
+        if total:
+            print(f"✓ Sweeper: {total} sessões expiradas desativadas")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "batch_size": self.batch_size,
+            "batches": self.batches,
+            "deactivated": self.deactivated,
+            "last_deactivated": self.last_deactivated,
+            "backlog": self.backlog,
+        }
+
+
+# Instância global
+session_sweeper = SessionSweeper()
@@ -0,0 +1,116 @@
+import os
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from src.db.async_storage import adb
+from src.db.queries import STATUS_RANK
+
+load_dotenv()
+
+# Janela para juntar status de vários webhooks num único lote
+STATUS_BATCH_WINDOW_MS = float(os.getenv("STATUS_BATCH_WINDOW_MS") or 50)
+STATUS_BATCH_SIZE = int(os.getenv("STATUS_BATCH_SIZE") or 500)
+
+
+def coalesce_statuses(statuses: Iterable[Dict[str, Any]], into: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Reduz os eventos de status a um por wamid, ficando com o mais avançado"""
+    coalesced = {} if into is None else into
+    for st in statuses:
+        wamid = st.get("id")
+        status = (st.get("status") or "").lower()
+        if not wamid or status not in STATUS_RANK:
+            continue
+        current = coalesced.get(wamid)
+        if current is None or STATUS_RANK[status] > STATUS_RANK[current]:
+            coalesced[wamid] = status
+    return coalesced
+
+
+class StatusPipeline:
+    """
+    Agrupa os status de entrega/leitura dos webhooks e grava em lote.
+
+    `submit` junta os eventos ao lote pendente e espera o flush (até
+    STATUS_BATCH_WINDOW_MS ou STATUS_BATCH_SIZE wamids), então quem chama
+    só segue depois do status gravado (o journal da fila só confirma depois).
+    """
+
+    def __init__(self, window_ms: float = STATUS_BATCH_WINDOW_MS, batch_size: int = STATUS_BATCH_SIZE):
+        self.window = window_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self._pending: Dict[str, str] = {}
+        self._keys: List[str] = []
+        self._waiters: List[asyncio.Future] = []
+        self._timer: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.events = 0
+        self.batches = 0
+        self.wamids = 0
+        self.updated = 0
+        self.failures = 0
+
+    async def submit(self, statuses: List[Dict[str, Any]], keys: Iterable[str] = ()) -> bool:
+        """
+        Enfileira os status e espera o lote ser gravado; False se o lote falhou.
+
+        `keys` são as chaves de idempotência dos eventos, gravadas na mesma
+        transação do lote.
+        """
+        self.events += len(statuses)
+        coalesce_statuses(statuses, into=self._pending)
+        self._keys.extend(keys)
+        if not self._pending:
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if len(self._pending) >= self.batch_size:
+            await self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return await waiter
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self._flush()
+
+    async def _flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        keys, self._keys = self._keys, []
+        waiters, self._waiters = self._waiters, []
+        if not waiters:
+            return
+
+        ok = False
+        try:
+            updated = await adb.apply_message_statuses(pending, keys)
+            ok = updated is not None
+            if ok:
+                self.updated += updated
+                print(f"✓ Status aplicados: {updated}/{len(pending)} mensagens atualizadas")
+        except Exception as e:
+            print(f"Erro ao aplicar lote de status: {e}")
+        finally:
+            self.batches += 1
+            self.wamids += len(pending)
+            if not ok:
+                self.failures += 1
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(ok)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "events": self.events,
+            "batches": self.batches,
+            "wamids": self.wamids,
+            "updated": self.updated,
+            "failures": self.failures,
+            "coalesce_ratio": round(self.events / self.wamids, 2) if self.wamids else 0.0,
+        }
+
+
+# Instância global
+status_pipeline = StatusPipeline()
@@ -0,0 +1,105 @@
+import os
+import asyncio
+from datetime import date, timedelta
+from typing import Any, Dict
+from dotenv import load_dotenv
+from src.db.storage import db
+from src.db.migrations import table_exists
+from src.db.partitions import DAY, is_partitioned, ensure_future_partitions, closed_partitions, drop_partition
+from src.utils.scheduler import PeriodicTask
+
+load_dotenv()
+
+# Dias de webhook bruto mantidos (0 = sem limite)
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS") or 30)
+WEBHOOK_PRUNE_INTERVAL = float(os.getenv("WEBHOOK_PRUNE_INTERVAL") or 3600)
+WEBHOOK_PARTITION_DAYS_AHEAD = int(os.getenv("WEBHOOK_PARTITION_DAYS_AHEAD") or 7)
+
+PRUNE_LOCK = "whatsapp_webhook_pruner"
+TABLE = "webhook"
+LEGACY_TABLE = "webhook_legacy"
+
+
+class WebhookPruner(PeriodicTask):
+    """
+    Retenção da tabela webhook (particionada por dia).
+
+    Cria as partições dos próximos dias e remove com DROP PARTITION as que
+    saíram da retenção, sem DELETE linha a linha. A webhook_legacy (tabela
+    anterior à migração) é removida quando todo o conteúdo dela expira.
+    """
+
+    name = "webhook_pruner"
+
+    def __init__(
+        self,
+        interval: float = WEBHOOK_PRUNE_INTERVAL,
+        retention_days: int = WEBHOOK_RETENTION_DAYS,
+        days_ahead: int = WEBHOOK_PARTITION_DAYS_AHEAD
+    ):
+        super().__init__(interval)
+        self.retention_days = max(0, retention_days)
+        self.days_ahead = max(1, days_ahead)
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+        self.legacy_dropped = False
+        self.skipped = 0
+
+    async def run_once(self) -> None:
+        await asyncio.to_thread(self._run)
+
+    def _run(self) -> None:
+        conn = db._get_connection()
+        if not conn:
+            raise RuntimeError("sem conexão com o banco")
+
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT GET_LOCK(%s, 0)", (PRUNE_LOCK,))
+            if not cur.fetchone()[0]:
+                self.skipped += 1
+                return
+            try:
+                if not is_partitioned(cur, TABLE):
+                    return
+                created = ensure_future_partitions(cur, TABLE, self.days_ahead, DAY)
+                self.partitions_created += len(created)
+
+                if not self.retention_days:
+                    return
+                cutoff = date.today() - timedelta(days=self.retention_days)
+                for name in closed_partitions(cur, TABLE, cutoff):
+                    drop_partition(cur, TABLE, name)
+                    self.partitions_dropped += 1
+                    print(f"✓ Retenção: partição {TABLE}.{name} removida")
+                self._drop_legacy(cur, cutoff)
+            finally:
+                cur.execute("SELECT RELEASE_LOCK(%s)", (PRUNE_LOCK,))
+                cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _drop_legacy(self, cur, cutoff: date) -> None:
+        if not table_exists(cur, LEGACY_TABLE):
+            return
+        cur.execute(f"SELECT MAX(date) FROM {LEGACY_TABLE}")
+        newest = cur.fetchone()[0]
+        if newest is None or newest.date() < cutoff:
+            cur.execute(f"DROP TABLE {LEGACY_TABLE}")
+            self.legacy_dropped = True
+            print(f"✓ Retenção: tabela {LEGACY_TABLE} removida")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "retention_days": self.retention_days,
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+            "legacy_dropped": self.legacy_dropped,
+            "skipped_locked": self.skipped,
+        }
+
+
+# Instância global
+webhook_pruner = WebhookPruner()
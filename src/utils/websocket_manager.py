@@ -1,76 +1,514 @@
-from typing import Dict, Set
-from fastapi import WebSocket
-import json
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from fastapi import WebSocket, WebSocketDisconnect
+from dotenv import load_dotenv
+from src.utils.fast_json import dumps_text
+from src.utils.ws_codec import JSON, MSGPACK, ENCODINGS, Frame, decode, encode, negotiate, to_msgpack
+from src.utils.broadcast_bus import BroadcastBus, create_bus
+import os
+import time
 import asyncio
 
+load_dotenv()
+
+# Tempo máximo (segundos) de um envio; quem passar disso é desconectado
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT") or 5)
+# Frames pendentes por conexão antes de aplicar a política
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE") or 256)
+# drop_oldest: descarta o frame mais antigo | drop_newest: descarta o novo | disconnect: desconecta
+WS_QUEUE_POLICY = os.getenv("WS_QUEUE_POLICY") or "drop_oldest"
+QUEUE_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+# Eventos recentes guardados por canal para reconexão com resume_from
+WS_REPLAY_BUFFER = int(os.getenv("WS_REPLAY_BUFFER") or 1000)
+
+# Código de fechamento para clientes lentos demais (1013: try again later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Código de fechamento para clientes que pararam de responder ao ping (1001: going away)
+IDLE_CLOSE_CODE = 1001
+# Minutos de histórico de conexões/desconexões (churn) nas métricas
+CHURN_MINUTES = 15
+# Canal do barramento para as conexões globais
+GLOBAL_CHANNEL = "*"
+
+
+def with_seq(data: str, seq: int) -> str:
+    """Inclui "seq" no objeto JSON já serializado, sem serializar de novo"""
+    if data == "{}":
+        return f'{{"seq":{seq}}}'
+    return f'{{"seq":{seq},{data[1:]}'
+
+
+class ChannelHistory:
+    """Últimos frames de um canal (buffer circular) para reenvio na reconexão"""
+    
+    def __init__(self, size: int = WS_REPLAY_BUFFER):
+        self.frames: Deque[Tuple[int, str]] = deque(maxlen=max(1, size))
+        self.last_seq = 0
+    
+    def append(self, seq: int, data: str) -> None:
+        if seq <= self.last_seq:
+            # Numeração recomeçou (novo broker sem o histórico): o buffer antigo não vale mais
+            self.frames.clear()
+        self.frames.append((seq, data))
+        self.last_seq = seq
+    
+    def since(self, seq: int) -> Optional[List[str]]:
+        """Frames posteriores a `seq`; None se algum já saiu do buffer (ou seq é desconhecida)"""
+        if seq > self.last_seq:
+            return None
+        if seq == self.last_seq:
+            return []
+        if not self.frames or self.frames[0][0] > seq + 1:
+            return None
+        return [data for s, data in self.frames if s > seq]
+
+
+class ClientConnection:
+    """
+    Uma conexão WebSocket com fila de saída limitada.
+    
+    Os broadcasts só enfileiram o frame já serializado; uma tarefa por
+    conexão escreve no socket. Quando a fila enche, a política decide entre
+    descartar frames ou desconectar o cliente lento.
+    """
+    
+    def __init__(
+        self,
+        websocket: WebSocket,
+        channel: Optional[str],
+        manager: "ConnectionManager",
+        encoding: str = JSON
+    ):
+        self.websocket = websocket
+        self.channel = channel
+        self.encoding = encoding
+        self.manager = manager
+        self.queue: Deque[Tuple[float, Frame]] = deque()
+        self.closed = False
+        self.reason: Optional[str] = None
+        self.close_code = SLOW_CONSUMER_CLOSE_CODE
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+        # Métricas
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.pongs = 0
+        self.rtt_ms: Optional[float] = None
+    
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._writer())
+    
+    def enqueue(self, data: Frame) -> bool:
+        """Enfileira um frame; retorna False se ele (ou o cliente) foi descartado"""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.manager.max_queue:
+            if self.manager.policy == "disconnect":
+                self.close("fila cheia")
+                return False
+            self.dropped += 1
+            self.manager.frames_dropped += 1
+            if self.manager.policy == "drop_newest":
+                return False
+            self.queue.popleft()
+        self.queue.append((time.monotonic(), data))
+        self._wakeup.set()
+        return True
+    
+    def close(self, reason: Optional[str] = None, code: int = SLOW_CONSUMER_CLOSE_CODE) -> None:
+        """Encerra a escrita; com `reason` o cliente é removido e o socket fechado"""
+        if self.closed:
+            return
+        self.closed = True
+        self.reason = reason
+        self.close_code = code
+        self.queue.clear()
+        self._wakeup.set()
+    
+    def touch(self) -> None:
+        """Registra atividade do cliente (qualquer mensagem recebida)"""
+        self.last_seen = time.monotonic()
+    
+    def pong(self, ts: Any) -> None:
+        self.pongs += 1
+        if isinstance(ts, (int, float)):
+            self.rtt_ms = max(0.0, time.time() * 1000 - ts)
+    
+    def lag_ms(self) -> float:
+        """Idade do frame pendente mais antigo"""
+        return (time.monotonic() - self.queue[0][0]) * 1000 if self.queue else 0.0
+    
+    async def _writer(self) -> None:
+        try:
+            while True:
+                if not self.queue:
+                    if self.closed:
+                        break
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                
+                queued_at, data = self.queue.popleft()
+                try:
+                    send = self.websocket.send_bytes if isinstance(data, bytes) else self.websocket.send_text
+                    await asyncio.wait_for(send(data), self.manager.send_timeout)
+                except asyncio.TimeoutError:
+                    self.manager.send_timeouts += 1
+                    self.close(f"envio excedeu {self.manager.send_timeout}s")
+                    break
+                except Exception as e:
+                    self.manager.send_errors += 1
+                    self.close(f"erro no envio: {e}")
+                    break
+                
+                self.sent += 1
+                self.manager.frames_sent += 1
+                self.last_lag_ms = (time.monotonic() - queued_at) * 1000
+                self.max_lag_ms = max(self.max_lag_ms, self.last_lag_ms)
+        finally:
+            self.closed = True
+            self.queue.clear()
+            if self.reason:
+                self.manager._evict(self)
+                try:
+                    await asyncio.wait_for(
+                        self.websocket.close(code=self.close_code), self.manager.send_timeout
+                    )
+                except Exception:
+                    pass
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "channel": self.channel or "global",
+            "encoding": self.encoding,
+            "queued": len(self.queue),
+            "lag_ms": round(self.lag_ms(), 2),
+            "last_lag_ms": round(self.last_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "rtt_ms": round(self.rtt_ms, 2) if self.rtt_ms is not None else None,
+            "idle_for": round(time.monotonic() - self.last_seen, 1),
+            "connected_for": round(time.monotonic() - self.connected_at, 1),
+        }
+
+
 class ConnectionManager:
-    def __init__(self):
+    def __init__(
+        self,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        max_queue: int = WS_QUEUE_SIZE,
+        policy: str = WS_QUEUE_POLICY,
+        bus: Optional[BroadcastBus] = None,
+        replay_size: int = WS_REPLAY_BUFFER
+    ):
         # Armazena conexões por phone_number_id
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self.active_connections: Dict[str, Set[ClientConnection]] = {}
         # Armazena conexões globais (admin dashboard)
-        self.global_connections: Set[WebSocket] = set()
+        self.global_connections: Set[ClientConnection] = set()
+        # WebSocket -> conexão (para disconnect/send_personal_message)
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.send_timeout = send_timeout
+        self.max_queue = max(1, max_queue)
+        if policy not in QUEUE_POLICIES:
+            print(f"⚠ WS_QUEUE_POLICY inválida ({policy}), usando drop_oldest")
+            policy = "drop_oldest"
+        self.policy = policy
+        # Todo broadcast passa pelo barramento (compartilhado entre workers)
+        self.bus = bus or create_bus()
+        self.bus.bind(self._deliver)
+        # Canal -> eventos recentes (seq monotônica por canal)
+        self.history: Dict[str, ChannelHistory] = {}
+        self.replay_size = replay_size
+        
+        # Métricas
+        self.broadcasts = 0
+        self.frames_queued = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.send_errors = 0
+        self.send_timeouts = 0
+        self.evicted = 0
+        self.replayed = 0
+        self.resyncs = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.peak_connections = 0
+        self.idle_evicted = 0
+        self.pings_sent = 0
+        self.pongs = 0
+        self._closed_seconds = 0.0
+        # [minuto, conexões, desconexões] dos últimos CHURN_MINUTES minutos
+        self._churn: Deque[List[int]] = deque(maxlen=CHURN_MINUTES)
     
-    async def connect(self, websocket: WebSocket, phone_number_id: str = None):
-        """Conecta cliente ao WebSocket"""
-        await websocket.accept()
+    async def connect(self, websocket: WebSocket, phone_number_id: str = None, encoding: str = None):
+        """Conecta cliente ao WebSocket (encoding: json ou msgpack, ou via subprotocolo)"""
+        encoding, subprotocol = negotiate(websocket, encoding)
+        await websocket.accept(subprotocol=subprotocol)
         
+        client = ClientConnection(websocket, phone_number_id, self, encoding)
+        self.clients[websocket] = client
         if phone_number_id:
             # Conexão específica para um número
             if phone_number_id not in self.active_connections:
                 self.active_connections[phone_number_id] = set()
-            self.active_connections[phone_number_id].add(websocket)
+            self.active_connections[phone_number_id].add(client)
             print(f"✓ Cliente conectado ao phone_number_id: {phone_number_id}")
         else:
             # Conexão global (recebe tudo)
-            self.global_connections.add(websocket)
+            self.global_connections.add(client)
             print(f"✓ Cliente conectado globalmente")
+        self.connects += 1
+        self.peak_connections = max(self.peak_connections, len(self.clients))
+        self._record_churn(1)
+        client.start()
+    
+    def _record_churn(self, index: int) -> None:
+        minute = int(time.time() // 60)
+        if not self._churn or self._churn[-1][0] != minute:
+            self._churn.append([minute, 0, 0])
+        self._churn[-1][index] += 1
+    
+    def _remove(self, client: ClientConnection) -> bool:
+        """Tira o cliente do registro; False se ele já tinha saído"""
+        if self.clients.get(client.websocket) is not client:
+            return False
+        del self.clients[client.websocket]
+        self._unregister(client)
+        self.disconnects += 1
+        self._closed_seconds += time.monotonic() - client.connected_at
+        self._record_churn(2)
+        return True
+    
+    def _unregister(self, client: ClientConnection) -> None:
+        if client.channel:
+            connections = self.active_connections.get(client.channel)
+            if connections is not None:
+                connections.discard(client)
+                if not connections:
+                    del self.active_connections[client.channel]
+        else:
+            self.global_connections.discard(client)
     
     def disconnect(self, websocket: WebSocket, phone_number_id: str = None):
         """Desconecta cliente"""
-        if phone_number_id and phone_number_id in self.active_connections:
-            self.active_connections[phone_number_id].discard(websocket)
-            if not self.active_connections[phone_number_id]:
-                del self.active_connections[phone_number_id]
+        client = self.clients.get(websocket)
+        if client:
+            self._remove(client)
+            client.close()
+        if phone_number_id:
             print(f"✓ Cliente desconectado de: {phone_number_id}")
         else:
-            self.global_connections.discard(websocket)
             print(f"✓ Cliente desconectado globalmente")
     
+    def _evict(self, client: ClientConnection) -> None:
+        """Remove um cliente lento/morto (chamado pela tarefa de escrita)"""
+        if not self._remove(client):
+            return
+        self.evicted += 1
+        print(f"⚠ Cliente WebSocket removido ({client.channel or 'global'}): {client.reason}")
+    
+    async def start(self):
+        """Conecta o barramento de broadcast"""
+        await self.bus.start()
+    
+    async def stop(self):
+        await self.bus.stop()
+    
+    def _deliver(self, channel: str, seq: int, data: str) -> int:
+        """Numera o frame, guarda no histórico do canal e enfileira para as conexões locais"""
+        data = with_seq(data, seq)
+        history = self.history.get(channel)
+        if history is None:
+            history = self.history[channel] = ChannelHistory(self.replay_size)
+        history.append(seq, data)
+        
+        if channel == GLOBAL_CHANNEL:
+            connections = self.global_connections
+        else:
+            connections = self.active_connections.get(channel)
+        if not connections:
+            return 0
+        # Cópia: a política "disconnect" pode remover clientes durante o laço
+        accepted = 0
+        packed = None
+        for client in list(connections):
+            if client.encoding == MSGPACK:
+                # Convertido uma vez por frame, só se houver cliente binário
+                if packed is None:
+                    packed = to_msgpack(data)
+                accepted += client.enqueue(packed)
+            else:
+                accepted += client.enqueue(data)
+        self.broadcasts += 1
+        self.frames_queued += accepted
+        return accepted
+    
+    def publish_to_phone(self, phone_number_id: str, message: dict) -> int:
+        """Publica mensagem para todos conectados em um phone_number_id (não bloqueia)"""
+        return self.bus.publish(phone_number_id, dumps_text(message))
+    
+    def publish_global(self, message: dict) -> int:
+        """Publica mensagem para todos conectados globalmente (não bloqueia)"""
+        return self.bus.publish(GLOBAL_CHANNEL, dumps_text(message))
+    
+    def last_seq(self, phone_number_id: str = None) -> int:
+        """Última seq publicada no canal (base para o resume_from do cliente)"""
+        history = self.history.get(phone_number_id or GLOBAL_CHANNEL)
+        return history.last_seq if history else 0
+    
+    def resume(self, websocket: WebSocket, resume_from: int) -> int:
+        """
+        Reenvia ao cliente os eventos do canal posteriores a `resume_from`.
+        
+        Se algum já saiu do buffer (ou não cabe na fila), envia
+        resync_required e o cliente deve recarregar pelo REST.
+        Retorna quantos eventos foram reenviados.
+        """
+        client = self.clients.get(websocket)
+        if not client:
+            return 0
+        history = self.history.get(client.channel or GLOBAL_CHANNEL)
+        if history:
+            frames = history.since(resume_from)
+        else:
+            frames = [] if resume_from == 0 else None
+        
+        if frames is None or len(frames) > self.max_queue:
+            self.resyncs += 1
+            client.enqueue(encode({
+                "type": "resync_required",
+                "resume_from": resume_from,
+                "last_seq": history.last_seq if history else 0,
+                "message": "Eventos perdidos não estão mais disponíveis, recarregue os dados"
+            }, client.encoding))
+            return 0
+        
+        for data in frames:
+            client.enqueue(to_msgpack(data) if client.encoding == MSGPACK else data)
+        self.replayed += len(frames)
+        return len(frames)
+    
+    async def receive(self, websocket: WebSocket) -> Any:
+        """
+        Recebe a próxima mensagem do cliente (JSON ou MessagePack).
+        
+        Toda mensagem conta como atividade para o heartbeat; {"type": "pong"}
+        responde ao ping do servidor e {"type": "ping"} recebe um pong.
+        Levanta WebSocketDisconnect quando o cliente sai.
+        """
+        try:
+            message = await websocket.receive()
+        except RuntimeError:
+            # Socket já fechado pelo servidor (ex.: cliente removido pelo reaper)
+            raise WebSocketDisconnect(1006)
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        
+        data = message.get("text")
+        decoded = decode(data if data is not None else message.get("bytes"))
+        client = self.clients.get(websocket)
+        if client:
+            client.touch()
+            kind = decoded.get("type") if isinstance(decoded, dict) else None
+            if kind == "pong":
+                self.pongs += 1
+                client.pong(decoded.get("ts"))
+            elif kind == "ping":
+                client.enqueue(encode({"type": "pong", "ts": decoded.get("ts")}, client.encoding))
+        return decoded
+    
+    def heartbeat(self, idle_timeout: float) -> Tuple[int, int]:
+        """
+        Envia ping a todos e remove quem parou de responder.
+        
+        Só são removidos clientes que já responderam algum ping e estão há
+        mais de `idle_timeout` segundos sem mandar nada; clientes que não
+        implementam o pong dependem do ping do protocolo (uvicorn).
+        Retorna (pings enviados, clientes removidos).
+        """
+        now = time.monotonic()
+        ping = {"type": "ping", "ts": int(time.time() * 1000)}
+        frames = {encoding: encode(ping, encoding) for encoding in ENCODINGS}
+        pinged = reaped = 0
+        for client in list(self.clients.values()):
+            if client.pongs and now - client.last_seen > idle_timeout:
+                self.idle_evicted += 1
+                reaped += 1
+                client.close(f"sem resposta ao ping há {now - client.last_seen:.0f}s", IDLE_CLOSE_CODE)
+            elif client.enqueue(frames[client.encoding]):
+                pinged += 1
+        self.pings_sent += pinged
+        return pinged, reaped
+    
     async def broadcast_to_phone(self, phone_number_id: str, message: dict):
         """Envia mensagem para todos conectados em um phone_number_id"""
-        if phone_number_id in self.active_connections:
-            disconnected = set()
-            for connection in self.active_connections[phone_number_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    print(f"Erro ao enviar para {phone_number_id}: {e}")
-                    disconnected.add(connection)
-            
-            # Remove conexões mortas
-            for conn in disconnected:
-                self.active_connections[phone_number_id].discard(conn)
+        self.publish_to_phone(phone_number_id, message)
     
     async def broadcast_global(self, message: dict):
         """Envia mensagem para todos conectados globalmente"""
-        disconnected = set()
-        for connection in self.global_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Erro ao enviar globalmente: {e}")
-                disconnected.add(connection)
-        
-        # Remove conexões mortas
-        for conn in disconnected:
-            self.global_connections.discard(conn)
+        self.publish_global(message)
     
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """Envia mensagem para um cliente específico"""
+        client = self.clients.get(websocket)
+        if client:
+            client.enqueue(encode(message, client.encoding))
+            return
         try:
-            await websocket.send_json(message)
+            await websocket.send_text(dumps_text(message))
         except Exception as e:
             print(f"Erro ao enviar mensagem pessoal: {e}")
+    
+    def stats(self, slowest: int = 10) -> Dict[str, Any]:
+        clients = list(self.clients.values())
+        lagging = sorted(clients, key=lambda c: (c.lag_ms(), len(c.queue)), reverse=True)
+        closed_for = self._closed_seconds
+        return {
+            "channels": len(self.active_connections),
+            "connections": len(clients),
+            "peak_connections": self.peak_connections,
+            "heartbeat_connections": sum(1 for c in clients if c.pongs),
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "avg_connection_seconds": round(closed_for / self.disconnects, 1) if self.disconnects else None,
+            "churn": [
+                {
+                    "minute": datetime.fromtimestamp(minute * 60).strftime('%Y-%m-%d %H:%M'),
+                    "connects": connects,
+                    "disconnects": disconnects,
+                }
+                for minute, connects, disconnects in self._churn
+            ],
+            "global_connections": len(self.global_connections),
+            "msgpack_connections": sum(1 for c in clients if c.encoding == MSGPACK),
+            "send_timeout": self.send_timeout,
+            "queue_size": self.max_queue,
+            "queue_policy": self.policy,
+            "broadcasts": self.broadcasts,
+            "frames_queued": self.frames_queued,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "frames_pending": sum(len(c.queue) for c in clients),
+            "send_errors": self.send_errors,
+            "send_timeouts": self.send_timeouts,
+            "evicted": self.evicted,
+            "idle_evicted": self.idle_evicted,
+            "pings_sent": self.pings_sent,
+            "pongs": self.pongs,
+            "replay_channels": len(self.history),
+            "replayed": self.replayed,
+            "resyncs": self.resyncs,
+            "max_lag_ms": round(lagging[0].lag_ms(), 2) if lagging else 0.0,
+            "slowest": [c.stats() for c in lagging[:slowest]],
+            "bus": self.bus.stats(),
+        }
 
 # Instância global
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
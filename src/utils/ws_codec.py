@@ -0,0 +1,51 @@
+from typing import Any, Optional, Tuple, Union
+import msgpack
+import orjson
+from fastapi import WebSocket
+from src.utils.fast_json import dumps, dumps_text
+
+# Codificações dos frames WebSocket (query ?encoding= ou subprotocolo)
+JSON = "json"
+MSGPACK = "msgpack"
+ENCODINGS = (JSON, MSGPACK)
+
+Frame = Union[str, bytes]
+
+
+def negotiate(websocket: WebSocket, requested: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Escolhe a codificação da conexão: (codificação, subprotocolo a aceitar).
+
+    O subprotocolo oferecido pelo cliente (Sec-WebSocket-Protocol: msgpack
+    ou json) precisa ser aceito para o navegador abrir a conexão; o
+    parâmetro ?encoding= tem prioridade sobre ele. Sem nenhum dos dois, JSON.
+    """
+    offered = [p.strip().lower() for p in websocket.scope.get("subprotocols") or []]
+    subprotocol = next((p for p in offered if p in ENCODINGS), None)
+    encoding = (requested or subprotocol or JSON).lower()
+    if encoding not in ENCODINGS:
+        encoding = JSON
+    return encoding, subprotocol
+
+
+def to_msgpack(data: str) -> bytes:
+    """Converte um frame JSON já serializado (com seq) para MessagePack"""
+    return msgpack.packb(orjson.loads(data))
+
+
+def decode(data: Optional[Frame]) -> Any:
+    """Lê uma mensagem do cliente (texto JSON ou MessagePack); None se inválida"""
+    if data is None:
+        return None
+    try:
+        return msgpack.unpackb(data) if isinstance(data, bytes) else orjson.loads(data)
+    except Exception:
+        return None
+
+
+def encode(message: Any, encoding: str = JSON) -> Frame:
+    """Serializa uma mensagem na codificação da conexão (texto JSON ou binário MessagePack)"""
+    if encoding == MSGPACK:
+        # Passa pelo orjson para datetime e afins saírem iguais ao JSON
+        return msgpack.packb(orjson.loads(dumps(message)))
+    return dumps_text(message)
@@ -0,0 +1,48 @@
+import os
+from typing import Any, Dict
+from dotenv import load_dotenv
+from src.utils.websocket_manager import manager
+from src.utils.scheduler import PeriodicTask
+
+load_dotenv()
+
+# Intervalo do ping de aplicação (segundos; 0 desliga) e silêncio tolerado antes de remover
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL") or 20)
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT") or 60)
+
+
+class WebSocketHeartbeat(PeriodicTask):
+    """
+    Ping de aplicação ({"type": "ping", "ts": ...}) para todas as conexões
+    WebSocket e remoção das que pararam de responder com pong.
+
+    Complementa o ping do protocolo (uvicorn), que derruba conexões
+    meio-abertas: este mede o RTT e detecta clientes travados.
+    """
+
+    name = "ws_heartbeat"
+
+    def __init__(self, interval: float = WS_PING_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT):
+        super().__init__(interval)
+        self.idle_timeout = max(interval * 2, idle_timeout)
+        self.reaped = 0
+        self.last_pinged = 0
+
+    async def run_once(self) -> None:
+        pinged, reaped = manager.heartbeat(self.idle_timeout)
+        self.last_pinged = pinged
+        self.reaped += reaped
+        if reaped:
+            print(f"⚠ Heartbeat: {reaped} conexões WebSocket sem resposta removidas")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "idle_timeout_s": self.idle_timeout,
+            "last_pinged": self.last_pinged,
+            "reaped": self.reaped,
+        }
+
+
+# Instância global
+ws_heartbeat = WebSocketHeartbeat()